@@ -1,9 +1,22 @@
 """
 This is the top directory of the SAGA package
+
+Subpackages and the classes below are imported on first use, so that
+`import SAGA` is fast.
 """
+from .utils.lazy import lazy_attributes
 
-from .database import Database
-from .hosts import HostCatalog
-from .objects import ObjectCatalog, ObjectCuts
+__version__ = '0.2.0'
 
-__version__ = '0.2.0'
\ No newline at end of file
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    'Database': ('.database', 'Database'),
+    'HostCatalog': ('.hosts', 'HostCatalog'),
+    'ObjectCatalog': ('.objects', 'ObjectCatalog'),
+    'ObjectCuts': ('.objects', 'ObjectCuts'),
+    'database': ('.database', None),
+    'hosts': ('.hosts', None),
+    'objects': ('.objects', None),
+    'spectra': ('.spectra', None),
+    'targets': ('.targets', None),
+    'utils': ('.utils', None),
+})
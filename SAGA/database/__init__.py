@@ -5,3 +5,9 @@ This subpackage contains database-related routines, including Database
 """
 
 from .database import (Database, GoogleSheets, FitsTable, DataObject)
+from .table_cache import TableCache
+from .tiled_fits import (write_tiled_fits, read_tiled_fits, convert_to_tiled_fits)
+from .spectra_store import (SpectraStore, select_spectra)
+from .sky_partition import SkyPartitionedCatalog
+from .shared_memory import (CatalogServer, SharedMemoryTable, attach_shared_tables)
+from .arrow import (ParquetTable, ParquetDataset, table_to_arrow, table_from_arrow, to_record_batches, query_to_arrow_filter)
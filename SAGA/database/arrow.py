@@ -0,0 +1,466 @@
+"""
+SAGA.database.arrow
+
+Arrow/Parquet support (requires pyarrow)
+"""
+import os
+import ast
+import re
+import json
+import numpy as np
+from ..utils import atomic_output_file, lazy_import
+from .database import DataObject
+
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+pads = lazy_import('pyarrow.dataset')
+
+__all__ = ['table_to_arrow', 'table_from_arrow', 'to_record_batches', 'query_to_arrow_filter',
+           'ParquetTable', 'ParquetDataset']
+
+_compare_ops = {ast.Lt: '__lt__', ast.LtE: '__le__', ast.Gt: '__gt__', ast.GtE: '__ge__', ast.Eq: '__eq__', ast.NotEq: '__ne__'}
+_arithmetic_ops = {ast.Add: '__add__', ast.Sub: '__sub__', ast.Mult: '__mul__', ast.Div: '__truediv__'}
+
+
+def _check_pyarrow():
+    try:
+        import pyarrow  # pylint: disable=unused-import
+    except ImportError:
+        raise ImportError('Arrow/Parquet support requires pyarrow; install it with `pip install pyarrow`')
+
+
+def _column_to_arrow(col):
+    values = np.ma.getdata(col)
+    if values.dtype.byteorder not in ('=', '|'):
+        # arrow only has native byte order (tables read with astropy from fits files are big-endian;
+        # FitsTable converts them when reading)
+        values = values.astype(values.dtype.newbyteorder('='))
+    mask = np.ma.getmask(col) if getattr(col, 'mask', None) is not None else np.ma.nomask
+    mask = None if mask is np.ma.nomask or not mask.any() else np.ascontiguousarray(mask)
+
+    if values.ndim > 1:
+        # stored as fixed-size lists of the flattened values (see `table_to_arrow`)
+        list_size = int(np.prod(values.shape[1:]))
+        flat_mask = None if mask is None else mask.reshape(-1)
+        flat = pa.array(np.ascontiguousarray(values).reshape(-1), mask=flat_mask)
+        return pa.FixedSizeListArray.from_arrays(flat, list_size)
+
+    if values.dtype.kind == 'S':
+        return pa.array(values, pa.binary(), mask=mask).cast(pa.string())
+    # numeric columns without a mask are not copied
+    return pa.array(values, mask=mask)
+
+
+def table_to_arrow(table):
+    """
+    Convert an astropy table to an Arrow table. Numeric columns in native
+    byte order without masks are not copied. Units, descriptions and the
+    dtypes of bytes columns are kept as field metadata.
+
+    Parameters
+    ----------
+    table : astropy.table.Table
+
+    Returns
+    -------
+    arrow_table : pyarrow.Table
+    """
+    _check_pyarrow()
+    arrays = []
+    fields = []
+    for name in table.colnames:
+        col = table[name]
+        arr = _column_to_arrow(col)
+        metadata = {}
+        if getattr(col, 'unit', None) is not None:
+            metadata['unit'] = str(col.unit)
+        if getattr(col, 'description', None):
+            metadata['description'] = col.description
+        if col.ndim > 2:
+            metadata['shape'] = json.dumps(col.shape[1:])
+        if col.dtype.kind == 'S':
+            # stored as Arrow strings, and converted back to bytes by `table_from_arrow`
+            metadata['dtype'] = col.dtype.str
+        arrays.append(arr)
+        fields.append(pa.field(name, arr.type, metadata=metadata or None))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def to_record_batches(table, max_chunksize=None):
+    """
+    Convert an astropy table (e.g. from `ObjectCatalog.load`) to a list of
+    Arrow record batches of at most `max_chunksize` rows (see `table_to_arrow`).
+
+    Returns
+    -------
+    batches : list of pyarrow.RecordBatch
+    """
+    return table_to_arrow(table).to_batches(max_chunksize)
+
+
+def _column_from_arrow(arr):
+    mask = None
+    if arr.null_count:
+        mask = arr.is_null().to_numpy(zero_copy_only=False)
+
+    if pa.types.is_fixed_size_list(arr.type):
+        size = arr.type.list_size
+        values, child_mask = _column_from_arrow(arr.values.slice(arr.offset * size, len(arr) * size))
+        values = values.reshape(len(arr), size)
+        if mask is not None:
+            mask = np.repeat(mask[:, np.newaxis], size, axis=1)
+            if child_mask is not None:
+                mask |= child_mask.reshape(values.shape)
+        elif child_mask is not None:
+            mask = child_mask.reshape(values.shape)
+        return values, mask
+
+    if mask is not None:
+        if pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type):
+            fill = ''
+        elif pa.types.is_binary(arr.type):
+            fill = b''
+        elif pa.types.is_boolean(arr.type):
+            fill = False
+        else:
+            fill = 0
+        arr = arr.fill_null(pa.scalar(fill, arr.type))
+
+    values = arr.to_numpy(zero_copy_only=False)
+    if values.dtype.hasobject:
+        values = values.astype(bytes if pa.types.is_binary(arr.type) else str)
+    elif not values.flags.writeable:
+        # the build functions modify tables in place
+        values = values.copy()
+    return values, mask
+
+
+def table_from_arrow(arrow_table):
+    """
+    Convert an Arrow table to an astropy table. Null values become masked
+    entries. String columns are unicode, except those written by
+    `table_to_arrow` from bytes columns.
+
+    Parameters
+    ----------
+    arrow_table : pyarrow.Table
+
+    Returns
+    -------
+    table : astropy.table.Table
+    """
+    from astropy.table import Table, Column, MaskedColumn
+    columns = []
+    for field, chunked in zip(arrow_table.schema, arrow_table.columns):
+        values, mask = _column_from_arrow(chunked.combine_chunks())
+        metadata = {k.decode(): v.decode() for k, v in (field.metadata or {}).items()}
+        if 'shape' in metadata:
+            values = values.reshape((len(values),) + tuple(json.loads(metadata['shape'])))
+            mask = None if mask is None else mask.reshape(values.shape)
+        if 'dtype' in metadata:
+            values = values.astype(metadata['dtype'])
+        kwargs = dict(name=field.name, unit=metadata.get('unit'), description=metadata.get('description'), copy=False)
+        columns.append(Column(values, **kwargs) if mask is None else MaskedColumn(values, mask=mask, **kwargs))
+    return Table(columns, copy=False)
+
+
+def _expression_to_arrow(node, names):
+    """
+    convert a python expression (ast node) to an Arrow expression;
+    return None if it cannot be converted
+    """
+    if isinstance(node, ast.Name):
+        return pads.field(node.id) if node.id in names else None
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        operand = _expression_to_arrow(node.operand, names)
+        if operand is None:
+            return None
+        return -operand if not isinstance(operand, pads.Expression) else pads.scalar(0) - operand
+    if isinstance(node, ast.BinOp) and type(node.op) in _arithmetic_ops:
+        left = _expression_to_arrow(node.left, names)
+        right = _expression_to_arrow(node.right, names)
+        if left is None or right is None:
+            return None
+        if not isinstance(left, pads.Expression):
+            left = pads.scalar(left)
+        if isinstance(node.op, ast.Div):
+            # true division, as in numpy (Arrow divides integers as integers)
+            left = left.cast(pa.float64())
+            if isinstance(right, pads.Expression):
+                right = right.cast(pa.float64())
+        return getattr(left, _arithmetic_ops[type(node.op)])(right)
+    return None
+
+
+def _condition_to_arrow(node, names):
+    """
+    convert a python condition (ast node) to an Arrow filter expression;
+    return (expression, exact), or None if it cannot be converted.
+    `exact` is False if the query needs to be applied again to the rows.
+    """
+    if isinstance(node, ast.Compare):
+        parts = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            if type(op) not in _compare_ops:
+                return None
+            a = _expression_to_arrow(left, names)
+            b = _expression_to_arrow(right, names)
+            if a is None or b is None:
+                return None
+            if not isinstance(a, pads.Expression):
+                a = pads.scalar(a)
+            parts.append(getattr(a, _compare_ops[type(op)])(b))
+            left = right
+        expr = parts[0]
+        for part in parts[1:]:
+            expr = expr & part
+        # divisions may round differently (or divide by zero) in Arrow
+        return expr, not any(isinstance(n, ast.Div) for n in ast.walk(node))
+
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+        return _combine_conditions('AND' if isinstance(node.op, ast.BitAnd) else 'OR',
+                                   [_condition_to_arrow(n, names) for n in (node.left, node.right)])
+    if isinstance(node, ast.BoolOp):
+        return _combine_conditions('AND' if isinstance(node.op, ast.And) else 'OR',
+                                   [_condition_to_arrow(n, names) for n in node.values])
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Invert, ast.Not)):
+        converted = _condition_to_arrow(node.operand, names)
+        if converted is None or not converted[1]:
+            return None
+        return ~converted[0], True
+    return None
+
+
+def _combine_conditions(operator, converted):
+    if operator == 'AND':
+        # unconvertible operands are dropped, which gives a superset
+        kept = [c for c in converted if c is not None]
+        if not kept:
+            return None
+        expr = kept[0][0]
+        for c in kept[1:]:
+            expr = expr & c[0]
+        return expr, len(kept) == len(converted) and all(c[1] for c in kept)
+    if any(c is None for c in converted):
+        return None
+    expr = converted[0][0]
+    for c in converted[1:]:
+        expr = expr | c[0]
+    return expr, all(c[1] for c in converted)
+
+
+def _query_to_arrow(query, names):
+    # pylint: disable=protected-access
+    if query._operator is None:
+        operand = query._operands
+        if isinstance(operand, str):
+            try:
+                node = ast.parse(operand.strip(), mode='eval').body
+            except SyntaxError:
+                return None
+            return _condition_to_arrow(node, names)
+        return None
+    if query._operator == 'NOT':
+        converted = _query_to_arrow(query._operands, names)
+        if converted is None or not converted[1]:
+            return None
+        return ~converted[0], True
+    if query._operator in ('AND', 'OR'):
+        return _combine_conditions(query._operator, [_query_to_arrow(op, names) for op in query._operands])
+    return None
+
+
+def query_to_arrow_filter(query, names):
+    """
+    Convert an easyquery Query to an Arrow filter expression. The parts of
+    the query that cannot be converted (e.g. callables) are left out, so
+    apply `query` to the filtered rows to get the exact result.
+    Returns None if nothing can be converted.
+
+    Parameters
+    ----------
+    query : easyquery.Query, str, tuple, or None
+    names : iterable of str
+        names of the columns in the dataset
+
+    Returns
+    -------
+    expression : pyarrow.dataset.Expression or None
+    """
+    from easyquery import Query
+    _check_pyarrow()
+    converted = _query_to_arrow(Query(query), set(names))
+    return None if converted is None else converted[0]
+
+
+class ParquetTable(DataObject):
+    """
+    A table stored in a Parquet file. Only the requested columns are read.
+
+    Examples
+    --------
+    >>> saga_database['spectra_clean'] = SAGA.database.ParquetTable('saga_spectra_clean.parquet')
+    """
+    def __init__(self, path, compression='zstd'):
+        self._path = path
+        self._compression = compression
+
+    def get_version(self):
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        return (self._path, stat.st_mtime_ns, stat.st_size)
+
+    def _read(self, columns=None):
+        _check_pyarrow()
+        return table_from_arrow(pq.read_table(self._path, columns=None if columns is None else list(columns)))
+
+    def _write(self, table, overwrite=False):
+        _check_pyarrow()
+        if overwrite or not os.path.isfile(self._path):
+            with atomic_output_file(self._path) as f:
+                pq.write_table(table_to_arrow(table), f, compression=self._compression)
+
+
+class ParquetDataset(DataObject):
+    """
+    A catalog stored as a Parquet dataset partitioned by host, in
+    `root_dir/HOST_NSAID=<host id>/part-0.parquet`.
+
+    Parameters
+    ----------
+    root_dir : str
+    compression : str, optional
+        Parquet compression codec (default: 'zstd')
+    row_group_size : int, optional
+        number of rows per row group; smaller row groups allow more rows to
+        be skipped by a filter (default: 65536)
+
+    Examples
+    --------
+    >>> dataset = saga_database['base_parquet']
+    >>> dataset.add_table(saga_database['base', 61945].read(), 61945)
+    >>> t = dataset.scan(columns=['RA', 'DEC', 'r'], cuts='r < 20.75', hosts=[61945])
+    """
+    partition_column = 'HOST_NSAID'
+
+    def __init__(self, root_dir, compression='zstd', row_group_size=65536):
+        self._root_dir = root_dir
+        self._compression = compression
+        self._row_group_size = int(row_group_size)
+
+    def _host_dir(self, host_id):
+        return os.path.join(self._root_dir, '{}={}'.format(self.partition_column, int(host_id)))
+
+    def _files(self):
+        if not os.path.isdir(self._root_dir):
+            return []
+        pattern = re.compile(r'^{}=(-?\d+)$'.format(self.partition_column))
+        files = []
+        for d in sorted(os.listdir(self._root_dir)):
+            if pattern.match(d):
+                host_dir = os.path.join(self._root_dir, d)
+                files.extend(os.path.join(host_dir, f) for f in sorted(os.listdir(host_dir)) if f.endswith('.parquet'))
+        return files
+
+    def exists(self):
+        return bool(self._files())
+
+    @property
+    def hosts(self):
+        """host IDs in the dataset"""
+        return sorted({int(os.path.basename(os.path.dirname(f)).partition('=')[2]) for f in self._files()})
+
+    def get_version(self):
+        stats = []
+        for path in self._files():
+            stat = os.stat(path)
+            stats.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(stats) if stats else None
+
+    def add_table(self, table, host_id, overwrite=False):
+        """
+        Write `table` (the base catalog of one host) as the partition of `host_id`.
+        """
+        _check_pyarrow()
+        path = os.path.join(self._host_dir(host_id), 'part-0.parquet')
+        if os.path.isfile(path) and not overwrite:
+            raise ValueError('host {} is already in the dataset'.format(host_id))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if self.partition_column in table.colnames:
+            table = table[[c for c in table.colnames if c != self.partition_column]]
+        with atomic_output_file(path) as f:
+            pq.write_table(table_to_arrow(table), f, compression=self._compression, row_group_size=self._row_group_size)
+
+    def _dataset(self):
+        files = self._files()
+        if not files:
+            raise ValueError('the Parquet dataset {} is empty'.format(self._root_dir))
+        partitioning = pads.partitioning(pa.schema([pa.field(self.partition_column, pa.int64())]), flavor='hive')
+        return pads.dataset(files, format='parquet', partitioning=partitioning,
+                            partition_base_dir=self._root_dir)
+
+    def scan(self, columns=None, cuts=None, hosts=None, apply_cuts=True, as_arrow=False):
+        """
+        Read the rows that pass `cuts` from the partitions of `hosts`.
+        The parts of `cuts` that can be converted to Arrow filters are
+        applied while reading.
+
+        Parameters
+        ----------
+        columns : list, optional
+        cuts : easyquery.Query, str, tuple, optional
+        hosts : list, optional
+            host IDs (default: all)
+        apply_cuts : bool, optional
+            If set to False, `cuts` is only used to skip rows while reading,
+            and the result may have rows that do not pass `cuts` (e.g. when
+            `cuts` uses columns that are computed after reading)
+        as_arrow : bool, optional
+            If set to True, return a pyarrow.Table (`cuts` must then be
+            fully convertible to an Arrow filter)
+
+        Returns
+        -------
+        objects : astropy.table.Table or pyarrow.Table
+        """
+        from easyquery import Query
+        _check_pyarrow()
+        dataset = self._dataset()
+        names = dataset.schema.names
+
+        expr = None
+        if hosts is not None:
+            expr = pads.field(self.partition_column).isin([int(h) for h in hosts])
+        converted = _query_to_arrow(Query(cuts), set(names))
+        if converted is not None:
+            expr = converted[0] if expr is None else expr & converted[0]
+        exact = cuts is None or not apply_cuts or (converted is not None and converted[1])
+
+        read_columns = None if columns is None else list(columns)
+        if read_columns is not None and not exact:
+            read_columns.extend(c for c in Query(cuts).variable_names if c not in read_columns and c in names)
+        arrow_table = dataset.to_table(columns=read_columns, filter=expr)
+
+        if as_arrow:
+            if not exact:
+                raise ValueError('cuts cannot be fully converted to Arrow filters; use as_arrow=False')
+            return arrow_table
+        t = table_from_arrow(arrow_table)
+        del arrow_table
+        if not exact:
+            t = Query(cuts).filter(t)
+        return t if columns is None else t[list(columns)]
+
+    def _read(self, columns=None):
+        return self.scan(columns=columns)
+
+    def _write(self, table, overwrite=False):
+        host_ids = np.asarray(table[self.partition_column])
+        for host_id in np.unique(host_ids):
+            self.add_table(table[host_ids == host_id], int(host_id), overwrite=overwrite)
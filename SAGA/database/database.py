@@ -1,33 +1,138 @@
 import os
-from astropy.table import Table
-from ..utils import gzip_compress
+import threading
+import numpy as np
+from ..utils import atomic_output_file, profile_stage, lazy_import, SingleFlight
+from .tiled_fits import read_tiled_fits, write_tiled_fits
+from .table_cache import TableCache
+
+# astropy is imported on first use, so that creating a Database is fast
+fits = lazy_import('astropy.io.fits')
+
+# concurrent reads of the same data object (and columns) share one read
+_reads_in_flight = SingleFlight()
+
+
+def _to_native_byte_order(table):
+    """
+    convert the big-endian columns of a table read from a fits file to
+    native byte order, once, so that they can be used (e.g. by Arrow)
+    without further copies
+    """
+    for name in table.colnames:
+        col = table[name]
+        if not col.dtype.isnative:
+            table.replace_column(name, col.astype(col.dtype.newbyteorder('=')), copy=False)
+    return table
 
 class DataObject(object):
+    """
+    Base class of the tables in a Database. `read` can be called from
+    several threads: concurrent reads of the same table share one read.
+    """
     _table = None
     _keep_table_default = False
+    _cache = None
+    _cache_name = None
 
-    def _read(self):
+    def _read(self, columns=None):
         raise NotImplementedError
 
     def _write(self, table, overwrite):
         raise NotImplementedError
 
-    def read(self, reload=False, keep=None):
-        if reload or self._table is None:
-            table = self._read()
-            if keep is None:
-                keep = self._keep_table_default
-            if keep:
-                self._table = table
-        else:
-            table = self._table
+    def attach_cache(self, cache, name):
+        """
+        Use `cache` (a SAGA.database.TableCache, usually the one of a
+        Database) to keep the tables read, under the name `name`.
+        Data objects that keep their table by default are pinned.
+        """
+        self._cache = cache
+        self._cache_name = name
+        if cache is not None and self._keep_table_default:
+            cache.pin(name)
+
+    def read(self, reload=False, keep=None, columns=None):
+        if keep is None:
+            keep = self._keep_table_default
+        if self._cache is not None:
+            return self._read_cached(reload, keep, columns)
+        table = self._table
+        if reload or table is None:
+            columns_to_read = None if keep else columns
+
+            def load():
+                if keep and not reload and self._table is not None:
+                    return self._table
+                table = self._read_profiled(columns_to_read)
+                if keep:
+                    self._table = table
+                return table
+
+            key = (self, keep, None if columns_to_read is None else tuple(columns_to_read))
+            table, shared = _reads_in_flight.do(key, load)
+            if shared and not keep:
+                table = table.copy()
+        if columns is not None and table.colnames != list(columns):
+            table = table[list(columns)]
         return table
 
+    def _read_profiled(self, columns):
+        with profile_stage('{}.read'.format(type(self).__name__)) as stage:
+            table = self._read(columns)
+            stage.rows_out = len(table)
+        return table
+
+    def _read_cached(self, reload, keep, columns):
+        if keep:
+            self._cache.pin(self._cache_name)
+        if self._cache.is_pinned(self._cache_name):
+            # pinned tables are read with all columns, so that they serve all requests
+            columns_to_read = None
+        else:
+            columns_to_read = columns
+        version = self.get_version()
+        if not reload:
+            table = self._cache.get(self._cache_name, version, columns)
+            if table is not None:
+                return table
+
+        def load():
+            if not reload:
+                # another thread may have finished reading since the lookup above
+                table = self._cache.get(self._cache_name, version, columns_to_read, count=False)
+                if table is not None:
+                    return table, False  # already a copy
+            table = self._read_profiled(columns_to_read)
+            return table, self._cache.put(self._cache_name, version, table, columns_to_read)
+
+        key = (self, version, None if columns_to_read is None else tuple(columns_to_read))
+        (table, cached), shared = _reads_in_flight.do(key, load)
+        if columns is not None and table.colnames != list(columns):
+            return table[list(columns)]
+        # only tables that are kept by the cache or shared with other callers are copied
+        return table.copy() if cached or shared else table
+
+    def read_rows(self, rows, columns=None):
+        """
+        return the rows with indices `rows` (in the stored table); subclasses
+        may override this to avoid reading the whole table
+        """
+        return self.read(columns=columns)[rows]
+
     def write(self, table, overwrite=False):
         self._write(table, overwrite)
 
+    def get_version(self):
+        """
+        return a hashable value that changes when the underlying data change,
+        or None if this cannot be determined
+        """
+        return None
+
     def clear(self):
         self._table = None
+        if self._cache is not None:
+            self._cache.discard(self._cache_name)
 
 
 class GoogleSheets(DataObject):
@@ -37,24 +142,53 @@ class GoogleSheets(DataObject):
         self._url = 'https://docs.google.com/spreadsheets/d/{0}/export?format=csv&gid={1}'.format(key, gid)
         self._kwargs = kwargs
 
-    def _read(self):
+    def _read(self, columns=None):
+        from astropy.table import Table
         return Table.read(self._url, format='ascii.csv', **self._kwargs)
 
 
 class FitsTable(DataObject):
-    def __init__(self, path, compress_after_write=True):
+    """
+    A table stored in a fits file. Paths ending with ".fz" are written as
+    tile-compressed fits files (see `SAGA.database.tiled_fits`), which allow
+    reading a subset of columns without decompressing the whole file.
+    """
+    def __init__(self, path, compress_after_write=True, compress_threads=1):
         self._path = path
         self._compress_after_write = compress_after_write
-
-    def _read(self):
-        return Table.read(self._path, format='fits')
+        self._compress_threads = compress_threads
+
+    def get_version(self):
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        return (self._path, stat.st_mtime_ns, stat.st_size)
+
+    def _read(self, columns=None):
+        if self._path.endswith('.fz'):
+            return _to_native_byte_order(read_tiled_fits(self._path, columns))
+        from astropy.table import Table
+        return _to_native_byte_order(Table.read(self._path, format='fits'))
+
+    def read_rows(self, rows, columns=None):
+        if self._table is not None or not self._path.endswith('.fits'):
+            return super(FitsTable, self).read_rows(rows, columns)
+        # uncompressed fits files are memory-mapped, so that only the requested rows are read
+        from astropy.table import Table
+        with fits.open(self._path, memmap=True) as hdul:
+            hdu = hdul[1]
+            table = _to_native_byte_order(Table.read(fits.BinTableHDU(data=hdu.data[np.asarray(rows)], header=hdu.header)))
+        return table if columns is None else table[list(columns)]
 
     def _write(self, table, overwrite=False):
         if overwrite or not os.path.isfile(self._path):
-            tmp_path = self._path + ('_tmp.fits' if self._compress_after_write else '')
-            table.write(tmp_path, format='fits', overwrite=True)
-            if self._compress_after_write:
-                gzip_compress(tmp_path, self._path)
+            if self._path.endswith('.fz'):
+                write_tiled_fits(table, self._path, overwrite=True)
+                return
+            # stream the fits bytes directly into the (compressed) output file
+            with atomic_output_file(self._path, self._compress_after_write, self._compress_threads) as f:
+                table.write(f, format='fits')
 
 
 class Database(object):
@@ -67,6 +201,20 @@ class Database(object):
     root_dir : str, optional
         path to the shared SAGA Dropbox root directory
         if you don't have access, set to None.
+    compress_threads : int, optional
+        number of threads used to compress fits files when writing
+        (default: 1). Values larger than 1 write multi-member gzip files,
+        which any gzip reader can read.
+    cache_bytes : int, optional
+        memory budget (in bytes) of the table cache shared by all data
+        objects (default: 1 GB; see `SAGA.database.TableCache`).
+        Set to None to disable the cache (tables are read every time,
+        except the Google Sheets, which are kept).
+
+    Notes
+    -----
+    A Database can be shared between threads. Concurrent reads of the same
+    table (e.g. the first accesses from a thread pool) share one read.
 
     Examples
     --------
@@ -74,6 +222,8 @@ class Database(object):
     >>> saga_database = SAGA.Database('/path/to/SAGA/Dropbox')
     >>> saga_hosts = SAGA.HostCatalog(saga_database)
     >>> saga_objects = SAGA.ObjectCatalog(saga_database)
+    >>> saga_database.cache.pin('spectra_clean')   # never evict the spectra
+    >>> saga_database.cache.stats()
 
 
     If you don't have access to SAGA Dropbox, you can do:
@@ -85,11 +235,14 @@ class Database(object):
     >>> saga_objects = SAGA.ObjectCatalog(saga_database)
 
     """
-    def __init__(self, root_dir=None):
+    def __init__(self, root_dir=None, compress_threads=1, cache_bytes=(1 << 30)):
         if root_dir is not None and not os.path.isdir(root_dir):
             raise ValueError('cannot locate {}'.format(root_dir))
 
         self._root_dir = root_dir
+        self._compress_threads = compress_threads
+        self.cache = None if cache_bytes is None else TableCache(cache_bytes)
+        self._lock = threading.RLock()
 
         self._tables = {
             'hosts_named': GoogleSheets('1GJYuhqfKeuJr-IyyGF_NDLb_ezL6zBiX2aeZFHHPr_s', 0, include_names=['SAGA', 'NSA', 'NGC']),
@@ -100,20 +253,96 @@ class Database(object):
         }
 
         if self._root_dir is not None:
-            self._tables['spectra_clean'] = FitsTable(os.path.join(self._root_dir, 'data', 'saga_spectra_clean.fits.gz'))
+            # these modules depend on this one
+            from .spectra_store import SpectraStore
+            from .sky_partition import SkyPartitionedCatalog
+            from .arrow import ParquetDataset
+            path = self._find_fits_file(os.path.join(self._root_dir, 'data', 'saga_spectra_clean'))
+            self._tables['spectra_clean'] = self._fits_table(path or os.path.join(self._root_dir, 'data', 'saga_spectra_clean.fits.gz'))
+            self._tables['spectra_store'] = SpectraStore(os.path.join(self._root_dir, 'data', 'saga_spectra_store'))
+            self._tables['base_healpix'] = SkyPartitionedCatalog(os.path.join(self._root_dir, 'base_catalogs', 'healpix'))
+            self._tables['base_parquet'] = ParquetDataset(os.path.join(self._root_dir, 'base_catalogs', 'parquet'))
+            self._tables['objid_index'] = FitsTable(os.path.join(self._root_dir, 'base_catalogs', 'objid_index.fits'), compress_after_write=False)
+
+        for key, value in self._tables.items():
+            value.attach_cache(self.cache, key)
+
+    def _fits_table(self, path):
+        return FitsTable(path, compress_threads=self._compress_threads)
+
+    @staticmethod
+    def _find_fits_file(path_without_ext):
+        """
+        return the path to a tile-compressed (.fits.fz) or gzipped (.fits.gz)
+        file, in this order of preference, or None if neither exists
+        """
+        for ext in ('.fits.fz', '.fits.gz'):
+            if os.path.isfile(path_without_ext + ext):
+                return path_without_ext + ext
 
     def __getitem__(self, key):
-        if key in self._tables:
+        try:
             return self._tables[key]
-
-        if isinstance(key, tuple) and len(key) == 2 and key[0] == 'base':
-            path = os.path.join(self._root_dir, 'base_catalogs', 'base_sql_nsa{}.fits.gz'.format(key[1]))
-            if os.path.isfile(path):
-                self._tables[key] = FitsTable(path)
-                return self._tables[key]
+        except KeyError:
+            pass
+
+        if isinstance(key, tuple) and len(key) == 2 and key[0] == 'base' and self._root_dir is not None:
+            with self._lock:
+                # another thread may have registered it in the meantime
+                if key in self._tables:
+                    return self._tables[key]
+                path = os.path.join(self._root_dir, 'base_catalogs', 'base_sql_nsa{}'.format(key[1]))
+                fits_path = self._find_fits_file(path)
+                if fits_path is not None:
+                    self[key] = self._fits_table(fits_path)
+                    return self._tables[key]
+                if os.path.isfile(path + '.parquet'):
+                    from .arrow import ParquetTable
+                    self[key] = ParquetTable(path + '.parquet')
+                    return self._tables[key]
 
         raise KeyError('cannot find {} in database'.format(key))
 
+    def __setitem__(self, key, value):
+        """
+        register a DataObject under `key`, e.g. to use local files instead of
+        the Google Sheets (for offline use)
+
+        Examples
+        --------
+        >>> saga_database['hosts_no_flags'] = SAGA.database.FitsTable('hosts_no_flags.fits')
+        """
+        if not isinstance(value, DataObject):
+            raise TypeError('value must be an instance of DataObject')
+        with self._lock:
+            if key in self._tables and self.cache is not None:
+                self.cache.discard(key)
+            value.attach_cache(self.cache, key)
+            self._tables[key] = value
+
+    def attach_shared_tables(self, name):
+        """
+        Use the tables published in shared memory by a
+        `SAGA.database.CatalogServer` (in another local process) instead of
+        reading them. The tables are read-only and are not copied.
+
+        Parameters
+        ----------
+        name : str
+            name of the CatalogServer (`server.name`)
+
+        Returns
+        -------
+        keys : list
+            keys of the attached tables
+        """
+        # this module depends on this one
+        from .shared_memory import attach_shared_tables
+        tables = attach_shared_tables(name)
+        for key, value in tables.items():
+            self[key] = value
+        return list(tables)
+
     def set_base_fits_file_path(self, host_nsa_id, path):
         """
         this function should not be used, but just in case you don't
@@ -128,7 +357,7 @@ class Database(object):
             path to the fits (or fits.gz) file
         """
         if os.path.isfile(path):
-            self._tables[('base', int(host_nsa_id))] = FitsTable(path)
+            self[('base', int(host_nsa_id))] = self._fits_table(path)
 
     def set_spectra_clean_fits_file_path(self, path):
         """
@@ -141,5 +370,5 @@ class Database(object):
             path to the fits (or fits.gz) file
         """
         if os.path.isfile(path):
-            self._tables['spectra_clean'] = FitsTable(path)
+            self['spectra_clean'] = self._fits_table(path)
 
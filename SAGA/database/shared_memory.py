@@ -0,0 +1,238 @@
+"""
+Sharing tables between local processes through shared memory
+(requires Python 3.8 for multiprocessing.shared_memory).
+"""
+import os
+import json
+import mmap
+import secrets
+import threading
+import numpy as np
+from .database import DataObject
+
+__all__ = ['CatalogServer', 'SharedMemoryTable', 'attach_shared_tables']
+
+_schema_version = 1
+
+# blocks attached by this process; they stay mapped until the process exits,
+# since tables returned earlier may still use them
+_attached_blocks = dict()
+_attached_lock = threading.Lock()
+_windows_handles = []
+
+
+def _create_block(name, size):
+    from multiprocessing import shared_memory
+    return shared_memory.SharedMemory(name=name, create=True, size=max(int(size), 1))
+
+
+def _open_block(name):
+    """
+    Map the shared memory block `name` read-only and return a buffer.
+    The block is not registered with the resource tracker (which would
+    unlink it when this process exits).
+    """
+    if os.name == 'nt':
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=name)
+        _windows_handles.append(shm)  # closing the handle would invalidate the buffer
+        return shm.buf
+    import _posixshmem
+    fd = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0o600)
+    try:
+        return mmap.mmap(fd, os.fstat(fd).st_size, prot=mmap.PROT_READ)
+    finally:
+        os.close(fd)
+
+
+def _attach_block(name):
+    with _attached_lock:
+        if name not in _attached_blocks:
+            _attached_blocks[name] = _open_block(name)
+        return _attached_blocks[name]
+
+
+def _encode_key(key):
+    return list(key) if isinstance(key, tuple) else key
+
+
+def _decode_key(key):
+    return tuple(key) if isinstance(key, list) else key
+
+
+class CatalogServer(object):
+    """
+    Publish tables of a Database in shared memory for other local processes,
+    which attach with `Database.attach_shared_tables(name)` and get
+    read-only views of the columns (no copy). The memory is released by
+    `close` (attached processes keep their view until they exit).
+
+    Parameters
+    ----------
+    database : SAGA.Database object
+    keys : list
+        keys of the tables to publish, e.g. ['spectra_clean', ('base', 61945)]
+    name : str, optional
+        name of the schema block, which clients use to attach
+        (default: a random name)
+
+    Examples
+    --------
+    In the server process:
+
+    >>> with SAGA.database.CatalogServer(saga_database, ['spectra_clean', 'hosts_no_flags']) as server:
+    ...     run_workers(server.name)  # pass the name to the workers
+
+    In each worker process:
+
+    >>> saga_database = SAGA.Database()
+    >>> saga_database.attach_shared_tables(name)
+    >>> saga_objects = SAGA.ObjectCatalog(saga_database)
+    """
+    def __init__(self, database, keys, name=None):
+        self.name = name or 'saga_{}'.format(secrets.token_hex(6))
+        self._blocks = []
+        self._lock = threading.Lock()
+        try:
+            tables = []
+            for key in keys:
+                tables.append(self._publish_table(key, database[key].read()))
+            schema = json.dumps({'version': _schema_version, 'tables': tables}).encode()
+            shm = _create_block(self.name, len(schema) + 8)
+            self._blocks.append(shm)
+            shm.buf[:8] = np.array([len(schema)], dtype='<u8').tobytes()
+            shm.buf[8:8+len(schema)] = schema
+        except BaseException:
+            self.close()
+            raise
+
+    def _copy_to_block(self, values):
+        values = np.ascontiguousarray(values)
+        shm = _create_block('{}_{}'.format(self.name, len(self._blocks)), values.nbytes)
+        self._blocks.append(shm)
+        np.ndarray(values.shape, values.dtype, buffer=shm.buf)[...] = values
+        return shm.name
+
+    def _publish_table(self, key, table):
+        columns = []
+        for colname in table.colnames:
+            col = table[colname]
+            values = np.ma.getdata(col)
+            if values.dtype.hasobject:
+                raise TypeError('column {} of {} has dtype object and cannot be shared'.format(colname, key))
+            mask = np.ma.getmask(col) if getattr(col, 'mask', None) is not None else np.ma.nomask
+            columns.append({
+                'name': colname,
+                'dtype': values.dtype.str,
+                'shape': list(values.shape),
+                'unit': None if col.unit is None else str(col.unit),
+                'description': col.description,
+                'block': self._copy_to_block(values),
+                'mask_block': None if mask is np.ma.nomask else self._copy_to_block(np.broadcast_to(mask, values.shape)),
+            })
+        return {'key': _encode_key(key), 'n_rows': len(table), 'columns': columns}
+
+    @property
+    def nbytes(self):
+        """total size of the shared memory blocks"""
+        return sum(shm.size for shm in self._blocks)
+
+    def close(self):
+        """release the shared memory (attached processes keep their view)"""
+        with self._lock:
+            while self._blocks:
+                shm = self._blocks.pop()
+                shm.close()
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+class SharedMemoryTable(DataObject):
+    """
+    A read-only table whose columns are views of shared memory blocks
+    published by a `CatalogServer`. Use `table.copy()` to modify the data.
+    """
+    def __init__(self, schema, blocks):
+        self._schema = schema
+        self._blocks = blocks
+
+    def attach_cache(self, cache, name):
+        # the data are already in memory, and the cache would copy them
+        pass
+
+    @property
+    def colnames(self):
+        return [c['name'] for c in self._schema['columns']]
+
+    def __len__(self):
+        return self._schema['n_rows']
+
+    def _column(self, info):
+        from astropy.table import Column, MaskedColumn
+        shape = tuple(info['shape'])
+        data = np.ndarray(shape, np.dtype(info['dtype']), buffer=self._blocks[info['block']])
+        kwargs = dict(name=info['name'], unit=info['unit'], description=info['description'], copy=False)
+        if info['mask_block'] is None:
+            return Column(data, **kwargs)
+        mask = np.ndarray(shape, bool, buffer=self._blocks[info['mask_block']])
+        return MaskedColumn(data, mask=mask, **kwargs)
+
+    def _read(self, columns=None):
+        from astropy.table import Table
+        infos = {c['name']: c for c in self._schema['columns']}
+        names = self.colnames if columns is None else list(columns)
+        missing = [c for c in names if c not in infos]
+        if missing:
+            raise KeyError('columns {} are not in the shared table'.format(missing))
+        return Table([self._column(infos[c]) for c in names], copy=False)
+
+    def read(self, reload=False, keep=None, columns=None):
+        return self._read(columns)
+
+    def read_rows(self, rows, columns=None):
+        return self._read(columns)[rows]
+
+    def _write(self, table, overwrite=False):
+        raise ValueError('shared memory tables are read-only')
+
+
+def attach_shared_tables(name):
+    """
+    Attach to the tables published by the `CatalogServer` called `name`.
+
+    Returns
+    -------
+    tables : dict
+        key -> SharedMemoryTable
+    """
+    try:
+        buf = _open_block(name)
+    except FileNotFoundError:
+        raise ValueError('cannot find shared tables {}; is the server running?'.format(name))
+    length = int(np.frombuffer(buf, dtype='<u8', count=1)[0])
+    schema = json.loads(bytes(buf[8:8+length]).decode())
+    del buf
+
+    if schema.get('version') != _schema_version:
+        raise ValueError('shared tables {} have an unsupported schema version'.format(name))
+
+    tables = dict()
+    for table_schema in schema['tables']:
+        blocks = dict()
+        for info in table_schema['columns']:
+            for block_name in (info['block'], info['mask_block']):
+                if block_name is not None:
+                    blocks[block_name] = _attach_block(block_name)
+        tables[_decode_key(table_schema['key'])] = SharedMemoryTable(table_schema, blocks)
+    return tables
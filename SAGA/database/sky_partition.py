@@ -0,0 +1,182 @@
+"""
+SAGA.database.sky_partition
+
+This file defines the SkyPartitionedCatalog class
+"""
+import os
+import re
+import json
+import threading
+import numpy as np
+from ..utils import atomic_output_file, concatenate_tables
+from ..utils.geometry import angular_separation, box_intersects_cone, healpix_ang2pix_nest
+from .database import DataObject
+
+__all__ = ['SkyPartitionedCatalog']
+
+_manifest_name = 'manifest.json'
+
+
+class SkyPartitionedCatalog(DataObject):
+    """
+    A catalog stored as fits files partitioned by HEALPix pixel of (RA, DEC).
+
+    Parameters
+    ----------
+    root_dir : str
+        directory of the catalog (created by `add_table`)
+    order : int, optional
+        HEALPix order of the partitions (nside = 2**order; default: 5,
+        i.e. pixels of about 1.8 deg). Ignored if the catalog already exists.
+
+    Examples
+    --------
+    >>> catalog = SkyPartitionedCatalog('/path/to/base_healpix')
+    >>> for host_id in host_ids:
+    ...     catalog.add_table(saga_database['base', host_id].read(), 'nsa{}'.format(host_id))
+    >>> objects = catalog.cone_search(354.13, 0.29, 0.1)
+    """
+    def __init__(self, root_dir, order=5):
+        self._root_dir = root_dir
+        self._order = int(order)
+        self._lock = threading.Lock()
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self._root_dir, _manifest_name)
+
+    def exists(self):
+        return os.path.isfile(self._manifest_path)
+
+    def _load_manifest(self):
+        if not self.exists():
+            return {'version': 1, 'order': self._order, 'sources': [], 'partitions': []}
+        with open(self._manifest_path) as f:
+            return json.load(f)
+
+    @property
+    def order(self):
+        return self._load_manifest()['order']
+
+    @property
+    def sources(self):
+        """names of the tables that have been added"""
+        return list(self._load_manifest()['sources'])
+
+    def get_version(self):
+        try:
+            stat = os.stat(self._manifest_path)
+        except OSError:
+            return None
+        return (self._manifest_path, stat.st_mtime_ns, stat.st_size)
+
+    def add_table(self, table, source, overwrite=False):
+        """
+        Split `table` by pixel and add it to the catalog under the name `source`.
+
+        Parameters
+        ----------
+        table : astropy.table.Table
+            must have columns RA and DEC (in degrees)
+        source : str
+            name of the table (e.g. 'nsa61945'), used in file names
+        overwrite : bool, optional
+            If set to True, replace a previously added table with the same name.
+        """
+        source = re.sub(r'[^\w.-]+', '_', str(source))
+        with self._lock:
+            manifest = self._load_manifest()
+            if source in manifest['sources']:
+                if not overwrite:
+                    raise ValueError('{} has already been added'.format(source))
+                self._remove_source(manifest, source)
+
+            order = manifest['order']
+            ra = np.asarray(table['RA'], dtype=np.float64)
+            dec = np.asarray(table['DEC'], dtype=np.float64)
+            pixels = healpix_ang2pix_nest(order, ra, dec)
+            sorter = np.argsort(pixels, kind='stable')
+            unique_pixels, starts = np.unique(pixels[sorter], return_index=True)
+            stops = np.append(starts[1:], len(sorter))
+
+            for pixel, start, stop in zip(unique_pixels, starts, stops):
+                idx = sorter[start:stop]
+                filename = 'pix{}/{}.fits'.format(pixel, source)
+                path = os.path.join(self._root_dir, filename)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with atomic_output_file(path) as f:
+                    table[idx].write(f, format='fits')
+                manifest['partitions'].append({
+                    'pixel': int(pixel),
+                    'file': filename,
+                    'source': source,
+                    'n_rows': int(stop - start),
+                    'ra_min': float(ra[idx].min()),
+                    'ra_max': float(ra[idx].max()),
+                    'dec_min': float(dec[idx].min()),
+                    'dec_max': float(dec[idx].max()),
+                })
+
+            manifest['sources'].append(source)
+            self._save_manifest(manifest)
+
+    def _remove_source(self, manifest, source):
+        kept = []
+        for part in manifest['partitions']:
+            if part['source'] == source:
+                os.unlink(os.path.join(self._root_dir, part['file']))
+            else:
+                kept.append(part)
+        manifest['partitions'] = kept
+        manifest['sources'].remove(source)
+
+    def _save_manifest(self, manifest):
+        if not os.path.isdir(self._root_dir):
+            os.makedirs(self._root_dir)
+        with atomic_output_file(self._manifest_path) as f:
+            f.write(json.dumps(manifest, indent=1).encode())
+
+    def partitions_in_cone(self, ra, dec, radius):
+        """
+        Return the manifest entries of the files that may contain objects
+        within `radius` of (`ra`, `dec`), all in degrees.
+        """
+        return [part for part in self._load_manifest()['partitions']
+                if box_intersects_cone(part['ra_min'], part['ra_max'], part['dec_min'], part['dec_max'], ra, dec, radius)]
+
+    @staticmethod
+    def _read_parts(paths, columns):
+        from astropy.table import Table
+        for path in paths:
+            t = Table.read(path, format='fits')
+            yield t if columns is None else t[list(columns)]
+
+    def cone_search(self, ra, dec, radius, columns=None):
+        """
+        Return the objects within `radius` of (`ra`, `dec`), all in degrees.
+        Only the partitions that intersect the cone are read.
+
+        Parameters
+        ----------
+        ra, dec, radius : float
+        columns : list, optional
+
+        Returns
+        -------
+        objects : astropy.table.Table
+        """
+        parts = self.partitions_in_cone(ra, dec, radius)
+        read_columns = None if columns is None else list(columns) + [c for c in ('RA', 'DEC') if c not in columns]
+        t = concatenate_tables(self._read_parts((os.path.join(self._root_dir, p['file']) for p in parts), read_columns))
+        if not len(t):
+            return t
+        t = t[angular_separation(ra, dec, np.asarray(t['RA']), np.asarray(t['DEC'])) <= radius]
+        return t if columns is None else t[list(columns)]
+
+    def _read(self, columns=None):
+        paths = [os.path.join(self._root_dir, p['file']) for p in self._load_manifest()['partitions']]
+        return concatenate_tables(self._read_parts(paths, columns))
+
+    def _write(self, table, overwrite=False):
+        self.add_table(table, 'table', overwrite=overwrite)
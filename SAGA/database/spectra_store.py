@@ -0,0 +1,285 @@
+"""
+SAGA.database.spectra_store
+
+This file defines the SpectraStore class
+"""
+import os
+import re
+import json
+import time
+import threading
+import numpy as np
+from ..utils import atomic_output_file, concatenate_tables, lazy_import
+from ..utils.geometry import angular_separation, box_intersects_cone
+from .database import DataObject
+
+fits = lazy_import('astropy.io.fits')
+
+__all__ = ['SpectraStore', 'select_spectra']
+
+_manifest_name = 'manifest.json'
+_no_host = -1
+
+
+def _as_str_array(column):
+    values = np.asarray(column)
+    if values.dtype.kind == 'S':
+        values = np.char.decode(values, 'ascii', 'replace')
+    return np.char.strip(values.astype(str))
+
+
+def select_spectra(spectra, telescope=None, hosts=None, ra=None, dec=None, radius=None):
+    """
+    Return the rows of `spectra` that match the selection (same arguments
+    as `SpectraStore.read`), using a full scan of the table.
+    """
+    mask = np.ones(len(spectra), bool)
+    if isinstance(telescope, str):
+        telescope = [telescope]
+    if telescope is not None:
+        mask &= np.isin(_as_str_array(spectra['TELNAME']), [t.strip() for t in telescope])
+    if hosts is not None:
+        mask &= np.isin(np.asarray(spectra['HOST_NSAID']), np.atleast_1d(hosts))
+    if ra is not None and dec is not None and radius is not None:
+        mask &= angular_separation(ra, dec, np.asarray(spectra['RA']), np.asarray(spectra['DEC'])) <= radius
+    return spectra if mask.all() else spectra[mask]
+
+
+class SpectraStore(DataObject):
+    """
+    A spectra table stored as a set of fits files partitioned by telescope
+    (column TELNAME) and indexed by host (column HOST_NSAID) and position
+    (columns RA, DEC, in degrees).
+
+    Parameters
+    ----------
+    root_dir : str
+        directory of the store (created on the first `append`)
+    block_rows : int, optional
+        maximal number of rows per index block (default: 4096).
+        Smaller blocks make cone searches read fewer rows.
+
+    Examples
+    --------
+    >>> store = SpectraStore('/path/to/saga_spectra_store')
+    >>> store.append(saga_database['spectra_clean'].read(), run='initial')
+    >>> mmt = store.read(telescope='MMT')
+    >>> near_anak = store.read(hosts=[61945])
+    >>> cone = store.read(ra=354.13, dec=0.29, radius=0.5)
+    """
+    def __init__(self, root_dir, block_rows=4096):
+        self._root_dir = root_dir
+        self._block_rows = int(block_rows)
+        self._lock = threading.Lock()
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self._root_dir, _manifest_name)
+
+    def exists(self):
+        return os.path.isfile(self._manifest_path)
+
+    def _load_manifest(self):
+        if not self.exists():
+            return {'version': 1, 'parts': []}
+        with open(self._manifest_path) as f:
+            return json.load(f)
+
+    def get_version(self):
+        try:
+            stat = os.stat(self._manifest_path)
+        except OSError:
+            return None
+        return (self._manifest_path, stat.st_mtime_ns, stat.st_size)
+
+    @property
+    def telescopes(self):
+        """sorted list of telescopes in the store"""
+        return sorted(set(part['telescope'] for part in self._load_manifest()['parts']))
+
+    def __len__(self):
+        return sum(part['n_rows'] for part in self._load_manifest()['parts'])
+
+    def _index_blocks(self, table):
+        blocks = []
+        hosts = np.asarray(table['HOST_NSAID'])
+        boundaries = np.flatnonzero(hosts[1:] != hosts[:-1]) + 1
+        starts = np.concatenate([[0], boundaries])
+        stops = np.concatenate([boundaries, [len(table)]])
+        ra = np.asarray(table['RA'], dtype=np.float64)
+        dec = np.asarray(table['DEC'], dtype=np.float64)
+        for host_start, host_stop in zip(starts, stops):
+            for start in range(host_start, host_stop, self._block_rows):
+                stop = min(start + self._block_rows, host_stop)
+                blocks.append({
+                    'host': int(hosts[start]),
+                    'start': int(start),
+                    'stop': int(stop),
+                    'ra_min': float(np.nanmin(ra[start:stop])),
+                    'ra_max': float(np.nanmax(ra[start:stop])),
+                    'dec_min': float(np.nanmin(dec[start:stop])),
+                    'dec_max': float(np.nanmax(dec[start:stop])),
+                })
+        return blocks
+
+    def append(self, spectra, run=None):
+        """
+        Add spectra (e.g. from a new observing run) to the store.
+        One new file is written per telescope; existing files are untouched.
+
+        Parameters
+        ----------
+        spectra : astropy.table.Table
+            must have columns RA and DEC; TELNAME and HOST_NSAID are used
+            for partitioning and indexing if present
+        run : str, optional
+            name of the run, used in the file names (default: a timestamp)
+
+        Returns
+        -------
+        paths : list of str
+            the files that were written
+        """
+        if run is None:
+            run = time.strftime('%Y%m%dT%H%M%S')
+        run = re.sub(r'[^\w.-]+', '_', str(run))
+
+        with self._lock:
+            manifest = self._load_manifest()
+            parts = self._write_parts(spectra, run, set(part['file'] for part in manifest['parts']))
+            manifest['parts'].extend(parts)
+            self._write_manifest(manifest)
+        return [os.path.join(self._root_dir, part['file']) for part in parts]
+
+    def _write_parts(self, spectra, run, known_files):
+        """write one file per telescope and return their manifest entries"""
+        if 'TELNAME' in spectra.colnames:
+            telescopes = _as_str_array(spectra['TELNAME'])
+        else:
+            telescopes = np.repeat('UNKNOWN', len(spectra))
+        if 'HOST_NSAID' in spectra.colnames:
+            hosts = np.ma.filled(np.ma.asarray(spectra['HOST_NSAID']), _no_host).astype(np.int64)
+        else:
+            hosts = np.repeat(np.int64(_no_host), len(spectra))
+
+        parts = []
+        for telescope in np.unique(telescopes):
+            mask = (telescopes == telescope)
+            dirname = re.sub(r'[^\w.-]+', '_', telescope) or 'UNKNOWN'
+            filename = '{}/{}.fits'.format(dirname, run)
+            if filename in known_files:
+                raise ValueError('run "{}" already exists for telescope {}'.format(run, telescope))
+
+            part = spectra[mask]
+            part['HOST_NSAID'] = hosts[mask]
+            part = part[np.lexsort((np.asarray(part['DEC']), np.asarray(part['HOST_NSAID'])))]
+
+            path = os.path.join(self._root_dir, filename)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with atomic_output_file(path) as f:
+                part.write(f, format='fits')
+
+            parts.append({
+                'file': filename,
+                'telescope': str(telescope),
+                'run': run,
+                'n_rows': len(part),
+                'blocks': self._index_blocks(part),
+            })
+        return parts
+
+    def _write_manifest(self, manifest):
+        with atomic_output_file(self._manifest_path) as f:
+            f.write(json.dumps(manifest, indent=1).encode())
+
+    def _select_blocks(self, telescope, hosts, ra, dec, radius):
+        if isinstance(telescope, str):
+            telescope = [telescope]
+        if telescope is not None:
+            telescope = set(t.strip() for t in telescope)
+        if hosts is not None:
+            hosts = set(int(h) for h in np.atleast_1d(hosts))
+
+        cone = ra is not None and dec is not None and radius is not None
+
+        manifest = self._load_manifest()
+        selected = []
+        for part in manifest['parts']:
+            if telescope is not None and part['telescope'] not in telescope:
+                continue
+            for block in part['blocks']:
+                if hosts is not None and block['host'] not in hosts:
+                    continue
+                if cone and not box_intersects_cone(block['ra_min'], block['ra_max'], block['dec_min'], block['dec_max'], ra, dec, radius):
+                    continue
+                if selected and selected[-1][0] == part['file'] and selected[-1][2] == block['start']:
+                    selected[-1][2] = block['stop']
+                else:
+                    selected.append([part['file'], block['start'], block['stop']])
+
+        # keep the columns of the store even if no rows are selected
+        if not selected and manifest['parts']:
+            selected.append([manifest['parts'][0]['file'], 0, 0])
+        return selected
+
+    def _iter_row_ranges(self, selected, columns):
+        from astropy.table import Table
+        for filename, start, stop in selected:
+            with fits.open(os.path.join(self._root_dir, filename), memmap=True) as hdul:
+                hdu = hdul[1]
+                t = Table.read(fits.BinTableHDU(data=hdu.data[start:stop], header=hdu.header))
+            yield t if columns is None else t[list(columns)]
+
+    def read(self, reload=False, keep=None, columns=None, telescope=None, hosts=None, ra=None, dec=None, radius=None):  # pylint: disable=arguments-differ
+        """
+        Read spectra from the store. Only the files and row blocks that can
+        match the selection are read.
+
+        Parameters
+        ----------
+        columns : list, optional
+        telescope : str or list of str, optional
+        hosts : int or list of int, optional
+            host NSAIDs
+        ra, dec, radius : float, optional
+            select spectra within `radius` of (`ra`, `dec`), all in degrees
+
+        Returns
+        -------
+        spectra : astropy.table.Table
+        """
+        if telescope is None and hosts is None and radius is None:
+            return super(SpectraStore, self).read(reload, keep, columns)
+
+        read_columns = columns
+        if columns is not None and radius is not None:
+            read_columns = list(columns) + [c for c in ('RA', 'DEC') if c not in columns]
+
+        selected = self._select_blocks(telescope, hosts, ra, dec, radius)
+        t = concatenate_tables(self._iter_row_ranges(selected, read_columns))
+
+        if radius is not None and len(t):
+            t = select_spectra(t, ra=ra, dec=dec, radius=radius)
+        if columns is not None and len(t):
+            t = t[list(columns)]
+        return t
+
+    def _read(self, columns=None):
+        selected = self._select_blocks(None, None, None, None, None)
+        return concatenate_tables(self._iter_row_ranges(selected, columns))
+
+    def _write(self, table, overwrite=False):
+        if self.exists() and not overwrite:
+            return
+        with self._lock:
+            old_parts = self._load_manifest()['parts']
+            old_files = set(part['file'] for part in old_parts)
+            run = 'initial'
+            if any(part['run'] == run for part in old_parts):
+                run = 'initial_{}'.format(time.time_ns())
+            # the new files are written next to the old ones, and replace
+            # them when the manifest is replaced
+            self._write_manifest({'version': 1, 'parts': self._write_parts(table, run, old_files)})
+            for filename in old_files:
+                os.unlink(os.path.join(self._root_dir, filename))
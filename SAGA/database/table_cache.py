@@ -0,0 +1,161 @@
+"""
+SAGA.database.table_cache
+
+This file defines the TableCache class
+"""
+import threading
+from collections import OrderedDict
+
+__all__ = ['TableCache']
+
+
+def _table_nbytes(table):
+    return sum(getattr(table[c], 'nbytes', 0) for c in table.colnames)
+
+
+class TableCache(object):
+    """
+    A memory-budgeted LRU cache of tables, keyed by data object name and
+    version (see `DataObject.get_version`), so that tables whose files
+    have changed are read again.
+
+    A cached table holds either all columns or a subset of columns; a
+    request for some columns is served by any cached table of the same
+    data object that has them.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        memory budget in bytes (default: 1 GB). Unpinned tables are evicted,
+        least recently used first, when the total size exceeds the budget;
+        tables larger than the budget are not cached unless pinned.
+
+    Notes
+    -----
+    Tables are copied when returned, so modifying a returned table (as the
+    build functions do) does not affect the cache.
+
+    Examples
+    --------
+    >>> saga_database = SAGA.Database('/path/to/SAGA/Dropbox', cache_bytes=4 << 30)
+    >>> saga_database.cache.pin('spectra_clean')
+    >>> saga_database.cache.stats()
+    """
+    def __init__(self, max_bytes=(1 << 30)):
+        self.max_bytes = int(max_bytes)
+        self._tables = OrderedDict()
+        self._pinned = set()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def pin(self, name):
+        """never evict the tables of data object `name`"""
+        with self._lock:
+            self._pinned.add(name)
+
+    def unpin(self, name):
+        """allow the tables of data object `name` to be evicted again"""
+        with self._lock:
+            self._pinned.discard(name)
+            self._evict()
+
+    def is_pinned(self, name):
+        return name in self._pinned
+
+    def _find(self, name, version, columns):
+        for key in reversed(self._tables):
+            if key[0] != name or key[1] != version:
+                continue
+            table = self._tables[key][0]
+            if columns is None:
+                if key[2] is None:
+                    return key
+            elif key[2] is None or set(columns).issubset(table.colnames):
+                return key
+
+    def get(self, name, version, columns=None, count=True):
+        """
+        Return a copy of the cached table of data object `name` at
+        `version` (with only `columns`, if set), or None.
+        Set `count` to False to not count the lookup in the statistics.
+        """
+        with self._lock:
+            key = self._find(name, version, columns)
+            if key is None:
+                if count:
+                    self.misses += 1
+                return None
+            self._tables.move_to_end(key)
+            if count:
+                self.hits += 1
+            table = self._tables[key][0]
+        return table.copy() if columns is None else table[list(columns)]
+
+    def put(self, name, version, table, columns=None):
+        """
+        Store `table` (not copied) as the table of data object `name` at
+        `version`; `columns` is None if `table` has all the columns.
+        Tables of other versions of the same data object are dropped.
+        Return False if the table is too large to be kept.
+        """
+        nbytes = _table_nbytes(table)
+        key = (name, version, None if columns is None else tuple(columns))
+        with self._lock:
+            for k in [k for k in self._tables if k[0] == name and (k[1] != version or k == key)]:
+                self._nbytes -= self._tables.pop(k)[1]
+            if nbytes > self.max_bytes and name not in self._pinned:
+                return False
+            self._tables[key] = (table, nbytes)
+            self._nbytes += nbytes
+            self._evict()
+            return key in self._tables
+
+    def _evict(self):
+        if self._nbytes <= self.max_bytes:
+            return
+        for key in list(self._tables):
+            if self._nbytes <= self.max_bytes:
+                break
+            if key[0] in self._pinned:
+                continue
+            self._nbytes -= self._tables.pop(key)[1]
+            self.evictions += 1
+
+    def discard(self, name):
+        """remove the tables of data object `name`"""
+        with self._lock:
+            for k in [k for k in self._tables if k[0] == name]:
+                self._nbytes -= self._tables.pop(k)[1]
+
+    def clear(self):
+        """remove all tables (pins are kept)"""
+        with self._lock:
+            self._tables.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._tables)
+
+    def stats(self):
+        """
+        Return a dict with the number of hits, misses and evictions, the
+        number of cached tables, their total size and the memory budget
+        (in bytes), and the pinned data objects.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'tables': len(self._tables),
+                'nbytes': self._nbytes,
+                'max_bytes': self.max_bytes,
+                'pinned': sorted(self._pinned, key=repr),
+            }
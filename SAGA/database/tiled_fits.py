@@ -0,0 +1,180 @@
+"""
+SAGA.database.tiled_fits
+
+This file collects functions to read and write tables as tile-compressed
+fits files, with one compressed image HDU per column.
+"""
+import os
+from collections import OrderedDict
+import numpy as np
+from ..utils import atomic_output_file, lazy_import
+
+fits = lazy_import('astropy.io.fits')
+
+__all__ = ['write_tiled_fits', 'read_tiled_fits', 'convert_to_tiled_fits']
+
+_TILED_KEYWORD = 'SAGATILE'
+_DEFAULT_TILE_ROWS = 65536
+
+
+def _column_to_image(col):
+    """
+    return the image to store, the dtype to restore on read, and the mask
+    (None if the column has no masked entries)
+    """
+    mask = None
+    if getattr(col, 'mask', None) is not None and np.any(col.mask):
+        mask = np.asarray(col.mask)
+    data = np.asarray(col.filled() if mask is not None else col)
+    kind = data.dtype.kind
+    if kind == 'U':
+        data = np.char.encode(data, 'ascii').astype('S{}'.format(max(data.dtype.itemsize // 4, 1)))
+        kind = 'S'
+    if kind == 'b':
+        return data.astype(np.uint8), data.dtype, mask
+    if kind == 'S':
+        data = data.astype('S{}'.format(max(data.dtype.itemsize, 1)))
+        image = np.ascontiguousarray(data).view(np.uint8).reshape(data.shape + (data.dtype.itemsize,))
+        return image, data.dtype, mask
+    if kind in 'iuf':
+        return np.ascontiguousarray(data), data.dtype, mask
+    raise ValueError('cannot store column {} of dtype {} in a tiled fits file'.format(col.name, data.dtype))
+
+
+def _image_to_hdu(data, tile_rows):
+    if len(data):
+        tile_shape = (tile_rows,) + data.shape[1:]
+        return fits.CompImageHDU(data, compression_type='GZIP_2', quantize_level=0.0, tile_shape=tile_shape)
+    return fits.ImageHDU()
+
+
+def _image_to_column(data, header, mask=None):
+    from astropy.table import Column, MaskedColumn
+    dtype = np.dtype(header['SAGADTYP'])
+    if data is None or not data.size:
+        data = np.zeros(0, dtype=dtype)
+    elif dtype.kind == 'b':
+        data = data.astype(bool)
+    elif dtype.kind == 'S':
+        data = np.ascontiguousarray(data, dtype=np.uint8).view(dtype).reshape(data.shape[:-1])
+    else:
+        data = data.astype(dtype, copy=False)
+    if mask is not None:
+        return MaskedColumn(data, mask=mask.astype(bool), name=header['SAGACOL'], unit=header.get('SAGAUNIT') or None)
+    return Column(data, name=header['SAGACOL'], unit=header.get('SAGAUNIT') or None)
+
+
+def write_tiled_fits(table, path, tile_rows=_DEFAULT_TILE_ROWS, overwrite=False):
+    """
+    Write `table` to `path` as a tile-compressed FITS file.
+    The file is written atomically.
+
+    Parameters
+    ----------
+    table : astropy.table.Table
+    path : str
+    tile_rows : int, optional
+        Number of rows in each compressed tile
+    overwrite : bool, optional
+    """
+    if not overwrite and os.path.isfile(path):
+        raise OSError('{} already exists'.format(path))
+
+    primary = fits.PrimaryHDU()
+    primary.header[_TILED_KEYWORD] = True
+    primary.header['NROWS'] = len(table)
+    primary.header['NCOLS'] = len(table.colnames)
+    hdus = [primary]
+
+    tile_rows = max(min(int(tile_rows), len(table)), 1)
+
+    for name in table.colnames:
+        col = table[name]
+        data, dtype, mask = _column_to_image(col)
+        hdu = _image_to_hdu(data, tile_rows)
+        hdu.header['SAGACOL'] = name
+        hdu.header['SAGADTYP'] = dtype.str
+        if col.unit is not None:
+            hdu.header['SAGAUNIT'] = str(col.unit)
+        hdus.append(hdu)
+        if mask is not None:
+            hdu = _image_to_hdu(mask.astype(np.uint8), tile_rows)
+            hdu.header['SAGACOL'] = name
+            hdu.header['SAGAMASK'] = True
+            hdus.append(hdu)
+
+    with atomic_output_file(path) as f:
+        fits.HDUList(hdus).writeto(f)
+
+
+def read_tiled_fits(path, columns=None):
+    """
+    Read a tile-compressed FITS file written by `write_tiled_fits`.
+    Only the requested columns are decompressed.
+
+    Parameters
+    ----------
+    path : str
+    columns : list, optional
+        If set, only read a subset of columns
+
+    Returns
+    -------
+    table : astropy.table.Table
+    """
+    from astropy.table import Table
+    out = Table()
+    with fits.open(path) as hdul:
+        hdu_by_name = OrderedDict()
+        mask_hdu_by_name = dict()
+        for hdu in hdul[1:]:
+            if hdu.header.get('SAGAMASK', False):
+                mask_hdu_by_name[hdu.header['SAGACOL']] = hdu
+            else:
+                hdu_by_name[hdu.header['SAGACOL']] = hdu
+        if columns is None:
+            columns = list(hdu_by_name)
+        for name in columns:
+            try:
+                hdu = hdu_by_name[name]
+            except KeyError:
+                raise KeyError('cannot find column {} in {}'.format(name, path))
+            mask = mask_hdu_by_name[name].data if name in mask_hdu_by_name else None
+            out.add_column(_image_to_column(None if hdu.data is None else np.array(hdu.data), hdu.header,
+                                            None if mask is None else np.array(mask)))
+    return out
+
+
+def convert_to_tiled_fits(path, out_path=None, tile_rows=_DEFAULT_TILE_ROWS, delete_original=False):
+    """
+    Convert an existing fits (or fits.gz) table to a tile-compressed FITS file.
+
+    Parameters
+    ----------
+    path : str
+    out_path : str, optional
+        Default is to replace ".fits" or ".fits.gz" in `path` by ".fits.fz"
+    tile_rows : int, optional
+    delete_original : bool, optional
+
+    Returns
+    -------
+    out_path : str
+
+    Examples
+    --------
+    >>> import glob
+    >>> for path in glob.iglob('/path/to/SAGA/Dropbox/base_catalogs/base_sql_nsa*.fits.gz'):
+    ...     convert_to_tiled_fits(path)
+    """
+    if out_path is None:
+        out_path = path[:-3] if path.endswith('.gz') else path
+        out_path += '.fz'
+
+    from astropy.table import Table
+    write_tiled_fits(Table.read(path, format='fits'), out_path, tile_rows, overwrite=True)
+
+    if delete_original:
+        os.unlink(path)
+
+    return out_path
@@ -4,4 +4,9 @@ SAGA.objects
 This subpackage contains object-related routines, including ObjectCatalog and ObjectCuts
 """
 from .object_catalog import ObjectCatalog
+from .result_cache import ResultCache
+from .dedup import DedupCatalog
+from .ingest import (ingest_spectra, remove_repeated_spectra)
+from .chunked_build import build_chunked
+from .build_pipeline import BuildPipeline
 from . import cuts as ObjectCuts
@@ -0,0 +1,174 @@
+"""
+SAGA.objects.aggregation
+
+This file collects the reducers used by `ObjectCatalog.aggregate`.
+"""
+import numpy as np
+from easyquery import Query
+from ..utils import compile_query
+
+__all__ = ['make_reducer']
+
+
+class _Reducer(object):
+    """
+    A reducer computes a partial result per group for one table, merges
+    partial results of different tables, and finalizes the merged result.
+    Partial results are arrays whose first axis is the group index.
+    """
+    dtype = np.float64
+    initial = 0
+    columns = ()
+
+    def partial(self, table, inverse, n_groups):
+        raise NotImplementedError
+
+    def merge(self, a, b):
+        return a + b
+
+    def empty(self):
+        return np.zeros((0,), self.dtype)
+
+    def resize(self, state, n_groups):
+        if len(state) >= n_groups:
+            return state
+        out = np.full((n_groups,) + state.shape[1:], self.initial, state.dtype)
+        out[:len(state)] = state
+        return out
+
+    def finalize(self, state):
+        return state
+
+
+class _Count(_Reducer):
+    dtype = np.int64
+
+    def partial(self, table, inverse, n_groups):
+        return np.bincount(inverse, minlength=n_groups).astype(self.dtype)
+
+
+class _QueryCount(_Reducer):
+    dtype = np.int64
+
+    def __init__(self, query):
+        self.query = compile_query(query)
+        self.columns = tuple(Query(query).variable_names)
+
+    def partial(self, table, inverse, n_groups):
+        mask = self.query.mask(table)
+        return np.bincount(inverse[mask], minlength=n_groups).astype(self.dtype)
+
+
+def _finite_values(table, column, inverse):
+    values = np.asarray(table[column], dtype=np.float64)
+    finite = np.isfinite(values)
+    return values[finite], inverse[finite]
+
+
+class _Sum(_Reducer):
+    def __init__(self, column):
+        self.columns = (column,)
+
+    def partial(self, table, inverse, n_groups):
+        values, inverse = _finite_values(table, self.columns[0], inverse)
+        return np.bincount(inverse, weights=values, minlength=n_groups)
+
+
+class _Mean(_Reducer):
+    def __init__(self, column):
+        self.columns = (column,)
+
+    def partial(self, table, inverse, n_groups):
+        values, inverse = _finite_values(table, self.columns[0], inverse)
+        return np.stack([np.bincount(inverse, weights=values, minlength=n_groups),
+                         np.bincount(inverse, minlength=n_groups)], axis=1)
+
+    def empty(self):
+        return np.zeros((0, 2), self.dtype)
+
+    def finalize(self, state):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return state[:, 0] / state[:, 1]
+
+
+class _Extremum(_Reducer):
+    def __init__(self, column, ufunc, initial):
+        self.columns = (column,)
+        self.ufunc = ufunc
+        self.initial = initial
+
+    def partial(self, table, inverse, n_groups):
+        values, inverse = _finite_values(table, self.columns[0], inverse)
+        out = np.full(n_groups, self.initial)
+        self.ufunc.at(out, inverse, values)
+        return out
+
+    def merge(self, a, b):
+        return self.ufunc(a, b)
+
+    def finalize(self, state):
+        state = state.copy()
+        state[state == self.initial] = np.nan
+        return state
+
+
+class _Histogram(_Reducer):
+    dtype = np.int64
+
+    def __init__(self, column, bins):
+        self.columns = (column,)
+        self.bins = np.asarray(bins, dtype=np.float64)
+        if self.bins.ndim != 1 or len(self.bins) < 2:
+            raise ValueError('`bins` must be a 1-d array of at least two bin edges')
+
+    def partial(self, table, inverse, n_groups):
+        values, inverse = _finite_values(table, self.columns[0], inverse)
+        n_bins = len(self.bins) - 1
+        idx = np.searchsorted(self.bins, values, side='right') - 1
+        idx[values == self.bins[-1]] = n_bins - 1 # the last bin includes its right edge, as in np.histogram
+        inside = (idx >= 0) & (idx < n_bins)
+        flat = inverse[inside] * n_bins + idx[inside]
+        return np.bincount(flat, minlength=n_groups*n_bins).reshape(n_groups, n_bins)
+
+    def empty(self):
+        return np.zeros((0, len(self.bins) - 1), self.dtype)
+
+
+def make_reducer(spec):
+    """
+    Create a reducer from a specification.
+
+    Parameters
+    ----------
+    spec : str, tuple, or easyquery.Query
+        'count' : number of rows
+        ('sum', column), ('mean', column), ('min', column), ('max', column) :
+            reductions over the finite values of `column`
+        ('hist', column, bins) : histogram of `column` with bin edges `bins`
+        easyquery.Query (or ('count', query)) : number of rows that pass the query
+
+    Returns
+    -------
+    reducer : object
+    """
+    if isinstance(spec, Query):
+        return _QueryCount(spec)
+    if isinstance(spec, str):
+        spec = (spec,)
+    if not isinstance(spec, tuple) or not spec:
+        raise ValueError('Cannot understand aggregation {!r}'.format(spec))
+
+    name, args = spec[0], spec[1:]
+    if name == 'count':
+        return _QueryCount(args[0]) if args else _Count()
+    if name == 'sum' and len(args) == 1:
+        return _Sum(*args)
+    if name == 'mean' and len(args) == 1:
+        return _Mean(*args)
+    if name == 'min' and len(args) == 1:
+        return _Extremum(args[0], np.fmin, np.inf)
+    if name == 'max' and len(args) == 1:
+        return _Extremum(args[0], np.fmax, -np.inf)
+    if name == 'hist' and len(args) == 2:
+        return _Histogram(*args)
+    raise ValueError('Cannot understand aggregation {!r}'.format(spec))
@@ -1,12 +1,13 @@
 import numpy as np
 import numexpr as ne
-from astropy.coordinates import SkyCoord
 from easyquery import Query
 from . import cuts as C
 from .manual_fixes import fixes_by_sdss_objid
-from ..utils import join_table_by_coordinates, fill_values_by_query, get_empty_str_array
+from ..utils import join_table_by_coordinates, fill_values_by_query, get_empty_str_array, instrument, IdSet
+from ..utils.geometry import angular_separation, radec_to_xyz, separation_from_xyz, host_projected_distance
 
 
+@instrument('build.add_host_info')
 def add_host_info(base, host, saga_names=None, overwrite_if_different_host=False):
     """
     Add host information to the base catalog (for a single host).
@@ -22,7 +23,7 @@ def add_host_info(base, host, saga_names=None, overwrite_if_different_host=False
     base : astropy.table.Table
     """
 
-    if ('HOST_NSAID' in base and base['HOST_NSAID'][0] != host['NSAID']) and not overwrite_if_different_host:
+    if ('HOST_NSAID' in base.colnames and base['HOST_NSAID'][0] != host['NSAID']) and not overwrite_if_different_host:
         raise ValueError('Existing host info and differs from input host info.')
 
     base['HOST_NSAID'] = host['NSAID']
@@ -34,14 +35,11 @@ def add_host_info(base, host, saga_names=None, overwrite_if_different_host=False
     base['HOST_MR'] = host['M_r']
     base['HOST_MG'] = host['M_g']
 
-    host_sc = SkyCoord(host['RA'], host['Dec'], unit='deg')
-    sep = SkyCoord(base['RA'], base['DEC'], unit="deg").separation(host_sc)
-    base['RHOST_ARCM'] = sep.arcmin
-    base['RHOST_KPC'] = np.sin(sep.radian) * (1000.0 * host['distance'])
+    base['RHOST_ARCM'], base['RHOST_KPC'] = host_projected_distance(base['RA'], base['DEC'], host['RA'], host['Dec'], host['distance'])
 
     cols = ('HOST_SAGA_NAME', 'HOST_NGC_NAME')
     for col in cols:
-        if col not in base:
+        if col not in base.colnames:
             base[col] = get_empty_str_array(len(base))
 
     if saga_names:
@@ -53,6 +51,7 @@ def add_host_info(base, host, saga_names=None, overwrite_if_different_host=False
     return base
 
 
+@instrument('build.add_more_photometric_data')
 def add_more_photometric_data(base, wise, **kwargs):
     """
     Add more photometric data to the base catalog (for a single host).
@@ -85,6 +84,7 @@ def add_more_photometric_data(base, wise, **kwargs):
     return base
 
 
+@instrument('build.set_remove_flag')
 def set_remove_flag(base, objects_to_remove, objects_to_add):
     """
     Set remove flag in the base catalog (for a single host),
@@ -101,11 +101,11 @@ def set_remove_flag(base, objects_to_remove, objects_to_add):
     -------
     base : astropy.table.Table
     """
-    if 'REMOVE' not in base:
+    if 'REMOVE' not in base.colnames:
         base['REMOVE'] = -1
 
-    ids_to_remove = np.unique(objects_to_remove['SDSS ID'].data.compressed())
-    fill_values_by_query(base, Query((lambda x: np.in1d(x, ids_to_remove), 'OBJID')), {'REMOVE': 1})
+    ids_to_remove = IdSet(objects_to_remove['SDSS ID'])
+    fill_values_by_query(base, Query((ids_to_remove.contains, 'OBJID')), {'REMOVE': 1})
     del ids_to_remove
 
     fill_values_by_query(base, C.too_close_to_host, {'REMOVE': 1})
@@ -126,13 +126,14 @@ def set_remove_flag(base, objects_to_remove, objects_to_add):
     q = Query((lambda *x: np.abs(np.median(x, axis=0)) > 0.5, 'g_err', 'r_err', 'i_err'))
     fill_values_by_query(base, q, {'REMOVE': 3})
 
-    ids_to_add = np.unique(objects_to_add['SDSS ID'].data.compressed())
-    fill_values_by_query(base, Query((lambda x: np.in1d(x, ids_to_add), 'OBJID')), {'REMOVE': -1})
+    ids_to_add = IdSet(objects_to_add['SDSS ID'])
+    fill_values_by_query(base, Query((ids_to_add.contains, 'OBJID')), {'REMOVE': -1})
 
     return base
 
 
 
+@instrument('build.fix_photometry_with_nsa')
 def fix_photometry_with_nsa(base, nsa):
     """
     Use NSA catalog to remove shereded object.
@@ -147,14 +148,11 @@ def fix_photometry_with_nsa(base, nsa):
     sdss : astropy.table.Table
     """
 
-    host_sc = SkyCoord(base['HOST_RA'][0], base['HOST_DEC'][0], unit='deg')
-    nsa = nsa[SkyCoord(nsa['RA'], nsa['DEC'], unit="deg").separation(host_sc).deg < 1.0]
+    nsa = nsa[angular_separation(nsa['RA'], nsa['DEC'], base['HOST_RA'][0], base['HOST_DEC'][0]) < 1.0]
 
     if len(nsa) == 0:
         return base
 
-    base_sc = SkyCoord(base['RA'], base['DEC'], unit='deg')
-
     for nsa_obj in nsa:
 
         values_for_ellipse_calculation = {
@@ -200,6 +198,7 @@ def fix_photometry_with_nsa(base, nsa):
 
 
 
+@instrument('build.add_spectra')
 def add_spectra(base, spectra, ignore_imacs=False):
     """
     Add spectra to base catalog.
@@ -218,35 +217,34 @@ def add_spectra(base, spectra, ignore_imacs=False):
 
     cols_to_copy = ('TELNAME', 'MASKNAME', 'ZQUALITY', 'SPEC_Z', 'SPEC_Z_ERR', 'specobjid')
 
-    if 'REMOVE' not in base:
+    if 'REMOVE' not in base.colnames:
         base['REMOVE'] = -1
-    if 'TELNAME' not in base:
+    if 'TELNAME' not in base.colnames:
         base['TELNAME'] = get_empty_str_array(len(base), 6)
-    if 'MASKNAME' not in base:
+    if 'MASKNAME' not in base.colnames:
         base['MASKNAME'] = get_empty_str_array(len(base))
-    if 'ZQUALITY' not in base:
+    if 'ZQUALITY' not in base.colnames:
         base['ZQUALITY'] = -1
-    if 'SPEC_Z' not in base:
+    if 'SPEC_Z' not in base.colnames:
         base['SPEC_Z'] = -1.0
-    if 'SPEC_Z_ERR' not in base:
+    if 'SPEC_Z_ERR' not in base.colnames:
         base['SPEC_Z_ERR'] = -1.0
-    if 'SPEC_REPEAT' not in base:
+    if 'SPEC_REPEAT' not in base.colnames:
         base['SPEC_REPEAT'] = get_empty_str_array(len(base))
-    if 'SPECOBJID' not in base:
+    if 'SPECOBJID' not in base.colnames:
         base['SPECOBJID'] = get_empty_str_array(len(base), 48)
 
-    host_sc = SkyCoord(base['HOST_RA'][0], base['HOST_DEC'][0], unit='deg')
-    spectra_sc = SkyCoord(spectra['RA'], spectra['DEC'], unit="deg")
-    near_host_mask = spectra_sc.separation(host_sc).deg < 1.0
+    near_host_mask = angular_separation(spectra['RA'], spectra['DEC'], base['HOST_RA'][0], base['HOST_DEC'][0]) < 1.0
 
     if not near_host_mask.any():
         return base
 
     spectra = spectra[near_host_mask]
-    spectra_sc = spectra_sc[near_host_mask]
     del near_host_mask
 
-    base_sc = SkyCoord(base['RA'], base['DEC'], unit='deg')
+    # unit vectors are computed once; separations in the loop are in arcsec
+    base_xyz = radec_to_xyz(base['RA'], base['DEC'])
+    spectra_xyz = radec_to_xyz(spectra['RA'], spectra['DEC'])
 
     done_spectra_indices = []
 
@@ -254,10 +252,10 @@ def add_spectra(base, spectra, ignore_imacs=False):
         if i in done_spectra_indices:
             continue
 
-        spec_sc = SkyCoord(spec['RA'], spec['DEC'], unit='deg')
+        base_sep = separation_from_xyz(base_xyz, spectra_xyz[i]) * 3600.0
 
         # do an initial search of objects within 5 arcsec
-        objects_nearby = base[base_sc.separation(spec_sc).arcsec < 5.0]
+        objects_nearby = base[base_sep < 5.0]
         if len(objects_nearby) == 0:
             raise ValueError('Marla said there must be an object!!')
 
@@ -271,10 +269,10 @@ def add_spectra(base, spectra, ignore_imacs=False):
         # now we search within the object radius
         # note that we need the indices here to keep track of specs and to write to base
 
-        objects_nearby_indices = np.where(base_sc.separation(spec_sc).arcsec < radius)[0]
+        objects_nearby_indices = np.where(base_sep < radius)[0]
         objects_nearby = base[objects_nearby_indices]
 
-        specs_nearby_indices = np.where(spectra_sc.separation(spec_sc).arcsec < radius)[0]
+        specs_nearby_indices = np.where(separation_from_xyz(spectra_xyz, spectra_xyz[i]) * 3600.0 < radius)[0]
         specs_nearby = spectra[specs_nearby_indices]
 
         done_spectra_indices.extend(specs_nearby_indices)
@@ -290,8 +288,7 @@ def add_spectra(base, spectra, ignore_imacs=False):
 
         # should prefer NSA
         best_spec = specs_nearby[specs_nearby['ZQUALITY'].data.argmax()]
-        best_spec_sc = SkyCoord(best_spec['RA'], best_spec['DEC'], unit='deg')
-        closest_object_index = SkyCoord(objects_nearby['RA'], objects_nearby['DEC'], unit='deg').separation(best_spec_sc).arcsec.argmin()
+        closest_object_index = angular_separation(objects_nearby['RA'], objects_nearby['DEC'], best_spec['RA'], best_spec['DEC']).argmin()
 
         original_base_index = objects_nearby_indices[closest_object_index]
         base['SPEC_REPEAT'][original_base_index] = spec_repeat
@@ -305,6 +302,7 @@ def add_spectra(base, spectra, ignore_imacs=False):
     return base
 
 
+@instrument('build.find_satelites')
 def find_satelites(base):
     """
     Add `SATS` column to the base catalog.
@@ -319,7 +317,7 @@ def find_satelites(base):
     base : astropy.table.Table
     """
 
-    if 'SATS' not in base:
+    if 'SATS' not in base.colnames:
         base['SATS'] = -1
 
     fill_values_by_query(base, C.is_galaxy & C.is_high_z, {'SATS':0})
@@ -330,6 +328,7 @@ def find_satelites(base):
     return base
 
 
+@instrument('build.apply_manual_fixes')
 def apply_manual_fixes(base):
     """
     Apply manual fixes to base catalog.
@@ -343,13 +342,17 @@ def apply_manual_fixes(base):
     -------
     base : astropy.table.Table
     """
-    for objid, fixes in fixes_by_sdss_objid.items():
-        fill_values_by_query(base, 'OBJID == {}'.format(objid), fixes)
+    objids_to_fix = IdSet(list(fixes_by_sdss_objid))
+    idx = objids_to_fix.index(base['OBJID'])
+    for row in np.flatnonzero(idx >= 0):
+        for c, v in fixes_by_sdss_objid[int(objids_to_fix.ids[idx[row]])].items():
+            base[c][row] = v
 
     return base
 
 
 
+@instrument('build.calc_stellar_mass')
 def calc_stellar_mass(base):
     """
     Calculate stellar mass based only on gi colors and redshift
@@ -365,4 +368,54 @@ def calc_stellar_mass(base):
     base : astropy.table.Table
     """
     #TODO: implement this
-    return base
\ No newline at end of file
+    return base
+
+def get_build_steps(host, wise=None, objects_to_remove=None, objects_to_add=None, nsa=None, spectra=None,
+                    saga_names=None, ignore_imacs=False):
+    """
+    Return the steps to build the base catalog of a single host, in order,
+    as a list of (function, keyword arguments). Steps whose input tables
+    are not given are skipped. Run them with `run_build_steps`.
+
+    Parameters
+    ----------
+    host : astropy.table.Row
+    wise : astropy.table.Table, optional
+    objects_to_remove : astropy.table.Table, optional
+    objects_to_add : astropy.table.Table, optional
+    nsa : astropy.table.Table, optional
+    spectra : astropy.table.Table, optional
+    saga_names : astropy.table.Table, optional
+    ignore_imacs : bool, optional
+
+    Returns
+    -------
+    steps : list
+    """
+    steps = [(add_host_info, {'host': host, 'saga_names': saga_names, 'overwrite_if_different_host': True})]
+    if wise is not None:
+        steps.append((add_more_photometric_data, {'wise': wise}))
+    if objects_to_remove is not None and objects_to_add is not None:
+        steps.append((set_remove_flag, {'objects_to_remove': objects_to_remove, 'objects_to_add': objects_to_add}))
+    if nsa is not None:
+        steps.append((fix_photometry_with_nsa, {'nsa': nsa}))
+    if spectra is not None:
+        steps.append((add_spectra, {'spectra': spectra, 'ignore_imacs': ignore_imacs}))
+    steps.append((find_satelites, {}))
+    steps.append((apply_manual_fixes, {}))
+    steps.append((calc_stellar_mass, {}))
+    return steps
+
+
+def run_build_steps(base, steps):
+    """
+    Run the build `steps` (see `get_build_steps`) on `base`.
+    `base` is modified in-place.
+
+    Returns
+    -------
+    base : astropy.table.Table
+    """
+    for func, kwargs in steps:
+        base = func(base, **kwargs)
+    return base
@@ -0,0 +1,232 @@
+"""
+SAGA.objects.build_pipeline
+
+This file defines the BuildPipeline class
+"""
+import os
+import inspect
+import hashlib
+import logging
+import numpy as np
+from ..utils import atomic_output_file, host_context
+from .build import run_build_steps
+from .result_cache import _update_code_hash
+from .sdss import run_casjob, construct_query
+
+__all__ = ['BuildPipeline']
+
+
+def _update_table_hash(h, table):
+    h.update(repr(table.colnames).encode())
+    for c in table.colnames:
+        col = table[c]
+        data = np.ascontiguousarray(np.ma.getdata(col))
+        h.update(data.dtype.str.encode())
+        h.update(repr(data.shape).encode())
+        if data.dtype.hasobject:
+            h.update(repr(data.tolist()).encode())
+        else:
+            h.update(data.view(np.uint8).reshape(-1).data)
+        if getattr(col, 'mask', None) is not None:
+            h.update(np.ascontiguousarray(np.ma.getmaskarray(col)).tobytes())
+
+
+class BuildPipeline(object):
+    """
+    Build base catalogs with a checkpoint of each host's table after every
+    build stage.
+
+    A stage is rerun when its checkpoint is missing or its key (a hash of
+    the previous key, the stage code and its arguments) has changed.
+    Only the code of the stage functions is hashed, not that of the
+    functions they call; use `clear` after changing those.
+
+    Parameters
+    ----------
+    checkpoint_dir : str
+    keep_checkpoints : bool, optional
+        If set to False, the checkpoints of a host are deleted once its
+        output file is written (default: True)
+
+    Examples
+    --------
+    >>> pipeline = BuildPipeline('/path/to/checkpoints')
+    >>> get_steps = lambda host: build.get_build_steps(host, wise=wise, nsa=nsa, spectra=spectra,
+    ...                                                objects_to_remove=remove_list, objects_to_add=add_list)
+    >>> failed = pipeline.build(hosts, get_steps, 'sdss/sdss_nsa{}.fits.gz', 'base_catalogs/base_sql_nsa{}.fits.gz')
+    """
+    def __init__(self, checkpoint_dir, keep_checkpoints=True):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_checkpoints = keep_checkpoints
+        self._table_hashes = dict()
+        self.stages_run = 0
+        self.stages_reused = 0
+
+    def _value_hash(self, h, value):
+        from astropy.table import Table, Row
+        if isinstance(value, Table):
+            # tables are usually shared by all hosts, so their hashes are kept
+            entry = self._table_hashes.get(id(value))
+            if entry is None or entry[0] is not value:
+                th = hashlib.sha1()
+                _update_table_hash(th, value)
+                entry = (value, th.hexdigest())
+                self._table_hashes[id(value)] = entry
+            h.update(entry[1].encode())
+        elif isinstance(value, Row):
+            h.update(repr(list(zip(value.colnames, value.as_void().tolist()))).encode())
+        else:
+            h.update(repr(value).encode())
+
+    def stage_keys(self, steps, input_key):
+        """
+        Return the list of (stage name, key) of the build `steps`;
+        `input_key` identifies the input table.
+        """
+        keys = []
+        key = repr(input_key)
+        for func, kwargs in steps:
+            func = inspect.unwrap(func)
+            h = hashlib.sha1(key.encode())
+            h.update(func.__qualname__.encode())
+            _update_code_hash(h, func.__code__)
+            for name in sorted(kwargs):
+                h.update(name.encode())
+                self._value_hash(h, kwargs[name])
+            key = h.hexdigest()
+            keys.append((func.__name__, key))
+        return keys
+
+    def _host_dir(self, host_id):
+        return os.path.join(self.checkpoint_dir, 'nsa{}'.format(host_id))
+
+    def _checkpoint_path(self, host_id, i, name, key):
+        return os.path.join(self._host_dir(host_id), '{:02d}_{}_{}.fits'.format(i, name, key[:16]))
+
+    def _write_checkpoint(self, table, host_id, i, name, key):
+        host_dir = self._host_dir(host_id)
+        if not os.path.isdir(host_dir):
+            os.makedirs(host_dir)
+        path = self._checkpoint_path(host_id, i, name, key)
+        with atomic_output_file(path) as f:
+            table.write(f, format='fits')
+        # checkpoints of this stage with other keys are stale
+        prefix = '{:02d}_'.format(i)
+        for filename in os.listdir(host_dir):
+            if filename.startswith(prefix) and filename.endswith('.fits') and filename != os.path.basename(path):
+                os.unlink(os.path.join(host_dir, filename))
+
+    def clear(self, host_id=None):
+        """delete the checkpoints of host `host_id` (or of all hosts)"""
+        if not os.path.isdir(self.checkpoint_dir):
+            return
+        host_dirs = [self._host_dir(host_id)] if host_id is not None else \
+            [os.path.join(self.checkpoint_dir, d) for d in os.listdir(self.checkpoint_dir) if d.startswith('nsa')]
+        for host_dir in host_dirs:
+            if not os.path.isdir(host_dir):
+                continue
+            for filename in os.listdir(host_dir):
+                if filename.endswith('.fits'):
+                    os.unlink(os.path.join(host_dir, filename))
+            os.rmdir(host_dir)
+
+    def download(self, host, sdss_path, radius=1.0):
+        """
+        Download the SDSS catalog of `host` from CasJobs to `sdss_path`,
+        unless the file exists (the download stage).
+        """
+        if os.path.isfile(sdss_path):
+            return
+        db_table_name = 'saga_nsa{}'.format(host['NSAID'])
+        run_casjob(construct_query(db_table_name, host['RA'], host['Dec'], radius), db_table_name, sdss_path,
+                   compress=sdss_path.endswith('.gz'))
+
+    def build_host(self, host, steps, sdss_path, output_path=None, resume=True):
+        """
+        Build the base catalog of a single host from its last valid checkpoint.
+
+        Parameters
+        ----------
+        host : astropy.table.Row
+        steps : list
+            (function, keyword arguments) pairs
+        sdss_path : str
+        output_path : str, optional
+            If set, the base catalog is written there
+        resume : bool, optional
+            If set to False, all stages are rerun (default: True)
+
+        Returns
+        -------
+        base : astropy.table.Table
+        """
+        from astropy.table import Table
+        host_id = int(host['NSAID'])
+        with host_context(host_id):
+            self.download(host, sdss_path)
+            stat = os.stat(sdss_path)
+            keys = self.stage_keys(steps, (os.path.abspath(sdss_path), stat.st_mtime_ns, stat.st_size))
+
+            base = None
+            start = 0
+            if resume:
+                for i in range(len(keys) - 1, -1, -1):
+                    path = self._checkpoint_path(host_id, i, *keys[i])
+                    if os.path.isfile(path):
+                        base = Table.read(path, format='fits')
+                        start = i + 1
+                        break
+            if base is None:
+                base = Table.read(sdss_path, format='fits')
+            self.stages_reused += start
+
+            for i in range(start, len(steps)):
+                base = run_build_steps(base, steps[i:i+1])
+                self._write_checkpoint(base, host_id, i, *keys[i])
+                self.stages_run += 1
+
+            if output_path is not None:
+                with atomic_output_file(output_path, compress=output_path.endswith('.gz')) as f:
+                    base.write(f, format='fits')
+                if not self.keep_checkpoints:
+                    self.clear(host_id)
+        return base
+
+    def build(self, hosts, get_steps, sdss_path_template, output_path_template, resume=True, stop_on_error=False):
+        """
+        Build the base catalogs of `hosts`. A host that fails is logged and
+        skipped, unless `stop_on_error` is set.
+
+        Parameters
+        ----------
+        hosts : astropy.table.Table
+        get_steps : callable
+            host -> build steps (e.g. a wrapper of `build.get_build_steps`)
+        sdss_path_template : str
+            path of the SDSS catalogs, with `{}` for the host NSAID
+        output_path_template : str
+            path of the base catalogs, with `{}` for the host NSAID
+        resume : bool, optional
+        stop_on_error : bool, optional
+
+        Returns
+        -------
+        failed : dict
+            host NSAID -> exception, for the hosts that failed
+        """
+        log = logging.getLogger(__name__)
+        failed = dict()
+        try:
+            for host in hosts:
+                host_id = int(host['NSAID'])
+                try:
+                    self.build_host(host, get_steps(host), sdss_path_template.format(host_id),
+                                    output_path_template.format(host_id), resume=resume)
+                except Exception as e:  # pylint: disable=broad-except
+                    if stop_on_error:
+                        raise
+                    log.error('building host %s failed: %r', host_id, e)
+                    failed[host_id] = e
+        finally:
+            self._table_hashes.clear()
+        return failed
@@ -0,0 +1,234 @@
+"""
+SAGA.objects.chunked_build
+
+Building base catalogs of very large host fields in bounded memory
+"""
+import io
+import os
+import gzip
+import shutil
+import tempfile
+import numpy as np
+from ..utils import gzip_compress, lazy_import
+from .build import run_build_steps
+
+fits = lazy_import('astropy.io.fits')
+
+__all__ = ['build_chunked', 'estimate_chunk_rows']
+
+# the build adds about 30 columns (host info, spectra, flags); bytes per row
+_added_bytes_per_row = 512
+
+# a chunk uses several times its size on disk (strings read as unicode,
+# copies and temporaries in the build steps)
+_memory_factor = 8
+
+# build step arguments that are catalogs of sky positions, cut to each chunk
+_spatial_arguments = ('wise', 'nsa', 'spectra')
+
+
+def estimate_chunk_rows(row_bytes, max_memory):
+    """
+    Return the number of base catalog rows per chunk so that a chunk build
+    uses about `max_memory` bytes.
+
+    Parameters
+    ----------
+    row_bytes : int
+        size of a row of the input base catalog
+    max_memory : int
+        in bytes
+
+    Returns
+    -------
+    chunk_rows : int
+    """
+    return max(int(max_memory // ((row_bytes + _added_bytes_per_row) * _memory_factor)), 1)
+
+
+def _dec_range_mask(table, dec_min, dec_max):
+    dec = np.asarray(table['DEC'])
+    return (dec >= dec_min) & (dec <= dec_max)
+
+
+def _cut_spatial(kwargs, dec_min, dec_max):
+    out = dict(kwargs)
+    for key in _spatial_arguments:
+        if out.get(key) is not None:
+            out[key] = out[key][_dec_range_mask(out[key], dec_min, dec_max)]
+    return out
+
+
+def _chunk_boundaries(dec_sorted, max_rows, margin):
+    """
+    split the sorted Dec values into strips (cores) such that each strip
+    extended by `margin` (deg) has at most `max_rows` rows; rows with the
+    same Dec stay in the same strip
+    """
+    n = len(dec_sorted)
+    upper = np.searchsorted(dec_sorted, dec_sorted + margin, 'right')
+    boundaries = []
+    start = 0
+    while start < n:
+        lower = int(np.searchsorted(dec_sorted, dec_sorted[start] - margin, 'left'))
+        end = int(np.searchsorted(upper, lower + max_rows, 'right'))
+        if end <= start:
+            raise ValueError('the halo alone has more than {} rows; increase `max_memory` or decrease `halo`'.format(max_rows))
+        end = int(np.searchsorted(dec_sorted, dec_sorted[end-1], 'right'))
+        boundaries.append((start, end))
+        start = end
+    return boundaries
+
+
+def _decompressed_path(path, tmp_dir):
+    if not path.endswith('.gz'):
+        return path, False
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.fits')
+    with os.fdopen(fd, 'wb') as f_out, gzip.open(path, 'rb') as f_in:
+        shutil.copyfileobj(f_in, f_out)
+    return tmp_path, True
+
+
+def _fits_table_rows(table):
+    """return (header, raw rows) of `table` as a fits binary table"""
+    buf = io.BytesIO()
+    table.write(buf, format='fits')
+    data = buf.getvalue()
+    with fits.open(io.BytesIO(data)) as hdul:
+        header = hdul[1].header.copy()
+        offset = hdul[1].fileinfo()['datLoc']
+    if header.get('PCOUNT', 0):
+        raise ValueError('variable-length array columns are not supported')
+    row_dtype = np.dtype((np.void, header['NAXIS1']))
+    return header, np.frombuffer(data, row_dtype, count=header['NAXIS2'], offset=offset)
+
+
+def _create_output(path, header, n_rows):
+    """
+    create a fits file with a zero-filled binary table of `n_rows` rows
+    and return a writable memory map of its rows
+    """
+    header = header.copy()
+    header['NAXIS2'] = n_rows
+    header_bytes = (fits.PrimaryHDU().header.tostring() + header.tostring()).encode('ascii')
+    data_bytes = header['NAXIS1'] * n_rows
+    with open(path, 'wb') as f:
+        f.write(header_bytes)
+        f.truncate(len(header_bytes) + -(-data_bytes // 2880) * 2880)
+    return np.memmap(path, np.dtype((np.void, header['NAXIS1'])), mode='r+', offset=len(header_bytes), shape=(n_rows,))
+
+
+def _same_format(header1, header2):
+    return all(header1.get(k) == header2.get(k) for k in header1 if k.startswith(('NAXIS1', 'TFIELDS', 'TTYPE', 'TFORM')))
+
+
+def build_chunked(input_path, output_path, steps, max_memory=(1 << 30), halo=120.0, chunk_rows=None,
+                  compress_threads=1, tmp_dir=None):
+    """
+    Build a base catalog one Dec strip at a time. The output is the same as
+    that of `run_build_steps(Table.read(input_path), steps)`, as long as
+    `halo` is larger than the match radii of the steps.
+
+    Parameters
+    ----------
+    input_path : str
+        fits file (optionally gzipped) of the base catalog
+    output_path : str
+        the output is gzipped if `output_path` ends with '.gz'
+    steps : list
+        (function, keyword arguments) pairs
+    max_memory : int, optional
+        in bytes, used to set `chunk_rows` if it is not given (default: 1 GB)
+    halo : float, optional
+        in arcsec (default: 120)
+    chunk_rows : int, optional
+        maximal number of base catalog rows (core and halo) per chunk
+    compress_threads : int, optional
+    tmp_dir : str, optional
+        directory for temporary files (default: the directory of `output_path`)
+
+    Returns
+    -------
+    n_chunks : int
+    """
+    from astropy.table import Table
+
+    output_path = os.path.abspath(output_path)
+    if tmp_dir is None:
+        tmp_dir = os.path.dirname(output_path)
+    halo_deg = halo / 3600.0
+
+    input_path, input_is_tmp = _decompressed_path(input_path, tmp_dir)
+    fd, tmp_output = tempfile.mkstemp(dir=tmp_dir, suffix='.fits')
+    os.close(fd)
+    os.unlink(tmp_output)
+
+    try:
+        with fits.open(input_path, memmap=True) as hdul_in:
+            header_in = hdul_in[1].header.copy()
+            row_dtype = hdul_in[1].data.dtype
+            offset = hdul_in[1].fileinfo()['datLoc']
+        n_rows = header_in['NAXIS2']
+        if chunk_rows is None:
+            chunk_rows = estimate_chunk_rows(header_in['NAXIS1'], max_memory)
+
+        # the raw rows are mapped with numpy, since indexing a memory-mapped
+        # FITS_rec converts (and keeps) whole columns
+        rows_in = np.memmap(input_path, row_dtype, mode='r', offset=offset, shape=(n_rows,)) if n_rows else None
+        try:
+            dec = np.array(rows_in['DEC'], np.float64) if n_rows else np.zeros(0)
+            order = np.argsort(dec, kind='stable')
+            dec_sorted = dec[order]
+            del dec
+
+            n_chunks = 0
+            rows_out = None
+            for start, end in _chunk_boundaries(dec_sorted, chunk_rows, 2.0*halo_deg):
+                dec_min = dec_sorted[start]
+                dec_max = dec_sorted[end-1]
+                i = int(np.searchsorted(dec_sorted, dec_min - 2.0*halo_deg, 'left'))
+                j = int(np.searchsorted(dec_sorted, dec_max + 2.0*halo_deg, 'right'))
+                rows = np.sort(order[i:j])
+                is_core = np.zeros(len(rows), bool)
+                is_core[np.searchsorted(rows, order[start:end])] = True
+
+                chunk = Table.read(fits.BinTableHDU(data=rows_in[rows], header=header_in))
+                chunk_steps = [(func, _cut_spatial(kwargs, dec_min - halo_deg, dec_max + halo_deg))
+                               for func, kwargs in steps]
+                chunk = run_build_steps(chunk, chunk_steps)
+                del chunk_steps
+                header, core_data = _fits_table_rows(chunk[is_core])
+                del chunk
+
+                # the rows of all chunks are written into one table, so they need the same format
+                if rows_out is None:
+                    header_out = header
+                    rows_out = _create_output(tmp_output, header, n_rows)
+                elif not _same_format(header_out, header):
+                    raise ValueError('the build steps give different columns in different chunks')
+                rows_out[rows[is_core]] = core_data
+                del core_data
+                n_chunks += 1
+
+            if rows_out is not None:
+                rows_out.flush()
+                del rows_out
+
+            if not n_chunks:
+                # an empty catalog: build it in memory to get its columns
+                table = run_build_steps(Table.read(input_path, hdu=1), steps)
+                table.write(tmp_output, format='fits')
+        finally:
+            del rows_in
+
+        if output_path.endswith('.gz'):
+            gzip_compress(tmp_output, output_path, threads=compress_threads)
+        else:
+            os.replace(tmp_output, output_path)
+    finally:
+        if input_is_tmp:
+            os.unlink(input_path)
+        if os.path.exists(tmp_output):
+            os.unlink(tmp_output)
+
+    return n_chunks
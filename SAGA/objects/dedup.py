@@ -0,0 +1,143 @@
+"""
+SAGA.objects.dedup
+
+This file defines the DedupCatalog class
+"""
+import numpy as np
+from easyquery import Query
+from astropy.table import Table
+from ..utils import concatenate_tables, compile_query
+
+__all__ = ['DedupCatalog', 'default_host_columns']
+
+# columns that the build sets for each host (besides HOST_*): the distances
+# to the host, REMOVE (set_remove_flag, fix_photometry_with_nsa and
+# add_spectra set it from the host field) and SATS
+default_host_columns = ('RHOST_ARCM', 'RHOST_KPC', 'REMOVE', 'SATS')
+
+
+def _is_host_column(name, host_columns):
+    return name.startswith('HOST_') or name in host_columns
+
+
+class DedupCatalog(object):
+    """
+    Objects of many hosts, with per-object columns stored once.
+
+    Use `from_tables` (or `ObjectCatalog.load_dedup`) to create one.
+
+    Attributes
+    ----------
+    objects : astropy.table.Table
+        one row per unique OBJID (sorted by OBJID), per-object columns only
+    associations : astropy.table.Table
+        one row per (object, host) pair, with OBJ_INDEX (row in `objects`)
+        and the per-host columns
+
+    Examples
+    --------
+    >>> dedup = saga_objects.load_dedup(hosts='all', cuts=C.basic_cut)
+    >>> len(dedup.objects), len(dedup.associations)
+    >>> sats = dedup.view(['OBJID', 'HOST_NSAID', 'r_mag', 'SPEC_Z'], C.is_sat)
+    """
+    def __init__(self, objects, associations):
+        self.objects = objects
+        self.associations = associations
+
+    @classmethod
+    def from_tables(cls, tables, host_columns=default_host_columns):
+        """
+        Build a DedupCatalog from an iterable of base catalogs (each table
+        is released after it is processed, so `tables` can be a generator).
+        For objects that appear in several tables, per-object columns are
+        taken from the first table.
+
+        Parameters
+        ----------
+        tables : iterable of astropy.table.Table
+            must have an OBJID column
+        host_columns : iterable of str, optional
+            per-host columns, in addition to those starting with HOST_
+            (default: RHOST_ARCM, RHOST_KPC, REMOVE, SATS)
+        """
+        host_columns = set(host_columns)
+        seen = [np.zeros(0, np.int64)]
+        associations = []
+
+        def iter_new_objects():
+            for t in tables:
+                objid = np.asarray(t['OBJID'], dtype=np.int64)
+                host_cols = [c for c in t.colnames if _is_host_column(c, host_columns)]
+                object_cols = [c for c in t.colnames if not _is_host_column(c, host_columns)]
+
+                assoc = t[host_cols] if host_cols else Table()
+                assoc['OBJID'] = objid
+                associations.append(assoc)
+
+                _, first = np.unique(objid, return_index=True)
+                first.sort()
+                idx = np.searchsorted(seen[0], objid[first])
+                idx[idx >= len(seen[0])] = 0
+                is_new = (seen[0][idx] != objid[first]) if len(seen[0]) else np.ones(len(first), bool)
+                new_rows = first[is_new]
+                seen[0] = np.union1d(seen[0], objid[new_rows])
+                yield t[object_cols][new_rows]
+
+        objects = concatenate_tables(iter_new_objects())
+        if len(objects):
+            objects = objects[np.argsort(np.asarray(objects['OBJID']), kind='stable')]
+
+        associations = concatenate_tables(associations)
+        if len(associations):
+            associations['OBJ_INDEX'] = np.searchsorted(np.asarray(objects['OBJID']), np.asarray(associations['OBJID']))
+            del associations['OBJID']
+        return cls(objects, associations)
+
+    def __len__(self):
+        return len(self.associations)
+
+    @property
+    def colnames(self):
+        return [c for c in self.associations.colnames if c != 'OBJ_INDEX'] + self.objects.colnames
+
+    @property
+    def nbytes(self):
+        return sum(t[c].nbytes for t in (self.objects, self.associations) for c in t.colnames)
+
+    def view(self, columns=None, cuts=None, hosts=None):
+        """
+        Return an (object, host) table, joining the needed per-object
+        columns on demand. This is equivalent to stacking the base catalogs
+        of all hosts, but only materializes the requested columns and rows.
+
+        Parameters
+        ----------
+        columns : list, optional
+            columns to return (default: all)
+        cuts : easyquery.Query, str, tuple, optional
+            applied to the joined rows
+        hosts : int or list of int, optional
+            only return rows of these host NSAIDs
+
+        Returns
+        -------
+        table : astropy.table.Table
+        """
+        q = compile_query(cuts)
+        names = self.colnames if columns is None else list(columns)
+        needed = list(names) + [c for c in Query(cuts).variable_names if c not in names]
+
+        rows = np.arange(len(self.associations))
+        if hosts is not None:
+            rows = rows[np.isin(np.asarray(self.associations['HOST_NSAID']), np.atleast_1d(hosts))]
+
+        obj_index = np.asarray(self.associations['OBJ_INDEX'])[rows]
+        out = Table()
+        for c in needed:
+            if c in self.associations.colnames:
+                out[c] = self.associations[c][rows]
+            else:
+                out[c] = self.objects[c][obj_index]
+        if cuts is not None:
+            out = q.filter(out)
+        return out[names]
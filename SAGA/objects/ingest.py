@@ -0,0 +1,164 @@
+"""
+SAGA.objects.ingest
+
+Adding new spectra to built base catalogs without rebuilding them
+"""
+import numpy as np
+from ..utils import SPEED_OF_LIGHT, concatenate_tables, host_context
+from ..utils.geometry import search_around
+from ..hosts import HostCatalog
+from ..database.spectra_store import _as_str_array
+from .build import add_spectra, find_satelites
+
+__all__ = ['ingest_spectra', 'remove_repeated_spectra']
+
+# add_spectra only uses spectra within this distance (in deg) of the host
+_host_radius = 1.0
+
+# add_spectra matches a spectrum to objects within the object radius,
+# PETRORAD_R (up to 30 arcsec)
+_match_radius_arcsec = 30.0
+
+
+def remove_repeated_spectra(new_spectra, existing_spectra=None, max_separation=1.0, max_velocity=50.0):
+    """
+    Return the rows of `new_spectra` that are not repeats, i.e., not within
+    `max_separation` and `max_velocity` of a spectrum from the same telescope
+    in `existing_spectra` (or of a better one in `new_spectra`).
+
+    Parameters
+    ----------
+    new_spectra : astropy.table.Table
+    existing_spectra : astropy.table.Table, optional
+    max_separation : float, optional
+        in arcsec (default: 1)
+    max_velocity : float, optional
+        in km/s (default: 50)
+
+    Returns
+    -------
+    spectra : astropy.table.Table
+    """
+    max_dz = max_velocity / SPEED_OF_LIGHT
+    radius = max_separation / 3600.0
+
+    def repeat_pairs(t1, t2):
+        idx1, idx2, _ = search_around(t1['RA'], t1['DEC'], t2['RA'], t2['DEC'], radius)
+        mask = np.abs(np.asarray(t1['SPEC_Z'])[idx1] - np.asarray(t2['SPEC_Z'])[idx2]) < max_dz
+        mask &= _as_str_array(t1['TELNAME'])[idx1] == _as_str_array(t2['TELNAME'])[idx2]
+        return idx1[mask], idx2[mask]
+
+    keep = np.ones(len(new_spectra), bool)
+    if existing_spectra is not None and len(existing_spectra) and len(new_spectra):
+        keep[repeat_pairs(new_spectra, existing_spectra)[0]] = False
+
+    idx1, idx2 = repeat_pairs(new_spectra, new_spectra)
+    quality = np.asarray(new_spectra['ZQUALITY'])
+    worse = (quality[idx1] < quality[idx2]) | ((quality[idx1] == quality[idx2]) & (idx1 > idx2))
+    keep[idx1[worse]] = False
+
+    return new_spectra if keep.all() else new_spectra[keep]
+
+
+def _patch_host(base, new_spectra, old_spectra, patch_radius, ignore_imacs):
+    """
+    return (row indices, patched rows) of the rows of `base` that change
+    """
+    # objects that a spectrum in the patch can be matched to
+    obj_idx = np.unique(search_around(base['RA'], base['DEC'], new_spectra['RA'], new_spectra['DEC'],
+                                      (patch_radius + _match_radius_arcsec) / 3600.0)[0])
+    if not len(obj_idx):
+        return obj_idx, None
+
+    spectra = concatenate_tables([old_spectra, new_spectra]) if len(old_spectra) else new_spectra
+    spec_idx = np.unique(search_around(spectra['RA'], spectra['DEC'], new_spectra['RA'], new_spectra['DEC'],
+                                       patch_radius / 3600.0)[0])
+
+    rows = base[obj_idx]
+    patched = find_satelites(add_spectra(rows.copy(), spectra[spec_idx], ignore_imacs=ignore_imacs))
+
+    missing = [c for c in patched.colnames if c not in rows.colnames]
+    if missing:
+        raise ValueError('base catalog has no columns {}; build it before ingesting spectra'.format(missing))
+
+    changed = np.zeros(len(rows), bool)
+    for c in patched.colnames:
+        changed |= np.asarray(rows[c] != patched[c]).reshape(len(rows), -1).any(axis=1)
+    return obj_idx[changed], patched[changed]
+
+
+def ingest_spectra(database, new_spectra, run=None, patch_radius=60.0, ignore_imacs=False):
+    """
+    Append new spectra to the spectra store, and re-run `add_spectra` and
+    `find_satelites` only on the base catalog rows near them.
+    Only the base catalogs that change are rewritten.
+
+    Parameters
+    ----------
+    database : SAGA.Database object
+    new_spectra : astropy.table.Table
+        with the columns of the spectra store
+    run : str, optional
+        name of the run (see `SpectraStore.append`)
+    patch_radius : float, optional
+        radius (in arcsec) around each new spectrum in which spectra are
+        re-matched to objects (default: 60)
+    ignore_imacs : bool, optional
+        passed to `add_spectra`
+
+    Returns
+    -------
+    changed_rows : dict
+        host NSAID -> number of base catalog rows that changed
+    """
+    store = database['spectra_store']
+    if not store.exists():
+        raise ValueError('the spectra store does not exist; create it with SpectrumCatalog.build_store')
+
+    hosts = HostCatalog(database).load()
+    host_idx = search_around(hosts['RA'], hosts['Dec'], new_spectra['RA'], new_spectra['DEC'], _host_radius)[0]
+    hosts = hosts[np.unique(host_idx)]
+
+    old_spectra = dict()
+    for host in hosts:
+        old_spectra[int(host['NSAID'])] = store.read(ra=host['RA'], dec=host['Dec'], radius=_host_radius)
+    if old_spectra:
+        new_spectra = remove_repeated_spectra(new_spectra, concatenate_tables(old_spectra.values()))
+    else:
+        new_spectra = remove_repeated_spectra(new_spectra)
+
+    # compute the patches first, so that nothing is written if add_spectra fails
+    patches = dict()
+    for host in hosts:
+        host_id = int(host['NSAID'])
+        with host_context(host_id):
+            spectra_idx = search_around(new_spectra['RA'], new_spectra['DEC'], host['RA'], host['Dec'], _host_radius)[0]
+            if not len(spectra_idx):
+                continue
+            base = database['base', host_id].read()
+            patch = _patch_host(base, new_spectra[spectra_idx], old_spectra[host_id], patch_radius, ignore_imacs)
+            if len(patch[0]):
+                patches[host_id] = patch
+            del base
+
+    if len(new_spectra):
+        store.append(new_spectra, run=run)
+
+    try:
+        sky_catalog = database['base_healpix']
+    except KeyError:
+        sky_catalog = None
+    sky_sources = set(sky_catalog.sources) if sky_catalog is not None and sky_catalog.exists() else set()
+
+    changed_rows = dict()
+    for host_id, (rows, patched) in patches.items():
+        with host_context(host_id):
+            base = database['base', host_id].read()
+            for c in patched.colnames:
+                base[c][rows] = patched[c]
+            database['base', host_id].write(base, overwrite=True)
+            source = 'nsa{}'.format(host_id)
+            if source in sky_sources:
+                sky_catalog.add_table(base, source, overwrite=True)
+        changed_rows[host_id] = len(rows)
+    return changed_rows
@@ -1,14 +1,42 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from astropy.table import vstack
+from astropy.table import Table
 from easyquery import Query
 from . import cuts as C
 from ..hosts import HostCatalog
+from ..utils import profile_stage, host_context, compile_query, concatenate_tables, prefetch, IdSet
+from .result_cache import ResultCache, canonical_query_key
+from .aggregation import make_reducer
+from .dedup import DedupCatalog, default_host_columns
+
+
+_sdss_bands = 'ugriz'
+_sdss_colors = tuple(map(''.join, zip(_sdss_bands[:-1], _sdss_bands[1:])))
 
 
 def _slice_columns(table, columns):
     return table[columns] if columns is not None else table
 
 
+def _get_columns_to_read(columns, query, extra_columns=()):
+    """
+    return the list of columns that need to be read from disk in order to
+    apply `query` and return `columns`, or None if all columns are needed
+    """
+    if columns is None:
+        return None
+    derived = set(_sdss_colors)
+    derived.update('{}_mag'.format(b) for b in _sdss_bands)
+    derived.update('{}_err'.format(c) for c in _sdss_colors)
+    needed = set(columns).union(Query(query).variable_names, extra_columns)
+    needed -= derived
+    needed.update(_sdss_bands)
+    needed.update('EXTINCTION_{}'.format(b.upper()) for b in _sdss_bands)
+    needed.update('{}_err'.format(b) for b in _sdss_bands)
+    return sorted(needed)
+
+
 class ObjectCatalog(object):
     """
     This class provides a high-level interface to access object catalogs
@@ -17,6 +45,10 @@ class ObjectCatalog(object):
     Parameters
     ----------
     database : SAGA.Database object
+    cache : bool or SAGA.objects.ResultCache, optional
+        If set, memoize the filtered tables returned by `load`, keyed by host,
+        cuts, columns and the version of the source file.
+        Set to True to use a ResultCache with default settings.
 
     Returns
     -------
@@ -31,26 +63,77 @@ class ObjectCatalog(object):
     >>> base_anak = saga_objects.load(hosts='AnaK')
 
     Here specs and base_anak are both astropy tables.
+
+    To memoize repeated loads (up to 4 GB in memory, and also on disk):
+    >>> saga_objects = SAGA.ObjectCatalog(saga_database, cache=SAGA.objects.ResultCache(4 << 30, '/tmp/saga_cache'))
     """
-    def __init__(self, database):
+    def __init__(self, database, cache=None):
         self._database = database
         self._hosts = HostCatalog(self._database)
+        self._cache = ResultCache() if cache is True else (None if cache is False else cache)
+
+
+    def _cached(self, source, query, columns, load_func, extra_key=()):
+        """
+        return load_func() through the result cache, if the cache is enabled
+        and the query and the source version can be expressed as a key
+        """
+        if self._cache is None:
+            return load_func()
+
+        query_key = canonical_query_key(query)
+        version = self._database[source].get_version()
+        if query_key is None or version is None:
+            return load_func()
+
+        key = (source, query_key, None if columns is None else tuple(columns), version) + tuple(extra_key)
+        table = self._cache.get(key)
+        if table is None:
+            table = load_func()
+            self._cache.put(key, table)
+        return table
 
 
     @staticmethod
     def _add_colors(table):
-        sdss_bands = 'ugriz'
-        for b in sdss_bands:
+        for b in _sdss_bands:
             table['{}_mag'.format(b)] = table[b] - table['EXTINCTION_{}'.format(b.upper())]
 
-        for color in map(''.join, zip(sdss_bands[:-1], sdss_bands[1:])):
+        for color in _sdss_colors:
             table[color] = table['{}_mag'.format(color[0])] - table['{}_mag'.format(color[1])]
             table['{}_err'.format(color)] = np.sqrt(table['{}_err'.format(color[0])]**2.0 + table['{}_err'.format(color[1])]**2.0)
 
         return table
 
 
-    def load(self, hosts=None, has_spec=None, cuts=None, iter_hosts=False, columns=None):
+    def _load_host(self, host, query, columns, columns_to_read):
+        def load_func():
+            t = self._add_colors(self._database['base', host].read(columns=columns_to_read))
+            with profile_stage('cuts', rows_in=len(t)) as stage:
+                t = query.filter(t)
+                stage.rows_out = len(t)
+            return _slice_columns(t, columns)
+
+        with host_context(host):
+            return self._cached(('base', host), query, columns, load_func)
+
+
+    def _load_host_parquet(self, host, query, columns, columns_to_read):
+        def load_func():
+            # the cuts are only pushed down here, since they may use derived columns (colors)
+            t = self._database['base_parquet'].scan(columns=columns_to_read, cuts=query, hosts=[host], apply_cuts=False)
+            t = self._add_colors(t)
+            with profile_stage('cuts', rows_in=len(t)) as stage:
+                t = query.filter(t)
+                stage.rows_out = len(t)
+            return _slice_columns(t, columns)
+
+        with host_context(host):
+            return self._cached('base_parquet', query, columns, load_func, (host,))
+
+
+    def load(self, hosts=None, has_spec=None, cuts=None, iter_hosts=False, columns=None, prefetch_hosts=0,
+             from_parquet=False):
         """
         load object catalogs (aka "base catalogs")
 
@@ -72,6 +155,19 @@ class ObjectCatalog(object):
         columns : list, optional
             If set, only load a subset of columns
 
+        prefetch_hosts : int, optional
+            Only used when iter_hosts is True (and has_spec is not).
+            If set to N > 0, read, decompress and filter up to N hosts ahead
+            in a background thread while the caller works on the current one.
+            Closing the iterator early stops the background thread.
+
+        from_parquet : bool, optional
+            If set to True, read the base catalogs from the host-partitioned
+            Parquet dataset (see `build_parquet_dataset`; requires pyarrow)
+            instead of the fits files. Only the needed columns are read,
+            and the cuts are used to skip rows while reading.
+            Cannot be used with has_spec=True.
+
         Returns
         -------
         objects : astropy.table.Table
@@ -93,21 +189,40 @@ class ObjectCatalog(object):
         and stored as a list:
         >>> base_tables = list(saga_objects.load(hosts='paper1', cuts=C.basic_cut, iter_hosts=True))
 
+        Loop over all hosts, reading the next host while the current one is processed:
+        >>> for base in saga_objects.load(cuts=C.basic_cut, iter_hosts=True, prefetch_hosts=1):
+        ...     do_something(base)
+
         Load base catalog for all paper1 hosts, with some basic cuts applied,
         and stored as one single big table:
         >>> bases_table = saga_objects.load(hosts='paper1', cuts=C.basic_cut)
+
+        To hand the result to pandas/Arrow tooling without copying its unmasked numeric columns:
+        >>> batches = SAGA.database.to_record_batches(bases_table)
         """
+        if has_spec and from_parquet:
+            raise ValueError('spectra are not stored in the Parquet dataset; use from_parquet=False with has_spec=True')
+
         if has_spec:
-            t = self._database['spectra_clean'].read()
+            host_ids = None if hosts is None else self._hosts.resolve_id(hosts)
+            columns_to_read = _get_columns_to_read(columns, cuts, ['HOST_NSAID'])
 
-            if hosts is not None:
-                host_ids = self._hosts.resolve_id(hosts)
-                t = Query((lambda x: np.in1d(x, host_ids), 'HOST_NSAID')).filter(t)
+            def load_func():
+                t = self._database['spectra_clean'].read(columns=columns_to_read)
 
-            t = self._add_colors(t)
+                if host_ids is not None:
+                    t = Query((lambda x: np.isin(x, host_ids), 'HOST_NSAID')).filter(t)
+
+                t = self._add_colors(t)
+
+                if cuts is not None:
+                    with profile_stage('cuts', rows_in=len(t)) as stage:
+                        t = compile_query(cuts).filter(t)
+                        stage.rows_out = len(t)
+                return t
 
-            if cuts is not None:
-                t = Query(cuts).filter(t)
+            extra_key = () if host_ids is None else (tuple(host_ids),)
+            t = self._cached('spectra_clean', cuts, columns_to_read, load_func, extra_key)
 
             if iter_hosts:
                 if hosts is None:
@@ -120,12 +235,327 @@ class ObjectCatalog(object):
             q = Query(cuts)
             if has_spec is not None:
                 q = q & (~C.has_spec)
+            q = compile_query(q)
 
             hosts = self._hosts.resolve_id('all') if hosts is None else self._hosts.resolve_id(hosts)
 
-            output_iterator = (_slice_columns(q.filter(self._add_colors(self._database['base', host].read())), columns) for host in hosts)
+            columns_to_read = _get_columns_to_read(columns, q)
+            load_func = self._load_host_parquet if from_parquet else self._load_host
+            def load_host(host):
+                return load_func(host, q, columns, columns_to_read)
+
+            if iter_hosts:
+                return prefetch(load_host, hosts, prefetch_hosts)
+            return concatenate_tables(load_host(host) for host in hosts)
+
+
+    def aggregate(self, hosts=None, cuts=None, by='HOST_NSAID', funcs=None, has_spec=None, n_jobs=1):
+        """
+        Compute per-group summaries (counts, sums, histograms, ...) while
+        streaming through the host catalogs. Only the columns needed by
+        `cuts`, `by` and `funcs` are read, and each host catalog is released
+        as soon as its partial result is computed.
+
+        Parameters
+        ----------
+        hosts : int, str, list, None, optional
+            host names/IDs or a list of host names/IDs or short-hand names like
+            "paper1" or "paper1_complete"
+
+        cuts : easyquery.Query, str, tuple, optional
+            To apply to the objects before aggregating
+
+        by : str or None, optional
+            Column to group by (default: 'HOST_NSAID').
+            Set to None to aggregate all objects into one row.
+
+        funcs : dict, optional
+            Output column name -> aggregation. Aggregations can be
+            'count', ('sum', col), ('mean', col), ('min', col), ('max', col),
+            ('hist', col, bins), or an easyquery.Query (number of objects
+            that pass it). Default: {'COUNT': 'count'}
+
+        has_spec : bool, optional
+            Same as in `load`
+
+        n_jobs : int, optional
+            Number of hosts to process in parallel (using threads)
+
+        Returns
+        -------
+        summary : astropy.table.Table
+            One row per group, sorted by `by`
+
+        Examples
+        --------
+        >>> import numpy as np
+        >>> from SAGA import ObjectCuts as C
+        >>> saga_objects.aggregate('paper1', C.basic_cut, funcs={
+        ...     'N_SAT': C.is_sat,
+        ...     'N_SPEC': C.has_spec,
+        ...     'R_HIST': ('hist', 'r_mag', np.arange(12, 21.5, 0.5)),
+        ... })
+        """
+        if funcs is None:
+            funcs = OrderedDict([('COUNT', 'count')])
+        reducers = OrderedDict((name, make_reducer(spec)) for name, spec in funcs.items())
+
+        columns = set()
+        if by is not None:
+            columns.add(by)
+        for reducer in reducers.values():
+            columns.update(reducer.columns)
+        columns = sorted(columns)
+
+        def reduce_table(t):
+            if by is None:
+                keys = np.zeros(1, np.int64)
+                inverse = np.zeros(len(t), np.intp)
+            else:
+                keys, inverse = np.unique(np.asarray(t[by]), return_inverse=True)
+                inverse = inverse.ravel()
+            return keys, [r.partial(t, inverse, len(keys)) for r in reducers.values()]
+
+        if has_spec:
+            partials = [reduce_table(self.load(hosts, has_spec, cuts, columns=columns))]
+        else:
+            q = Query(cuts)
+            if has_spec is not None:
+                q = q & (~C.has_spec)
+            q = compile_query(q)
+            host_ids = self._hosts.resolve_id('all') if hosts is None else self._hosts.resolve_id(hosts)
+            columns_to_read = _get_columns_to_read(columns, q)
+
+            def reduce_host(host):
+                return reduce_table(self._load_host(host, q, columns, columns_to_read))
+
+            if n_jobs > 1:
+                executor = ThreadPoolExecutor(n_jobs)
+                partials = executor.map(reduce_host, host_ids)
+            else:
+                executor = None
+                partials = map(reduce_host, host_ids)
+
+        group_index = {}
+        group_keys = []
+        states = [r.empty() for r in reducers.values()]
+        try:
+            for keys, host_states in partials:
+                for key in keys.tolist():
+                    if key not in group_index:
+                        group_index[key] = len(group_keys)
+                        group_keys.append(key)
+                idx = np.fromiter((group_index[key] for key in keys.tolist()), np.intp, len(keys))
+                for i, (reducer, host_state) in enumerate(zip(reducers.values(), host_states)):
+                    state = states[i] = reducer.resize(states[i], len(group_keys))
+                    state[idx] = reducer.merge(state[idx], host_state)
+        finally:
+            if not has_spec and executor is not None:
+                executor.shutdown()
+
+        order = np.argsort(group_keys, kind='stable') if group_keys else np.zeros(0, np.intp)
+        out = Table()
+        if by is not None:
+            out[by] = np.asarray(group_keys)[order]
+        for (name, reducer), state in zip(reducers.items(), states):
+            out[name] = reducer.finalize(state)[order]
+        return out
+
+
+    def load_dedup(self, hosts=None, has_spec=None, cuts=None, columns=None, host_columns=default_host_columns):
+        """
+        load object catalogs of many hosts into a DedupCatalog, where objects
+        that appear in several (overlapping) host fields have their per-object
+        columns stored once. Host catalogs are read one at a time.
+
+        Parameters
+        ----------
+        hosts, has_spec, cuts, columns :
+            Same as in `load` (cuts are applied per host, before deduplication)
+        host_columns : iterable of str, optional
+            per-host columns in addition to those starting with HOST_
+            (default: RHOST_ARCM, RHOST_KPC, REMOVE, SATS)
+
+        Returns
+        -------
+        dedup : SAGA.objects.DedupCatalog
+
+        Examples
+        --------
+        >>> dedup = saga_objects.load_dedup(cuts=C.basic_cut)
+        >>> sats = dedup.view(['OBJID', 'HOST_NSAID', 'r_mag'], C.is_sat)
+        """
+        if columns is not None and 'OBJID' not in columns:
+            columns = list(columns) + ['OBJID']
+        tables = self.load(hosts, has_spec, cuts, iter_hosts=True, columns=columns)
+        return DedupCatalog.from_tables(tables, host_columns)
+
+
+    def build_objid_index(self, hosts=None):
+        """
+        Build the global OBJID index (`saga_database['objid_index']`),
+        which maps each OBJID to the host catalog(s) and row(s) it is in.
+        Only the OBJID column of each base catalog is kept in memory.
+        The index has to be rebuilt when the base catalogs are rebuilt.
+
+        Parameters
+        ----------
+        hosts : int, str, list, None, optional
+            hosts to index (default: all)
+        """
+        hosts = self._hosts.resolve_id('all') if hosts is None else self._hosts.resolve_id(hosts)
+        objid, host_ids, rows = [], [], []
+        for host in hosts:
+            ids = np.asarray(self._database['base', host].read(columns=['OBJID'])['OBJID'], dtype=np.int64)
+            objid.append(ids)
+            host_ids.append(np.full(len(ids), host, np.int64))
+            rows.append(np.arange(len(ids), dtype=np.int64))
+
+        index = Table()
+        index['OBJID'] = np.concatenate(objid) if objid else np.zeros(0, np.int64)
+        index['HOST_NSAID'] = np.concatenate(host_ids) if host_ids else np.zeros(0, np.int64)
+        index['ROW'] = np.concatenate(rows) if rows else np.zeros(0, np.int64)
+        index = index[np.argsort(index['OBJID'], kind='stable')]
+
+        self._database['objid_index'].write(index, overwrite=True)
+        self._database['objid_index'].clear()
+
+
+    def get_objects(self, objids, columns=None):
+        """
+        load the objects with the given OBJIDs from all base catalogs, using
+        the global OBJID index (see `build_objid_index`), so that only the
+        host catalogs (and, for uncompressed fits files, the rows) that
+        contain these objects are read.
+
+        Parameters
+        ----------
+        objids : array_like
+        columns : list, optional
+            If set, only load a subset of columns
+
+        Returns
+        -------
+        objects : astropy.table.Table
+            one row per (object, host) pair, ordered by host.
+            OBJIDs that are not in the index are ignored.
+
+        Examples
+        --------
+        >>> saga_objects.build_objid_index() # only needed once
+        >>> fixes = saga_objects.get_objects(list(fixes_by_sdss_objid), columns=['OBJID', 'HOST_NSAID', 'SPEC_Z'])
+        """
+        index = self._database['objid_index'].read(keep=True)
+        matched = IdSet(objids).contains(np.asarray(index['OBJID']))
+        host_ids = np.asarray(index['HOST_NSAID'])[matched]
+        rows = np.asarray(index['ROW'])[matched]
+
+        columns_to_read = _get_columns_to_read(columns, None, ['OBJID'])
+
+        def iter_hosts():
+            for host in np.unique(host_ids):
+                with host_context(int(host)):
+                    yield self._database['base', int(host)].read_rows(np.sort(rows[host_ids == host]), columns_to_read)
+
+        t = concatenate_tables(iter_hosts())
+        if not len(t):
+            return t
+        return _slice_columns(self._add_colors(t), columns)
+
 
-            return output_iterator if iter_hosts else vstack(list(output_iterator))
+    def build_sky_partitions(self, hosts=None, overwrite=False):
+        """
+        Add the base catalogs of `hosts` (default: all) to the HEALPix-partitioned
+        catalog used by `cone_search` (`saga_database['base_healpix']`).
+        Base catalogs are read and written one at a time.
+
+        Parameters
+        ----------
+        hosts : int, str, list, None, optional
+        overwrite : bool, optional
+            If set to True, replace hosts that have already been added
+            (otherwise they are skipped).
+        """
+        catalog = self._database['base_healpix']
+        done = set(catalog.sources) if catalog.exists() else set()
+        hosts = self._hosts.resolve_id('all') if hosts is None else self._hosts.resolve_id(hosts)
+        for host in hosts:
+            source = 'nsa{}'.format(host)
+            if source in done and not overwrite:
+                continue
+            with host_context(host):
+                catalog.add_table(self._database['base', host].read(), source, overwrite=overwrite)
+
+
+    def build_parquet_dataset(self, hosts=None, overwrite=False):
+        """
+        Add the base catalogs of `hosts` (default: all) to the host-partitioned
+        Parquet dataset (`saga_database['base_parquet']`), which
+        `load(..., from_parquet=True)` reads. Requires pyarrow.
+        Base catalogs are read and written one at a time.
+
+        Parameters
+        ----------
+        hosts : int, str, list, None, optional
+        overwrite : bool, optional
+            If set to True, replace hosts that have already been added
+            (otherwise they are skipped).
+        """
+        dataset = self._database['base_parquet']
+        done = set(dataset.hosts)
+        hosts = self._hosts.resolve_id('all') if hosts is None else self._hosts.resolve_id(hosts)
+        for host in hosts:
+            if host in done and not overwrite:
+                continue
+            with host_context(host):
+                dataset.add_table(self._database['base', host].read(), host, overwrite=overwrite)
+
+
+    def cone_search(self, ra, dec, radius, cuts=None, columns=None):
+        """
+        load the objects within `radius` of (`ra`, `dec`) from the
+        HEALPix-partitioned catalog (see `build_sky_partitions`), reading
+        only the partitions that intersect the cone.
+
+        Note that objects in overlapping host fields are returned once per host.
+
+        Parameters
+        ----------
+        ra, dec : float
+            in degrees
+
+        radius : float or astropy.units.Quantity
+            in degrees if a float
+
+        cuts : easyquery.Query, str, tuple, optional
+            To apply to the objects when loaded
+
+        columns : list, optional
+            If set, only load a subset of columns
+
+        Returns
+        -------
+        objects : astropy.table.Table
+
+        Examples
+        --------
+        >>> import astropy.units as u
+        >>> saga_objects.build_sky_partitions() # only needed once
+        >>> nearby = saga_objects.cone_search(354.13, 0.29, 5*u.arcmin, cuts=C.basic_cut)
+        """
+        if hasattr(radius, 'to'):
+            radius = radius.to('deg').value
+        catalog = self._database['base_healpix']
+        if not catalog.exists():
+            raise ValueError('the sky-partitioned catalog does not exist; run `build_sky_partitions` first')
+
+        q = compile_query(cuts)
+        columns_to_read = _get_columns_to_read(columns, q)
+        t = catalog.cone_search(ra, dec, radius, columns=columns_to_read)
+        if not len(t):
+            return t
+        t = q.filter(self._add_colors(t))
+        return _slice_columns(t, columns)
 
 
     def build(self, hosts=None, rebuild=False):
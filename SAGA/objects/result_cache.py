@@ -0,0 +1,298 @@
+"""
+SAGA.objects.result_cache
+
+This file defines the ResultCache class, which ObjectCatalog uses to
+memoize filtered tables.
+"""
+import os
+import sys
+import types
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from easyquery import Query
+from astropy.table import Table
+from ..utils import atomic_output_file
+
+__all__ = ['ResultCache', 'canonical_query_key']
+
+
+def _update_code_hash(h, code):
+    """
+    hash the bytecode, names and constants of a code object; nested code
+    objects (lambdas, comprehensions) are hashed recursively, since their
+    repr contains a memory address
+    """
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            h.update(b'<code>')
+            _update_code_hash(h, const)
+        else:
+            h.update(repr(const).encode())
+
+
+_simple_types = (bool, int, float, complex, str, bytes, type(None))
+
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(_code_names(const))
+    return names
+
+
+def _resolve(module_name, qualname):
+    module = sys.modules.get(module_name) if module_name else None
+    if module is None or not qualname:
+        return None
+    obj = module
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr, None)
+    return obj
+
+
+def _value_key(value, seen):
+    """
+    return a stable key for a global or default value of a function, or
+    None if it cannot be captured (arrays, tables, other objects)
+    """
+    if isinstance(value, _simple_types):
+        return repr(value)
+    if isinstance(value, types.ModuleType):
+        return ('module', value.__name__)
+    if isinstance(value, type):
+        return ('type', value.__module__, value.__qualname__)
+    if isinstance(value, tuple):
+        keys = tuple(_value_key(v, seen) for v in value)
+        return None if any(k is None for k in keys) else keys
+    if callable(value):
+        return _callable_key(value, seen)
+    return None
+
+
+def _callable_key(func, _seen=None):
+    """
+    return a stable key for a callable, or None if the callable depends on
+    state that cannot be captured (closures, bound objects, globals or
+    defaults that are not constants, modules, classes or functions)
+    """
+    if isinstance(func, np.ufunc):
+        return ('ufunc', func.__name__)
+    owner = getattr(func, '__self__', None)
+    if isinstance(func, types.BuiltinFunctionType) and (owner is None or isinstance(owner, types.ModuleType)):
+        return ('builtin', getattr(owner, '__name__', None), func.__qualname__)
+    if owner is not None:
+        return None
+    code = getattr(func, '__code__', None)
+    if code is None:
+        # library callables implemented in C (or wrapped, e.g. numpy
+        # functions) are identified by name, if the name leads back to them
+        name = (getattr(func, '__module__', None), getattr(func, '__qualname__', None))
+        return ('ref',) + name if _resolve(*name) is func else None
+    if func.__closure__:
+        return None
+
+    name = (func.__module__, func.__qualname__)
+    if _seen is None:
+        _seen = set()
+    if name in _seen:  # recursive functions
+        return ('func',) + name
+    _seen.add(name)
+
+    h = hashlib.sha1()
+    _update_code_hash(h, code)
+    values = [func.__defaults__, func.__kwdefaults__ and tuple(sorted(func.__kwdefaults__.items()))]
+    values.extend((n, func.__globals__[n]) for n in sorted(_code_names(code)) if n in func.__globals__)
+    for value in values:
+        key = _value_key(value, _seen)
+        if key is None:
+            return None
+        h.update(repr(key).encode())
+    return ('func',) + name + (h.hexdigest(),)
+
+
+def canonical_query_key(query):
+    """
+    Return a hashable canonical form of an easyquery Query (or anything
+    that can be converted to one). AND/OR operands are sorted, so that
+    `a & b` and `b & a` give the same key. Returns None if the query
+    contains a callable whose behavior cannot be captured in a key
+    (e.g. a lambda that closes over an array).
+
+    Parameters
+    ----------
+    query : easyquery.Query, str, tuple, or None
+
+    Returns
+    -------
+    key : tuple or None
+    """
+    # pylint: disable=protected-access
+    q = Query(query)
+    if q._operator is None:
+        operand = q._operands
+        if operand is None:
+            return ('ALL',)
+        if isinstance(operand, str):
+            return ('EXPR', ''.join(operand.split()))
+        if isinstance(operand, tuple):
+            func_key = _callable_key(operand[0])
+            return None if func_key is None else ('CALL', func_key) + tuple(operand[1:])
+        func_key = _callable_key(operand)
+        return None if func_key is None else ('CALL', func_key)
+
+    if q._operator == 'NOT':
+        key = canonical_query_key(q._operands)
+        return None if key is None else ('NOT', key)
+
+    keys = [canonical_query_key(op) for op in q._operands]
+    if any(k is None for k in keys):
+        return None
+    if q._operator in ('AND', 'OR'):
+        keys = sorted(set(keys), key=repr)
+    return (q._operator,) + tuple(keys)
+
+
+def _table_nbytes(table):
+    return sum(getattr(table[c], 'nbytes', 0) for c in table.colnames)
+
+
+class ResultCache(object):
+    """
+    An LRU cache for tables with a memory cap and an optional on-disk tier.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        memory cap in bytes (default: 1 GB). Least recently used tables are
+        evicted from memory when the total size exceeds the cap.
+    cache_dir : str, optional
+        If set, tables are also stored as fits files in this directory,
+        and survive across sessions.
+    max_disk_bytes : int, optional
+        cap on the total size of the fits files in `cache_dir` (default: 10 GB).
+        Least recently used files are deleted when a new table is stored
+        and the total size exceeds the cap.
+
+    Notes
+    -----
+    Tables are copied when stored and when returned, so modifying a
+    returned table does not affect the cache.
+    """
+    def __init__(self, max_bytes=(1 << 30), cache_dir=None, max_disk_bytes=(10 << 30)):
+        self.max_bytes = int(max_bytes)
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = int(max_disk_bytes)
+        self._tables = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir is not None and not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def _hash_key(key):
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, '{}.fits'.format(self._hash_key(key)))
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and self._tables:
+            _, (table, nbytes) = self._tables.popitem(last=False)
+            self._nbytes -= nbytes
+
+    def get(self, key):
+        """
+        Return a copy of the table stored under `key`, or None.
+        """
+        with self._lock:
+            if key in self._tables:
+                self._tables.move_to_end(key)
+                self.hits += 1
+                return self._tables[key][0].copy()
+
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            if os.path.isfile(path):
+                table = Table.read(path, format='fits')
+                os.utime(path)
+                self._put_memory(key, table)
+                with self._lock:
+                    self.hits += 1
+                return table.copy()
+
+        with self._lock:
+            self.misses += 1
+
+    def _put_memory(self, key, table):
+        nbytes = _table_nbytes(table)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._tables:
+                self._nbytes -= self._tables.pop(key)[1]
+            self._tables[key] = (table, nbytes)
+            self._nbytes += nbytes
+            self._evict()
+
+    def put(self, key, table):
+        """
+        Store a copy of `table` under `key`.
+        """
+        table = table.copy()
+        self._put_memory(key, table)
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            if not os.path.isfile(path):
+                with atomic_output_file(path) as f:
+                    table.write(f, format='fits')
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """
+        delete the least recently used fits files until the cache directory
+        is within `max_disk_bytes`
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.fits') and entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total <= self.max_disk_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self, disk=False):
+        """
+        Remove all tables from memory (and from disk, if `disk` is True).
+        """
+        with self._lock:
+            self._tables.clear()
+            self._nbytes = 0
+        if disk and self.cache_dir is not None:
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith('.fits'):
+                    os.unlink(os.path.join(self.cache_dir, filename))
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._tables)
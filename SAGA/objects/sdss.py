@@ -1,9 +1,11 @@
 import os
 import time
 import re
-from astropy import units as u
-from casjobs import CasJobs
-from ..utils import gzip_compress, get_logger
+from ..utils import gzip_compress, get_logger, lazy_import
+
+# optional dependencies, only needed to run the queries
+u = lazy_import('astropy.units')
+casjobs = lazy_import('casjobs')
 
 __all__ = ['extract_sdss_specs', 'run_casjob', 'construct_query']
 
@@ -54,7 +56,7 @@ def run_casjob(query, db_table_name, output_path, compress=True, overwrite=False
         raise ValueError('You are not setup to run casjobs')
 
     # USES POST
-    cjob = CasJobs(base_url='http://skyserver.sdss.org/casjobs/services/jobs.asmx', request_type='POST', context='DR14')
+    cjob = casjobs.CasJobs(base_url='http://skyserver.sdss.org/casjobs/services/jobs.asmx', request_type='POST', context='DR14')
 
     output_path_tmp = output_path + '.tmp' if compress else output_path
 
@@ -1,6 +1,6 @@
 import numpy as np
-from astropy.coordinates import SkyCoord
 from ..utils import SPEED_OF_LIGHT
+from ..utils.geometry import angular_separation, radec_to_xyz, separation_from_xyz
 
 def clean_repeats(spectra):
 
@@ -21,7 +21,7 @@ def clean_repeats(spectra):
 
     # make copies of the ra, dec, z, and indices of the whole spectra
     # we need copies as these will be later sliced in place
-    spectra_sc = SkyCoord(spectra['RA'], spectra['DEC'], unit="deg")
+    spectra_xyz = radec_to_xyz(spectra['RA'], spectra['DEC'])
     spectra_z = np.array(spectra['SPEC_Z'])
     spectra_idx = np.arange(len(spectra))
 
@@ -29,15 +29,13 @@ def clean_repeats(spectra):
         if i not in spectra_idx:
             continue
 
-        spec_sc = SkyCoord(spec['RA'], spec['DEC'], unit='deg')
-
         # search nearby spectra in 3D
         nearby_mask = (np.abs(spectra['SPEC_Z'] - spec['SPEC_Z']) < 50.0/SPEED_OF_LIGHT)
-        nearby_mask &= (spectra_sc.separation(spec_sc).arcsec < 30.0)
+        nearby_mask &= (separation_from_xyz(spectra_xyz, radec_to_xyz(spec['RA'], spec['DEC'])) * 3600.0 < 30.0)
 
         specs_nearby = spectra[spectra_idx[nearby_mask]]
 
-        spectra_sc = spectra_sc[~nearby_mask]
+        spectra_xyz = spectra_xyz[~nearby_mask]
         spectra_z = spectra_z[~nearby_mask]
         spectra_idx = spectra_idx[~nearby_mask]
 
@@ -50,8 +48,7 @@ def clean_repeats(spectra):
 
         # should prefer NSA
         best_spec = specs_nearby[specs_nearby['ZQUALITY'].data.argmax()]
-        best_spec_sc = SkyCoord(best_spec['RA'], best_spec['DEC'], unit='deg')
-        closest_object_index = SkyCoord(objects_nearby['RA'], objects_nearby['DEC'], unit='deg').separation(best_spec_sc).arcsec.argmin()
+        closest_object_index = angular_separation(objects_nearby['RA'], objects_nearby['DEC'], best_spec['RA'], best_spec['DEC']).argmin()
 
         original_base_index = objects_nearby_indices[closest_object_index]
         base['SPEC_REPEAT'][original_base_index] = spec_repeat
@@ -1,7 +1,138 @@
+"""
+SAGA.spectra.spectrum_catalog
+
+This file defines the SpectrumCatalog class
+"""
+import numpy as np
+from easyquery import Query
+from ..hosts import HostCatalog
+from ..database import select_spectra
+from ..objects.ingest import ingest_spectra
+from ..utils import compile_query
+
+
 class SpectrumCatalog(object):
+    """
+    This class provides a high-level interface to access spectra.
+    Spectra are read from the partitioned spectra store
+    (`saga_database['spectra_store']`) if it exists, and from the
+    `spectra_clean` fits file otherwise.
+
+    Parameters
+    ----------
+    database : SAGA.Database object
+
+    Returns
+    -------
+    spectrum_catalog : SAGA.SpectrumCatalog object
 
+    Examples
+    --------
+    >>> import SAGA
+    >>> saga_database = SAGA.Database('/path/to/SAGA/Dropbox')
+    >>> saga_spectra = SAGA.spectra.SpectrumCatalog(saga_database)
+    >>> saga_spectra.build_store() # only needed once
+    >>> mmt = saga_spectra.load(telescope='MMT')
+    >>> near_anak = saga_spectra.load(hosts='AnaK')
+    >>> saga_spectra.append(new_spectra, run='2017-09')
+    >>> saga_spectra.ingest(new_spectra, run='2017-10')  # also updates the base catalogs
+    """
     def __init__(self, database):
         self._database = database
+        self._hosts = None
+
+    def _get_store(self):
+        try:
+            store = self._database['spectra_store']
+        except KeyError:
+            return None
+        return store if store.exists() else None
+
+    def _resolve_hosts(self, hosts):
+        if hosts is None:
+            return None
+        try:
+            return [int(h) for h in np.atleast_1d(hosts)]
+        except (TypeError, ValueError):
+            pass
+        if self._hosts is None:
+            self._hosts = HostCatalog(self._database)
+        return self._hosts.resolve_id(hosts)
+
+    def load(self, telescope=None, hosts=None, ra=None, dec=None, radius=None, cuts=None, columns=None):
+        """
+        load spectra
+
+        Parameters
+        ----------
+        telescope : str or list of str, optional
+            only load spectra from these telescopes (column TELNAME)
+
+        hosts : int, str, list, None, optional
+            host names/IDs or a list of host names/IDs or short-hand names like
+            "paper1" or "paper1_complete"
+
+        ra, dec, radius : float, optional
+            only load spectra within `radius` of (`ra`, `dec`), all in degrees
+
+        cuts : easyquery.Query, str, tuple, optional
+            To apply to the spectra when loaded
+
+        columns : list, optional
+            If set, only return a subset of columns
+
+        Returns
+        -------
+        spectra : astropy.table.Table
+        """
+        host_ids = self._resolve_hosts(hosts)
+        read_columns = None
+        if columns is not None:
+            read_columns = set(columns).union(Query(cuts).variable_names)
+            for col, arg in (('TELNAME', telescope), ('HOST_NSAID', host_ids), ('RA', radius), ('DEC', radius)):
+                if arg is not None:
+                    read_columns.add(col)
+            read_columns = sorted(read_columns)
+
+        store = self._get_store()
+        if store is not None:
+            t = store.read(columns=read_columns, telescope=telescope, hosts=host_ids, ra=ra, dec=dec, radius=radius)
+        else:
+            t = self._database['spectra_clean'].read(columns=read_columns)
+            t = select_spectra(t, telescope, host_ids, ra, dec, radius)
+
+        if cuts is not None:
+            t = compile_query(cuts).filter(t)
+        if columns is not None:
+            t = t[list(columns)]
+        return t
+
+    def append(self, spectra, run=None):
+        """
+        Add spectra (e.g. from a new observing run) to the spectra store,
+        without rewriting existing files. See `SAGA.database.SpectraStore.append`.
+        """
+        return self._database['spectra_store'].append(spectra, run=run)
+
+    def ingest(self, spectra, run=None, patch_radius=60.0, ignore_imacs=False):
+        """
+        Add spectra to the spectra store (without repeats) and update only
+        the base catalog rows near them. See `SAGA.objects.ingest_spectra`.
+
+        Returns
+        -------
+        changed_rows : dict
+            host NSAID -> number of base catalog rows that changed
+        """
+        return ingest_spectra(self._database, spectra, run=run, patch_radius=patch_radius, ignore_imacs=ignore_imacs)
+
+    def build_store(self, overwrite=False):
+        """
+        Create the spectra store from the `spectra_clean` fits file.
 
-    def load(self, telescope=None):
-        raise NotImplementedError #TODO: implement this
+        Parameters
+        ----------
+        overwrite : bool, optional
+            If set to True, replace an existing store.
+        """
+        self._database['spectra_store'].write(self._database['spectra_clean'].read(), overwrite=overwrite)
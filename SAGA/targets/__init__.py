@@ -6,3 +6,4 @@ This subpackage contains target-related routines, including TargetSelection
 This subpackage is still under construction! DO NOT USE YET!
 """
 from .target_selection import TargetSelection
+from .gmm import GMMScoreCache
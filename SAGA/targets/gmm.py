@@ -1,6 +1,8 @@
 import os
+import hashlib
+import threading
 import numpy as np
-from scipy.misc import logsumexp
+from ..utils import instrument, atomic_output_file
 
 _colors = ('ug', 'gr', 'ri', 'iz')
 
@@ -21,6 +23,12 @@ def _GMMlogposterior(y, yerr, xmap, xmean, xcovar):
     allpost_nosat /= norms
     allpost_sat /= norms
     """
+    # scipy is slow to import, so it is only imported when needed
+    try:
+        from scipy.special import logsumexp
+    except ImportError:
+        from scipy.misc import logsumexp
+
     assert y.shape[1] == xmean.shape[1]
     assert xmean.shape[0] == xcovar.shape[0]
     assert xmean.shape[1] == xcovar.shape[1]
@@ -41,16 +49,174 @@ def _GMMlogposterior(y, yerr, xmap, xmean, xcovar):
 
 def _change_table_format(table, cols):
     if table.masked:
-        return np.vstack((table[c].data.data for c in cols)).T
+        return np.vstack([table[c].data.data for c in cols]).T
     else:
-        return np.vstack((table[c].data for c in cols)).T
+        return np.vstack([table[c].data for c in cols]).T
+
+
+def hash_model_parameters(model_parameters):
+    """
+    Return a hex digest that changes when any of the GMM model parameters change.
+    """
+    h = hashlib.sha1()
+    for key in sorted(model_parameters):
+        value = np.ascontiguousarray(model_parameters[key], dtype=np.float64)
+        h.update(key.encode())
+        h.update(repr(value.shape).encode())
+        h.update(value.tobytes())
+    return h.hexdigest()
+
 
+def _hash_rows(values):
+    """
+    64-bit FNV-1a style hash of each row of a 2-d float64 array
+    """
+    words = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+    h = np.full(len(words), np.uint64(14695981039346656037))
+    prime = np.uint64(1099511628211)
+    for i in range(words.shape[1]):
+        h ^= words[:, i]
+        h *= prime
+    return h
 
-def calc_satellite_probability(base, model_parameters):
 
+class GMMScoreCache(object):
+    """
+    Cache of satellite probabilities keyed by OBJID, a hash of the color
+    inputs (colors and their errors) and a hash of the model parameters.
+    Entries made with a different model are dropped when the model changes.
+
+    Parameters
+    ----------
+    path : str, optional
+        If set, the cache is loaded from (if it exists) and saved to this
+        .npz file.
+
+    Examples
+    --------
+    >>> cache = GMMScoreCache('/path/to/gmm_scores.npz')
+    >>> p = calc_satellite_probability(base, model_parameters, cache=cache)
+    >>> cache.save()
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.model_hash = None
+        self._objid = np.zeros(0, np.int64)
+        self._color_hash = np.zeros(0, np.uint64)
+        self._p = np.zeros(0, np.float64)
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None and os.path.isfile(self.path):
+            with np.load(self.path) as data:
+                self.model_hash = str(data['model_hash'])
+                self._objid = data['objid']
+                self._color_hash = data['color_hash']
+                self._p = data['p']
+
+    def __len__(self):
+        return len(self._objid)
+
+    def _set_model(self, model_hash):
+        if model_hash != self.model_hash:
+            self.model_hash = model_hash
+            self._objid = np.zeros(0, np.int64)
+            self._color_hash = np.zeros(0, np.uint64)
+            self._p = np.zeros(0, np.float64)
+            self._dirty = True
+
+    def lookup(self, objid, color_hash, model_hash):
+        """
+        Return (p, found), where found is a boolean mask of the objects whose
+        score is cached for the same color inputs and model.
+        """
+        with self._lock:
+            self._set_model(model_hash)
+            p = np.zeros(len(objid), np.float64)
+            idx = np.searchsorted(self._objid, objid)
+            idx[idx >= len(self._objid)] = 0
+            found = np.zeros(len(objid), bool)
+            if len(self._objid):
+                found = (self._objid[idx] == objid) & (self._color_hash[idx] == color_hash)
+                p[found] = self._p[idx[found]]
+            self.hits += np.count_nonzero(found)
+            self.misses += len(objid) - np.count_nonzero(found)
+        return p, found
+
+    def update(self, objid, color_hash, p, model_hash):
+        """
+        Store the scores of the given objects (replacing older entries).
+        """
+        if not len(objid):
+            return
+        with self._lock:
+            self._set_model(model_hash)
+            objid = np.concatenate([objid, self._objid])
+            color_hash = np.concatenate([color_hash, self._color_hash])
+            p = np.concatenate([p, self._p])
+            # keep the first (i.e. newest) entry of each OBJID
+            objid, first = np.unique(objid, return_index=True)
+            self._objid = objid
+            self._color_hash = color_hash[first]
+            self._p = p[first]
+            self._dirty = True
+
+    def save(self, path=None):
+        """
+        Save the cache to `path` (default: the path given at creation),
+        if it has changed.
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError('no path to save the cache to')
+        with self._lock:
+            if not self._dirty and path == self.path and os.path.isfile(path):
+                return
+            with atomic_output_file(path) as f:
+                np.savez(f, model_hash=np.array(self.model_hash or ''), objid=self._objid,
+                         color_hash=self._color_hash, p=self._p)
+            self._dirty = False
+
+
+@instrument('gmm.calc_satellite_probability')
+def calc_satellite_probability(base, model_parameters, cache=None):
+    """
+    Compute the satellite probability of each object in `base`
+    with the GMM model.
+
+    Parameters
+    ----------
+    base : astropy.table.Table
+        with the colors ug, gr, ri, iz and their errors (e.g. ug_err)
+    model_parameters : dict
+    cache : GMMScoreCache, optional
+        If set (and `base` has an OBJID column), only objects that are new,
+        whose colors changed, or that were scored with a different model are
+        computed; the cache is updated with the new scores.
+
+    Returns
+    -------
+    p_sat : numpy.ndarray
+    """
     colors = _change_table_format(base, _colors)
     colors_err = _change_table_format(base, ('{}_err'.format(c) for c in _colors))
 
+    if cache is None or 'OBJID' not in base.colnames:
+        return _calc_satellite_probability(colors, colors_err, model_parameters)
+
+    objid = np.asarray(base['OBJID'], dtype=np.int64)
+    color_hash = _hash_rows(np.hstack([colors, colors_err]))
+    model_hash = hash_model_parameters(model_parameters)
+    p_sat, found = cache.lookup(objid, color_hash, model_hash)
+    todo = ~found
+    if todo.any():
+        p_sat[todo] = _calc_satellite_probability(colors[todo], colors_err[todo], model_parameters)
+        cache.update(objid[todo], color_hash[todo], p_sat[todo], model_hash)
+    return p_sat
+
+
+def _calc_satellite_probability(colors, colors_err, model_parameters):
     p_notsat = _GMMlogposterior(colors, colors_err,
                                 model_parameters['xamp_nosat'],
                                 model_parameters['xmean_nosat'],
@@ -1,31 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from easyquery import Query
 from ..objects import ObjectCatalog
 from ..objects import cuts as C
-from ..utils import fill_values_by_query, get_empty_str_array
-from .gmm import calc_satellite_probability
+from ..utils import fill_values_by_query, get_empty_str_array, concatenate_tables, IdSet
+from .gmm import calc_satellite_probability, GMMScoreCache
 
 _colors = ['ug', 'gr', 'ri', 'iz']
 
 class TargetSelection(object):
-    def __init__(self, database):
+    """
+    Select targets for spectroscopic follow-up.
+
+    The RISA object list and the GMM model parameters are not part of the
+    default database: pass them as `risa_objid` and `gmm_parameters`, or
+    register them in the database as 'risa_objects' (a table with an OBJID
+    column) and 'gmm_model_para'. Tables from the database are read once
+    per TargetSelection object (call `clear` to re-read them).
+
+    Parameters
+    ----------
+    database : SAGA.Database object
+    score_cache : SAGA.targets.GMMScoreCache or str, optional
+        If set, GMM scores are cached by OBJID, color inputs and model
+        version, so re-targeting only scores new or changed objects.
+        A str is used as the path of a persistent cache file.
+    gmm_parameters : dict, optional
+        GMM model parameters (see `calc_satellite_probability`)
+    risa_objid : array_like, optional
+        OBJIDs of the RISA objects
+
+    Examples
+    --------
+    >>> saga_targets = SAGA.targets.TargetSelection(saga_database)
+    >>> targets_anak = saga_targets.select_preliminary_targets(61945)
+    >>> targets = saga_targets.select_preliminary_targets_batch('paper1', n_jobs=4)
+    """
+    def __init__(self, database, score_cache=None, gmm_parameters=None, risa_objid=None):
         self._database = database
         self._objects = ObjectCatalog(self._database)
+        self._score_cache = GMMScoreCache(score_cache) if isinstance(score_cache, str) else score_cache
+        self._gmm_parameters_input = gmm_parameters
+        self._risa_objid_input = None if risa_objid is None else IdSet(risa_objid)
+        self.clear()
 
-    def select_preliminary_targets(self, host_id, return_columns=['OBJID', 'RA', 'DEC']):
-        columns = list(set(return_columns + _colors + ['{}_err'.format(c) for c in _colors] + ['OBJID']))
+    def clear(self):
+        """forget the RISA object list and the GMM model parameters read from the database"""
+        self._risa_objid = self._risa_objid_input
+        self._gmm_parameters = self._gmm_parameters_input
 
-        base = self._objects.load(hosts=host_id, has_spec=False, cuts=C.basic_cut, columns=columns)
+    def _read_input(self, key, argument):
+        try:
+            data_object = self._database[key]
+        except KeyError:
+            raise KeyError('{} is not in the database; pass `{}` to TargetSelection, '
+                           'or register it with saga_database[{!r}] = ...'.format(key, argument, key))
+        return data_object.read()
 
+    def _get_risa_objid(self):
+        if self._risa_objid is None:
+            self._risa_objid = IdSet(self._read_input('risa_objects', 'risa_objid')['OBJID'])
+        return self._risa_objid
+
+    def _get_gmm_parameters(self):
+        if self._gmm_parameters is None:
+            self._gmm_parameters = self._read_input('gmm_model_para', 'gmm_parameters')
+        return self._gmm_parameters
+
+    @staticmethod
+    def _get_columns(return_columns):
+        return list(set(list(return_columns) + _colors + ['{}_err'.format(c) for c in _colors] + ['OBJID']).union(C.sdss_limit.variable_names))
+
+    def _assign_targets(self, base, chunk_rows=None):
         base['TARGETING_LABEL'] = get_empty_str_array(len(base))
         base['TARGETING_SCORE'] = 9999.0
 
-        n_bright = fill_values_by_query(base, C.sdss_limit, {'TARGETING_LABEL':'BRIGHT', 'TARGETING_SCORE': 0.0})
+        fill_values_by_query(base, C.sdss_limit, {'TARGETING_LABEL':'BRIGHT', 'TARGETING_SCORE': 0.0})
 
-        risa_objid = self._database._table['risa_objects'].read()['OBJID']
-        n_risa = fill_values_by_query(base,  Query((lambda x: np.in1d(x, risa_objid), 'OBJID')),
-                                      {'TARGETING_LABEL':'RISA', 'TARGETING_SCORE': 1.0})
+        risa_objid = self._get_risa_objid()
+        fill_values_by_query(base, Query((risa_objid.contains, 'OBJID')),
+                             {'TARGETING_LABEL':'RISA', 'TARGETING_SCORE': 1.0})
 
-        p = calc_satellite_probability(base, self._database._table['gmm_model_para'].read())
+        gmm_parameters = self._get_gmm_parameters()
+        if chunk_rows is None or len(base) <= chunk_rows:
+            p = calc_satellite_probability(base, gmm_parameters, cache=self._score_cache)
+        else:
+            p = np.concatenate([calc_satellite_probability(base[i:i+chunk_rows], gmm_parameters, cache=self._score_cache)
+                                for i in range(0, len(base), chunk_rows)])
+        if self._score_cache is not None and self._score_cache.path is not None:
+            self._score_cache.save()
         p_mask = (p > 0.5)
         base['TARGETING_LABEL'][p_mask] = 'HIGH_P_GMM'
         base['TARGETING_SCORE'][p_mask] = 3.0 - p[p_mask]
@@ -33,3 +96,50 @@ class TargetSelection(object):
         #TODO: finish this
 
         return base
+
+    def select_preliminary_targets(self, host_id, return_columns=['OBJID', 'RA', 'DEC']):
+        columns = self._get_columns(return_columns)
+
+        base = self._objects.load(hosts=host_id, has_spec=False, cuts=C.basic_cut, columns=columns)
+
+        return self._assign_targets(base)
+
+    def select_preliminary_targets_batch(self, hosts='all', return_columns=['OBJID', 'RA', 'DEC'], n_jobs=1, chunk_rows=100000):
+        """
+        Select preliminary targets for many hosts in one run. The base
+        catalogs are read in parallel (`n_jobs` threads) and combined, the
+        RISA list and GMM model are read once, and all rows are scored
+        together (in chunks of `chunk_rows` rows to bound the memory used by
+        the GMM).
+
+        Parameters
+        ----------
+        hosts : int, str, list, optional
+            host names/IDs or short-hand names (default: 'all')
+        return_columns : list, optional
+        n_jobs : int, optional
+        chunk_rows : int, optional
+
+        Returns
+        -------
+        targets : astropy.table.Table
+            one table for all hosts, with columns `return_columns`,
+            HOST_NSAID, TARGETING_LABEL and TARGETING_SCORE
+        """
+        columns = self._get_columns(list(return_columns) + ['HOST_NSAID'])
+        host_ids = self._objects._hosts.resolve_id(hosts) # pylint: disable=protected-access
+
+        def load_host(host_id):
+            return self._objects.load(hosts=host_id, has_spec=False, cuts=C.basic_cut, columns=columns)
+
+        # read the shared inputs before starting the threads
+        self._get_risa_objid()
+        self._get_gmm_parameters()
+
+        if n_jobs > 1:
+            with ThreadPoolExecutor(n_jobs) as executor:
+                base = concatenate_tables(executor.map(load_host, host_ids))
+        else:
+            base = concatenate_tables(load_host(host_id) for host_id in host_ids)
+
+        return self._assign_targets(base, chunk_rows)
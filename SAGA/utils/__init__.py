@@ -2,13 +2,30 @@
 SAGA.utils
 
 This subpackage collects some handy functions.
+The functions are imported on first use (see `SAGA.utils.lazy`).
 """
+from .lazy import (lazy_import,
+                   lazy_attributes,
+                   )
 
-from .utils import (SPEED_OF_LIGHT,
-                    get_empty_str_array,
-                    get_logger,
-                    get_decals_viewer_image,
-                    gzip_compress,
-                    join_table_by_coordinates,
-                    fill_values_by_query,
-                    )
\ No newline at end of file
+__getattr__, __dir__ = lazy_attributes(__name__, {
+    'SPEED_OF_LIGHT': ('.utils', 'SPEED_OF_LIGHT'),
+    'get_empty_str_array': ('.utils', 'get_empty_str_array'),
+    'get_logger': ('.utils', 'get_logger'),
+    'get_decals_viewer_image': ('.utils', 'get_decals_viewer_image'),
+    'CutoutFetcher': ('.cutouts', 'CutoutFetcher'),
+    'gzip_compress': ('.utils', 'gzip_compress'),
+    'atomic_output_file': ('.utils', 'atomic_output_file'),
+    'join_table_by_coordinates': ('.utils', 'join_table_by_coordinates'),
+    'fill_values_by_query': ('.utils', 'fill_values_by_query'),
+    'concatenate_tables': ('.utils', 'concatenate_tables'),
+    'prefetch': ('.utils', 'prefetch'),
+    'SingleFlight': ('.utils', 'SingleFlight'),
+    'IdSet': ('.membership', 'IdSet'),
+    'compile_query': ('.query_compiler', 'compile_query'),
+    'CompiledQuery': ('.query_compiler', 'CompiledQuery'),
+    'Profiler': ('.profiling', 'Profiler'),
+    'profile_stage': ('.profiling', 'profile_stage'),
+    'instrument': ('.profiling', 'instrument'),
+    'host_context': ('.profiling', 'host_context'),
+})
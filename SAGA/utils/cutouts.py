@@ -0,0 +1,224 @@
+"""
+SAGA.utils.cutouts
+
+This file defines the CutoutFetcher class
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .lazy import lazy_import
+from .utils import atomic_output_file, SingleFlight
+
+requests = lazy_import('requests')
+
+__all__ = ['CutoutFetcher']
+
+_default_url = 'http://legacysurvey.org/viewer-dev/jpeg-cutout/'
+
+# responses worth retrying: rate limiting and server or gateway errors
+_retry_status = (429, 500, 502, 503, 504)
+
+
+def _cutout_key(ra, dec, pixscale, layer, size):
+    # coordinates are rounded to 1e-7 deg (0.36 mas), so that the same
+    # target gives the same key (and url) whatever the float type
+    return 'ra={:.7f}&dec={:.7f}&pixscale={:g}&layer={}&size={:d}'.format(
+        float(ra), float(dec), float(pixscale), layer, int(size))
+
+
+class CutoutFetcher(object):
+    """
+    Fetch jpeg cutouts from the Legacy Survey viewer, with retries (and
+    exponential backoff) of failed requests. If `cache_dir` is set, each
+    cutout is only downloaded once.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+    base_url : str, optional
+        url of the jpeg cutout service (default: the Legacy Survey viewer)
+    max_workers : int, optional
+        maximal number of concurrent requests of `fetch_many` (default: 8)
+    timeout : float, optional
+        in seconds, for connecting and for each read (default: 30)
+    max_retries : int, optional
+        (default: 3)
+    backoff : float, optional
+        in seconds (default: 0.5)
+
+    Examples
+    --------
+    >>> fetcher = CutoutFetcher(cache_dir='cutouts', max_workers=16)
+    >>> images = fetcher.fetch_many(targets['RA'], targets['DEC'])
+    """
+    def __init__(self, cache_dir=None, base_url=_default_url, max_workers=8, timeout=30.0,
+                 max_retries=3, backoff=0.5):
+        self.cache_dir = cache_dir
+        self.base_url = base_url
+        self.max_workers = max(int(max_workers), 1)
+        self.timeout = timeout
+        self.max_retries = max(int(max_retries), 0)
+        self.backoff = backoff
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._downloads = SingleFlight()
+
+    @property
+    def session(self):
+        """the pooled HTTP session (created on first use)"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def close(self):
+        """close the connections of the session"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def url(self, ra, dec, pixscale=0.2, layer='sdssco', size=256):
+        """return the url of a cutout"""
+        return '{}?{}'.format(self.base_url, _cutout_key(ra, dec, pixscale, layer, size))
+
+    def cache_path(self, ra, dec, pixscale=0.2, layer='sdssco', size=256):
+        """return the path of a cutout in the cache (None if there is no cache)"""
+        if self.cache_dir is None:
+            return None
+        h = hashlib.sha1(_cutout_key(ra, dec, pixscale, layer, size).encode()).hexdigest()
+        return os.path.join(self.cache_dir, h[:2], h + '.jpg')
+
+    def _retry_delay(self, attempt, response=None):
+        delay = self.backoff * (2 ** attempt)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get('Retry-After', 0)))
+            except ValueError:  # an HTTP date instead of seconds
+                pass
+        return delay
+
+    def _download(self, url):
+        log = logging.getLogger(__name__)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                log.debug('retrying %s in %.1f s (%r)', url, delay, e)
+            else:
+                if response.status_code not in _retry_status or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response.content
+                delay = self._retry_delay(attempt, response)
+                log.debug('retrying %s in %.1f s (status %d)', url, delay, response.status_code)
+            time.sleep(delay)
+
+    def _fetch(self, url, path):
+        if path is not None and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        content = self._download(url)
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with atomic_output_file(path) as f:
+                f.write(content)
+        return content
+
+    def fetch(self, ra, dec, pixscale=0.2, layer='sdssco', size=256):
+        """
+        Return the jpeg cutout centered at (`ra`, `dec`) as bytes.
+
+        Parameters
+        ----------
+        ra, dec : float
+            in deg
+        pixscale : float, optional
+            in arcsec per pixel (default: 0.2)
+        layer : str, optional
+            (default: 'sdssco')
+        size : int, optional
+            in pixels (default: 256)
+
+        Returns
+        -------
+        content : bytes
+        """
+        url = self.url(ra, dec, pixscale, layer, size)
+        path = self.cache_path(ra, dec, pixscale, layer, size)
+        return self._downloads.do(url, lambda: self._fetch(url, path))[0]
+
+    def fetch_many(self, ra, dec, pixscale=0.2, layer='sdssco', size=256, ignore_errors=False):
+        """
+        Return the jpeg cutouts centered at each (`ra`, `dec`), fetched with
+        up to `max_workers` concurrent requests.
+
+        Parameters
+        ----------
+        ra, dec : array_like
+            in deg
+        pixscale, layer, size : optional
+            scalars, or arrays of the same length as `ra`
+        ignore_errors : bool, optional
+            If set to True, the cutouts that cannot be fetched (after the
+            retries) are None instead of raising the error (default: False)
+
+        Returns
+        -------
+        contents : list
+            bytes of each cutout, in the order of `ra` and `dec`
+        """
+        ra, dec, pixscale, layer, size = np.broadcast_arrays(np.asarray(ra, np.float64).ravel(),
+                                                             np.asarray(dec, np.float64).ravel(),
+                                                             pixscale, layer, size)
+        log = logging.getLogger(__name__)
+
+        def fetch_one(i):
+            try:
+                return self.fetch(ra[i], dec[i], pixscale[i], str(layer[i]), size[i])
+            except Exception as e:  # pylint: disable=broad-except
+                if not ignore_errors:
+                    raise
+                log.warning('cannot fetch cutout at (%s, %s): %r', ra[i], dec[i], e)
+                return None
+
+        executor = ThreadPoolExecutor(min(self.max_workers, max(len(ra), 1)))
+        futures = [executor.submit(fetch_one, i) for i in range(len(ra))]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            # on errors, cancel the pending downloads and do not wait for the
+            # running ones (as `with executor` would)
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+_default_fetcher = None
+_default_fetcher_lock = threading.Lock()
+
+
+def get_default_fetcher():
+    """return the (uncached) fetcher used by `get_decals_viewer_image`"""
+    global _default_fetcher  # pylint: disable=global-statement
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = CutoutFetcher()
+        return _default_fetcher
@@ -0,0 +1,208 @@
+"""
+SAGA.utils.geometry
+
+This file collects spherical geometry functions on plain arrays of RA and
+Dec (in degrees), used instead of SkyCoord in the build.
+"""
+import numpy as np
+
+__all__ = ['angular_separation', 'radec_to_xyz', 'separation_from_xyz', 'position_angle',
+           'host_projected_distance', 'search_around', 'cone_bounding_box',
+           'box_intersects_cone', 'healpix_ang2pix_nest']
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """
+    Angular separation (in degrees) between (ra1, dec1) and (ra2, dec2),
+    all in degrees. Inputs are broadcast against each other.
+    Uses the Vincenty formula, which is accurate at all separations.
+    """
+    ra1, dec1, ra2, dec2 = (np.deg2rad(np.asarray(x, dtype=np.float64)) for x in (ra1, dec1, ra2, dec2))
+    dra = ra2 - ra1
+    sin_dra, cos_dra = np.sin(dra), np.cos(dra)
+    sin_d1, cos_d1 = np.sin(dec1), np.cos(dec1)
+    sin_d2, cos_d2 = np.sin(dec2), np.cos(dec2)
+    num1 = cos_d2 * sin_dra
+    num2 = cos_d1 * sin_d2 - sin_d1 * cos_d2 * cos_dra
+    denominator = sin_d1 * sin_d2 + cos_d1 * cos_d2 * cos_dra
+    return np.rad2deg(np.arctan2(np.hypot(num1, num2), denominator))
+
+
+def radec_to_xyz(ra, dec):
+    """
+    Unit vectors (array of shape (..., 3)) of the positions (`ra`, `dec`), in degrees.
+    Precompute these to compute many separations from the same set of positions.
+    """
+    ra = np.deg2rad(np.asarray(ra, dtype=np.float64))
+    dec = np.deg2rad(np.asarray(dec, dtype=np.float64))
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def separation_from_xyz(xyz1, xyz2):
+    """
+    Angular separation (in degrees) between unit vectors (see `radec_to_xyz`).
+    Inputs are broadcast against each other.
+    """
+    xyz1 = np.asarray(xyz1)
+    xyz2 = np.asarray(xyz2)
+    cross = np.cross(xyz1, xyz2)
+    dot = np.sum(xyz1 * xyz2, axis=-1)
+    return np.rad2deg(np.arctan2(np.sqrt(np.sum(cross * cross, axis=-1)), dot))
+
+
+def position_angle(ra1, dec1, ra2, dec2):
+    """
+    Position angle (in degrees, East of North, in [0, 360)) of (ra2, dec2)
+    as seen from (ra1, dec1), all in degrees.
+    Same as `SkyCoord.position_angle`.
+    """
+    ra1, dec1, ra2, dec2 = (np.deg2rad(np.asarray(x, dtype=np.float64)) for x in (ra1, dec1, ra2, dec2))
+    dra = ra2 - ra1
+    x = np.sin(dra) * np.cos(dec2)
+    y = np.cos(dec1) * np.sin(dec2) - np.sin(dec1) * np.cos(dec2) * np.cos(dra)
+    return np.mod(np.rad2deg(np.arctan2(x, y)), 360.0)
+
+
+def host_projected_distance(ra, dec, host_ra, host_dec, host_dist):
+    """
+    Angular and projected distances of objects from a host.
+
+    Parameters
+    ----------
+    ra, dec : array_like
+        positions of the objects, in degrees
+    host_ra, host_dec : float
+        position of the host, in degrees
+    host_dist : float
+        distance to the host, in Mpc
+
+    Returns
+    -------
+    rhost_arcmin : numpy.ndarray
+        angular separations, in arcmin (RHOST_ARCM)
+    rhost_kpc : numpy.ndarray
+        projected distances `sin(separation) * host_dist`, in kpc (RHOST_KPC)
+    """
+    sep = angular_separation(ra, dec, host_ra, host_dec)
+    return sep * 60.0, np.sin(np.deg2rad(sep)) * (1000.0 * host_dist)
+
+
+def search_around(ra1, dec1, ra2, dec2, radius):
+    """
+    Find all pairs of positions in the two sets that are within `radius`.
+    Same as `astropy.coordinates.search_around_sky`, all in degrees.
+
+    Returns
+    -------
+    idx1, idx2 : numpy.ndarray
+        indices into the first and second set, sorted by idx1 then idx2
+    sep : numpy.ndarray
+        separations of the pairs, in degrees
+    """
+    from scipy.spatial import cKDTree
+
+    xyz1 = radec_to_xyz(ra1, dec1).reshape(-1, 3)
+    xyz2 = radec_to_xyz(ra2, dec2).reshape(-1, 3)
+    if not len(xyz1) or not len(xyz2):
+        empty = np.zeros(0, np.intp)
+        return empty, empty, np.zeros(0, np.float64)
+
+    # search with a slightly larger chord length, then apply the exact cut
+    chord = 2.0 * np.sin(np.deg2rad(min(radius, 180.0)) * 0.5) * (1.0 + 1e-8)
+    pairs = cKDTree(xyz1).query_ball_tree(cKDTree(xyz2), chord)
+    counts = np.fromiter((len(p) for p in pairs), np.intp, len(pairs))
+    idx1 = np.repeat(np.arange(len(pairs)), counts)
+    idx2 = np.fromiter((j for p in pairs for j in sorted(p)), np.intp, counts.sum())
+    sep = separation_from_xyz(xyz1[idx1], xyz2[idx2])
+    mask = sep <= radius
+    return idx1[mask], idx2[mask], sep[mask]
+
+
+def cone_bounding_box(ra, dec, radius):
+    """
+    Return (ra_min, ra_max, dec_min, dec_max) of a box (in degrees) that
+    contains the cone of `radius` around (`ra`, `dec`). ra_min/ra_max may
+    be outside [0, 360) when the box wraps around RA = 0.
+    """
+    dec_min, dec_max = dec - radius, dec + radius
+    if dec_max >= 90.0 or dec_min <= -90.0:
+        return 0.0, 360.0, max(dec_min, -90.0), min(dec_max, 90.0)
+    dra = np.rad2deg(np.arcsin(min(np.sin(np.deg2rad(radius)) / np.cos(np.deg2rad(dec)), 1.0)))
+    return ra - dra, ra + dra, dec_min, dec_max
+
+
+def box_intersects_cone(ra_min, ra_max, dec_min, dec_max, ra, dec, radius):
+    """
+    Return True if the box [ra_min, ra_max] x [dec_min, dec_max] (in degrees,
+    with 0 <= ra_min <= ra_max < 360) may intersect the cone of `radius`
+    around (`ra`, `dec`). Conservative: may return True for boxes that only
+    intersect the bounding box of the cone.
+    """
+    lo, hi, cone_dec_min, cone_dec_max = cone_bounding_box(ra, dec, radius)
+    if dec_max < cone_dec_min or dec_min > cone_dec_max:
+        return False
+    return any(lo + k <= ra_max and hi + k >= ra_min for k in (-360.0, 0.0, 360.0))
+
+
+def _spread_bits(v):
+    v = v.astype(np.int64)
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+
+def healpix_ang2pix_nest(order, ra, dec):
+    """
+    HEALPix pixel indices (nested scheme, nside = 2**order) of the positions
+    (`ra`, `dec`), in degrees.
+
+    Parameters
+    ----------
+    order : int
+        0 <= order <= 29
+    ra, dec : array_like
+
+    Returns
+    -------
+    pixels : numpy.ndarray of int64
+    """
+    order = int(order)
+    if not 0 <= order <= 29:
+        raise ValueError('`order` must be between 0 and 29')
+    nside = 1 << order
+    ra = np.asarray(ra, dtype=np.float64)
+    z = np.sin(np.deg2rad(np.asarray(dec, dtype=np.float64)))
+    za = np.abs(z)
+    tt = np.mod(ra / 90.0, 4.0)
+
+    ix = np.empty(z.shape, np.int64)
+    iy = np.empty(z.shape, np.int64)
+    face = np.empty(z.shape, np.int64)
+
+    eq = za <= 2.0/3.0
+    temp1 = nside * (0.5 + tt[eq])
+    temp2 = nside * (z[eq] * 0.75)
+    jp = (temp1 - temp2).astype(np.int64)
+    jm = (temp1 + temp2).astype(np.int64)
+    ifp = jp >> order
+    ifm = jm >> order
+    face[eq] = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix[eq] = jm & (nside - 1)
+    iy[eq] = nside - (jp & (nside - 1)) - 1
+
+    pol = ~eq
+    ntt = np.minimum(tt[pol].astype(np.int64), 3)
+    tp = tt[pol] - ntt
+    tmp = nside * np.sqrt(3.0 * (1.0 - za[pol]))
+    jp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm = np.minimum(((1.0 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z[pol] >= 0
+    face[pol] = np.where(north, ntt, ntt + 8)
+    ix[pol] = np.where(north, nside - jm - 1, jp)
+    iy[pol] = np.where(north, nside - jp - 1, jm)
+
+    return (face << (2 * order)) + _spread_bits(ix) + (_spread_bits(iy) << 1)
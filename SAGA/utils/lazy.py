@@ -0,0 +1,85 @@
+"""
+SAGA.utils.lazy
+
+This file collects functions to import modules and package attributes
+on first use.
+"""
+import importlib
+import threading
+
+__all__ = ['lazy_import', 'lazy_attributes']
+
+
+class _LazyModule(object):
+    """
+    A placeholder for a module that is imported on first attribute access.
+    A missing (optional) module only raises an ImportError when it is used.
+    """
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+        self._lazy_lock = threading.Lock()
+
+    def _load(self):
+        if self._lazy_module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(self._lazy_name)
+        return self._lazy_module
+
+    def __getattr__(self, name):
+        if name.startswith('_lazy_'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        return '<lazily imported module {!r}>'.format(self._lazy_name)
+
+
+def lazy_import(name):
+    """
+    Return a placeholder for module `name` that imports it on first use.
+
+    Examples
+    --------
+    >>> fits = lazy_import('astropy.io.fits')
+    >>> fits.open(path)  # astropy.io.fits is imported here
+    """
+    return _LazyModule(name)
+
+
+def lazy_attributes(package_name, attributes):
+    """
+    Return `__getattr__` and `__dir__` functions for a package `__init__`
+    (PEP 562), so that the exported names are imported on first access.
+
+    Parameters
+    ----------
+    package_name : str
+        `__name__` of the package
+    attributes : dict
+        exported name -> (relative module name, attribute name in that
+        module, or None for the module itself)
+
+    Examples
+    --------
+    >>> __getattr__, __dir__ = lazy_attributes(__name__, {'Database': ('.database', 'Database')})
+    """
+    def __getattr__(name):
+        try:
+            module_name, attr = attributes[name]
+        except KeyError:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(package_name, name))
+        value = importlib.import_module(module_name, package_name)
+        if attr is not None:
+            value = getattr(value, attr)
+        setattr(importlib.import_module(package_name), name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(importlib.import_module(package_name))).union(attributes))
+
+    return __getattr__, __dir__
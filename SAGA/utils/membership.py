@@ -0,0 +1,60 @@
+"""
+SAGA.utils.membership
+
+This file defines the IdSet class
+"""
+import numpy as np
+
+__all__ = ['IdSet']
+
+
+class IdSet(object):
+    """
+    A set of integer IDs stored as a sorted array. Membership tests and
+    lookups use a binary search (`np.searchsorted`), so the (sorted) set is
+    built once and each test costs O(n log m) without sorting the input.
+
+    Parameters
+    ----------
+    ids : array_like
+        IDs; masked values are ignored and duplicates are removed
+    assume_sorted_unique : bool, optional
+        If set to True, `ids` is used as is (it must be sorted and unique)
+
+    Examples
+    --------
+    >>> ids_to_remove = IdSet(objects_to_remove['SDSS ID'])
+    >>> mask = ids_to_remove.contains(base['OBJID'])
+    """
+    def __init__(self, ids, assume_sorted_unique=False):
+        ids = np.ma.asarray(ids)
+        ids = ids.compressed() if np.ma.is_masked(ids) else np.asarray(ids).ravel()
+        self.ids = ids if assume_sorted_unique else np.unique(ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, value):
+        return bool(self.contains([value])[0])
+
+    def index(self, values):
+        """
+        Return the position of each value in the sorted `ids`, or -1 for
+        values that are not in the set.
+        """
+        values = np.asarray(values)
+        if not len(self.ids):
+            return np.full(values.shape, -1, np.intp)
+        idx = np.searchsorted(self.ids, values)
+        idx[idx >= len(self.ids)] = 0
+        idx[self.ids[idx] != values] = -1
+        return idx
+
+    def contains(self, values):
+        """
+        Return a boolean array that is True where `values` is in the set
+        (same as `np.isin(values, ids)`).
+        """
+        return self.index(values) >= 0
+
+    __call__ = contains
@@ -0,0 +1,281 @@
+"""
+SAGA.utils.profiling
+
+This file defines the Profiler class, and the `profile_stage` and
+`instrument` hooks (no-ops unless a Profiler is active).
+"""
+import time
+import threading
+import functools
+import tracemalloc
+from collections import OrderedDict
+import numpy as np
+
+__all__ = ['Profiler', 'profile_stage', 'instrument', 'host_context']
+
+_active_profilers = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_stack(name):
+    stack = getattr(_local, name, None)
+    if stack is None:
+        stack = []
+        setattr(_local, name, stack)
+    return stack
+
+
+class _Stage(object):
+    """
+    Record of one stage. `rows_out` (and `rows_in`) can be set inside the
+    `with` block when they are only known after the work is done.
+
+    Memory is measured from tracemalloc snapshots at the start and end of
+    the stage: `peak_mem` is the rise of the traced memory peak during the
+    stage (or of the traced memory, if the peak did not rise).
+    """
+    __slots__ = ('name', 'host', 'rows_in', 'rows_out', 'wall_time', 'peak_mem', '_t0', '_mem0')
+
+    def __init__(self, name, host=None, rows_in=None):
+        self.name = name
+        self.host = host
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.wall_time = None
+        self.peak_mem = None
+
+    def __enter__(self):
+        if self.host is None:
+            hosts = _get_stack('hosts')
+            self.host = hosts[-1] if hosts else None
+        self._mem0 = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall_time = time.perf_counter() - self._t0
+        if self._mem0 is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak_mem = max((peak if peak > self._mem0[1] else current) - self._mem0[0], 0)
+        if exc_type is None:
+            with _lock:
+                profilers = list(_active_profilers)
+            for profiler in profilers:
+                profiler._record(self)
+
+
+class _NullStage(object):
+    __slots__ = ()
+    name = host = rows_in = rows_out = wall_time = peak_mem = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+_null_stage = _NullStage()
+
+
+def profile_stage(name, host=None, rows_in=None):
+    """
+    Context manager that records one stage to all active profilers.
+    Returns a no-op object if no profiler is active.
+
+    Parameters
+    ----------
+    name : str
+    host : int, optional
+        Default is the innermost `host_context`
+    rows_in : int, optional
+
+    Examples
+    --------
+    with profile_stage('cuts', rows_in=len(t)) as stage:
+        t = q.filter(t)
+        stage.rows_out = len(t)
+    """
+    if not _active_profilers:
+        return _null_stage
+    return _Stage(name, host, rows_in)
+
+
+class host_context(object):
+    """
+    Context manager that sets the host that stages inside the block belong to.
+
+    Examples
+    --------
+    with host_context(61945):
+        base = saga_database['base', 61945].read()
+    """
+    def __init__(self, host):
+        self.host = host
+
+    def __enter__(self):
+        _get_stack('hosts').append(self.host)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _get_stack('hosts').pop()
+
+
+def _len_or_none(obj):
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+
+def _host_of_table(table):
+    try:
+        return int(table['HOST_NSAID'][0])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def instrument(name=None):
+    """
+    Decorator that records each call of a function that takes a table as its
+    first argument. Rows in/out are the lengths of the first argument and of
+    the returned value. If no host context is set, the host is taken from
+    the HOST_NSAID column of the input table, if available, and is also used
+    for the stages nested in the call.
+
+    Examples
+    --------
+    @instrument('build.add_spectra')
+    def add_spectra(base, spectra):
+        ...
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _active_profilers:
+                return func(*args, **kwargs)
+            table = args[0] if args else None
+            hosts = _get_stack('hosts')
+            host = hosts[-1] if hosts else _host_of_table(table)
+            with host_context(host), _Stage(stage_name, host, _len_or_none(table)) as stage:
+                out = func(*args, **kwargs)
+                stage.rows_out = _len_or_none(out)
+            return out
+        return wrapper
+    return decorator
+
+
+class Profiler(object):
+    """
+    Collect wall time, rows in/out and peak memory for each instrumented
+    stage that runs while the profiler is active.
+
+    Parameters
+    ----------
+    trace_memory : bool, optional
+        If set to True, measure memory with tracemalloc (slower). Tracing
+        is started if it is not running, and stopped by the same profiler.
+    callbacks : list of callable, optional
+        Called with each finished stage record (a dict) as it is recorded.
+
+    Examples
+    --------
+    >>> with Profiler(callbacks=[print]) as prof:
+    ...     saga_objects.load(hosts='all')
+    >>> prof.report(by_host=True)
+    """
+    def __init__(self, trace_memory=False, callbacks=None):
+        self.trace_memory = trace_memory
+        self.callbacks = list(callbacks or [])
+        self.records = []
+        self._tracing = False
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        with _lock:
+            _active_profilers.append(self)
+        return self
+
+    def stop(self):
+        with _lock:
+            if self in _active_profilers:
+                _active_profilers.remove(self)
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _record(self, stage):
+        record = OrderedDict([
+            ('host', stage.host),
+            ('stage', stage.name),
+            ('wall_time', stage.wall_time),
+            ('rows_in', stage.rows_in),
+            ('rows_out', stage.rows_out),
+            ('peak_mem', stage.peak_mem),
+        ])
+        with _lock:
+            self.records.append(record)
+        for callback in self.callbacks:
+            callback(record)
+
+    def clear(self):
+        self.records = []
+
+    def report(self, by_host=False):
+        """
+        Summarize the recorded stages.
+
+        Parameters
+        ----------
+        by_host : bool, optional
+            If set to True, aggregate all stages of each host into one row.
+
+        Returns
+        -------
+        report : astropy.table.Table
+            with columns HOST, STAGE (not present when by_host=True), CALLS,
+            WALL_TIME (sum, in s), ROWS_IN, ROWS_OUT (sums) and PEAK_MEM (max, in bytes)
+        """
+        keys = ('host',) if by_host else ('host', 'stage')
+        summary = OrderedDict()
+        for r in self.records:
+            k = tuple(r[key] for key in keys)
+            s = summary.setdefault(k, {'calls': 0, 'wall_time': 0.0, 'rows_in': 0, 'rows_out': 0, 'peak_mem': 0})
+            s['calls'] += 1
+            s['wall_time'] += r['wall_time']
+            s['rows_in'] += r['rows_in'] or 0
+            s['rows_out'] += r['rows_out'] or 0
+            s['peak_mem'] = max(s['peak_mem'], r['peak_mem'] or 0)
+
+        from astropy.table import Table
+        out = Table()
+        out['HOST'] = np.array([-1 if k[0] is None else k[0] for k in summary], dtype=np.int64)
+        if not by_host:
+            out['STAGE'] = np.array([k[1] for k in summary], dtype=str)
+        for col in ('calls', 'wall_time', 'rows_in', 'rows_out', 'peak_mem'):
+            out[col.upper()] = np.array([s[col] for s in summary.values()])
+        return out
+
+    def to_dict(self):
+        """
+        Return a structured per-host report: a dict keyed by host ID
+        (None for stages not associated with a host), where each value is
+        the list of stage records of that host, in the order they ran.
+        """
+        out = OrderedDict()
+        for r in self.records:
+            out.setdefault(r['host'], []).append(OrderedDict((k, v) for k, v in r.items() if k != 'host'))
+        return out
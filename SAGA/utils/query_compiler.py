@@ -0,0 +1,124 @@
+"""
+SAGA.utils.query_compiler
+
+This file defines `compile_query`, which evaluates a composite easyquery
+Query as a single numexpr expression.
+"""
+import weakref
+import threading
+import numpy as np
+import numexpr as ne
+from easyquery import Query
+
+__all__ = ['compile_query', 'CompiledQuery']
+
+_operator_symbols = {'AND': '&', 'OR': '|', 'XOR': '^'}
+_compiled_cache = weakref.WeakKeyDictionary()
+_compiled_cache_lock = threading.Lock()
+
+
+def _structure_key(query):
+    # pylint: disable=protected-access
+    if query._operator is None:
+        return id(query._operands)
+    if query._operator == 'NOT':
+        return ('NOT', _structure_key(query._operands))
+    return (query._operator,) + tuple(_structure_key(op) for op in query._operands)
+
+
+class CompiledQuery(Query):
+    """
+    A Query whose mask is computed with one fused numexpr expression.
+    Use `compile_query` to create one.
+    """
+    # pylint: disable=protected-access
+    def __init__(self, *queries):
+        source = Query(*queries)
+        super(CompiledQuery, self).__init__()
+        # combining a compiled query with others gives a regular Query
+        self._query_class = Query
+        self._operator = source._operator
+        self._operands = source._operands
+        self._source = source
+        self._fallbacks = []
+        self._expression = self._compile(self._source)
+        self._variables = tuple(ne.necompiler.getExprNames(self._expression, {})[0])
+
+    def _compile(self, query):
+        if query._operator is None:
+            operand = query._operands
+            if operand is None:
+                return 'True'
+            if isinstance(operand, str):
+                return '({})'.format(operand)
+            self._fallbacks.append(query)
+            return 'saga_q{}'.format(len(self._fallbacks) - 1)
+
+        if query._operator == 'NOT':
+            return '(~{})'.format(self._compile(query._operands))
+
+        parts = [self._compile(op) for op in query._operands]
+        return '({})'.format(' {} '.format(_operator_symbols[query._operator]).join(parts))
+
+    @property
+    def expression(self):
+        """the fused numexpr expression"""
+        return self._expression
+
+    def mask(self, table):
+        local_dict = {}
+        for name in self._variables:
+            if name.startswith('saga_q'):
+                local_dict[name] = np.asarray(self._fallbacks[int(name[6:])].mask(table), dtype=bool)
+            else:
+                local_dict[name] = table[name]
+
+        out = ne.evaluate(self._expression, local_dict=local_dict, global_dict={})
+
+        if out.shape == ():
+            out = np.full(len(table), bool(out))
+        return out
+
+    def filter(self, table, column_slice=None):
+        if column_slice is not None:
+            return self._source.filter(table, column_slice)
+        if self._operator is None and self._operands is None:
+            return table
+        return table[self.mask(table)]
+
+    __call__ = filter
+
+    def count(self, table):
+        return np.count_nonzero(self.mask(table))
+
+
+def compile_query(query):
+    """
+    Return a CompiledQuery that evaluates `query` with a single numexpr
+    expression. The compiled form is cached per Query object, and is
+    recompiled if the structure of the query changes.
+
+    Parameters
+    ----------
+    query : easyquery.Query, str, tuple, or None
+
+    Returns
+    -------
+    compiled_query : CompiledQuery
+    """
+    if isinstance(query, CompiledQuery):
+        return query
+
+    if not isinstance(query, Query):
+        return CompiledQuery(query)
+
+    key = _structure_key(query)
+    with _compiled_cache_lock:
+        cached = _compiled_cache.get(query)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    compiled = CompiledQuery(query)
+    with _compiled_cache_lock:
+        _compiled_cache[query] = (key, compiled)
+    return compiled
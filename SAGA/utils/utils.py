@@ -1,19 +1,35 @@
 import os
+import io
 import sys
 import logging
 import gzip
+import queue
 import shutil
-import requests
+import tempfile
+import threading
+import collections
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future
 import numpy as np
-from easyquery import Query
-from astropy.coordinates import search_around_sky, SkyCoord
-from astropy.units import Quantity
+from .lazy import lazy_import
+from .profiling import profile_stage
+from .geometry import search_around
+
+# heavy dependencies are imported on first use
+requests = lazy_import('requests')
+units = lazy_import('astropy.units')
 
 SPEED_OF_LIGHT = 299792.458 # in km/s
 
+# read the umask once at import time; os.umask can only be read by setting it,
+# which would briefly change it for every other thread in the process
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
 
 def get_empty_str_array(array_length, string_length=48):
-    return np.chararray((array_length,), itemsize=string_length, unicode=False)
+    # np.chararray does not initialize its memory
+    return np.zeros(array_length, dtype='S{}'.format(string_length)).view(np.chararray)
 
 
 def get_logger(level='WARNING'):
@@ -27,8 +43,9 @@ def get_logger(level='WARNING'):
 
 
 def get_decals_viewer_image(ra, dec, pixscale=0.2, layer='sdssco', size=256, out=None):
-    url = 'http://legacysurvey.org/viewer-dev/jpeg-cutout/?ra={ra}&dec={dec}&pixscale={pixscale}&layer={layer}&size={size}'.format(**locals())
-    content = requests.get(url).content
+    # for many targets, use `CutoutFetcher.fetch_many` (concurrent and cached)
+    from .cutouts import get_default_fetcher
+    content = get_default_fetcher().fetch(ra, dec, pixscale, layer, size)
     if out is not None:
         if not out.lower().endswith('.jpg'):
             out += '.jpg'
@@ -37,11 +54,109 @@ def get_decals_viewer_image(ra, dec, pixscale=0.2, layer='sdssco', size=256, out
     return content
 
 
-def gzip_compress(path, out_path=None, delete_original=True):
+class _ParallelGzipWriter(io.BufferedIOBase):
+    """
+    A write-only file object that compresses fixed-size blocks in a thread
+    pool and writes them out, in order, as concatenated gzip members.
+    Concatenated members are valid gzip (RFC 1952), so the output can be read
+    by `gzip`, astropy, and any other standard gzip reader.
+    """
+    def __init__(self, fileobj, threads, block_size=(1 << 22), compresslevel=6):
+        super(_ParallelGzipWriter, self).__init__()
+        self._fileobj = fileobj
+        self._block_size = int(block_size)
+        self._compresslevel = compresslevel
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._pending = collections.deque()
+        self._max_pending = 2 * threads
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(gzip.compress, block, self._compresslevel))
+        while len(self._pending) > self._max_pending:
+            self._fileobj.write(self._pending.popleft().result())
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed file')
+        self._buffer.extend(data)
+        while len(self._buffer) >= self._block_size:
+            self._submit(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                del self._buffer[:]
+            while self._pending:
+                self._fileobj.write(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown()
+            super(_ParallelGzipWriter, self).close()
+
+
+@contextmanager
+def atomic_output_file(path, compress=False, threads=1, compresslevel=6):
+    """
+    Open a binary file object for writing to `path` atomically.
+    Data are written to a temporary file in the same directory, which is
+    renamed to `path` only after the block exits without error, so readers
+    never see a partially written file.
+
+    Parameters
+    ----------
+    path : str
+    compress : bool, optional
+        If set to True, gzip-compress the data as they are being written
+    threads : int, optional
+        Number of threads used for compression. If larger than 1, the data are
+        compressed in blocks that are written as concatenated gzip members.
+    compresslevel : int, optional
+
+    Examples
+    --------
+    with atomic_output_file('base_sql_nsa32.fits.gz', compress=True) as f:
+        table.write(f, format='fits')
+    """
+    path = os.path.abspath(path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix='.{}.'.format(os.path.basename(path)),
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f_raw:
+            if not compress:
+                yield f_raw
+            elif threads is not None and threads > 1:
+                with _ParallelGzipWriter(f_raw, threads, compresslevel=compresslevel) as f:
+                    yield f
+            else:
+                with gzip.GzipFile(filename='', mode='wb', fileobj=f_raw, compresslevel=compresslevel, mtime=0) as f:
+                    yield f
+            f_raw.flush()
+            os.fsync(f_raw.fileno())
+
+        # mkstemp creates files readable only by the owner; use the usual umask instead
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def gzip_compress(path, out_path=None, delete_original=True, threads=1):
     if out_path is None:
         out_path = path + '.gz'
 
-    with open(path, 'rb') as f_in, gzip.open(out_path, 'wb') as f_out:
+    with open(path, 'rb') as f_in, atomic_output_file(out_path, compress=True, threads=threads) as f_out:
         shutil.copyfileobj(f_in, f_out)
 
     if delete_original:
@@ -74,9 +189,12 @@ def join_table_by_coordinates(table, table_to_join,
     ra2 = table_to_join_ra_name
     dec2 = table_to_join_dec_name
 
-    idx1, idx2 = search_around_sky(SkyCoord(t1[ra1], t1[dec1], unit=unit),
-                                   SkyCoord(t1[ra1], t1[dec1], unit=unit),
-                                   Quantity(max_distance, unit=unit))[:2]
+    def to_deg(x):
+        return units.Quantity(x, unit=unit).to_value('deg')
+
+    idx1, idx2 = search_around(to_deg(t1[ra1]), to_deg(t1[dec1]),
+                               to_deg(t2[ra2]), to_deg(t2[dec2]),
+                               to_deg(max_distance))[:2]
 
     n_matched = len(idx1)
 
@@ -95,7 +213,7 @@ def join_table_by_coordinates(table, table_to_join,
 
         for c2 in columns_to_join:
             c1 = columns_to_rename.get(c2, c2)
-            if c1 not in t1:
+            if c1 not in t1.colnames:
                 t1[c1] = missing_value_dict.get(c1, missing_value)
             t1[c1][idx1] = t2[c2][idx2]
 
@@ -110,11 +228,250 @@ def fill_values_by_query(table, query, values_to_fill):
     fill_values_by_query(table, 'OBJID == 1237668367995568266',
                          {'SPEC_Z': 0.21068, 'TELNAME':'SDSS', 'MASKNAME':'SDSS'})
     """
-    mask = Query(query).mask(table)
-    n_matched = np.count_nonzero(mask)
+    from .query_compiler import compile_query
+    with profile_stage('fill_values_by_query', rows_in=len(table)) as stage:
+        mask = compile_query(query).mask(table)
+        n_matched = np.count_nonzero(mask)
+        stage.rows_out = n_matched
 
     if n_matched:
         for c, v in values_to_fill.items():
             table[c][mask] = v
 
     return n_matched
+
+
+def _grow(array, n_rows):
+    """resize `array` along the first axis, in place when possible"""
+    try:
+        array.resize((n_rows,) + array.shape[1:], refcheck=False)
+    except ValueError:
+        new = np.zeros((n_rows,) + array.shape[1:], array.dtype)
+        n = min(n_rows, len(array))
+        new[:n] = array[:n]
+        array = new
+    return array
+
+
+def concatenate_tables(tables, initial_rows=0):
+    """
+    Concatenate tables, like astropy's `vstack`, but without holding all
+    input tables at once. Each table is copied into preallocated output
+    columns that grow in amortized chunks, and is released before the next
+    one is read (e.g. when `tables` is a generator). Columns are promoted
+    to a common dtype as needed; as in `vstack`, a column that is missing
+    from some tables is masked in their rows.
+
+    Parameters
+    ----------
+    tables : iterable of astropy.table.Table
+    initial_rows : int, optional
+        number of rows to preallocate (e.g. an estimate of the output length)
+
+    Returns
+    -------
+    table : astropy.table.Table
+    """
+    from astropy.table import Table
+    tables = iter(tables)
+    t = next(tables, None)
+    if t is None:
+        return Table()
+
+    # zero-length copies, so that the template does not keep the first table alive
+    template = t[:0].copy()
+    data = collections.OrderedDict()
+    masks = dict()
+    capacity = 0
+    n = 0
+
+    while t is not None:
+        for name in t.colnames:
+            if name not in template.colnames:
+                template[name] = t[name][:0].copy()
+
+        n_new = n + len(t)
+        if n_new > capacity:
+            capacity = max(n_new, int(capacity * 1.5), initial_rows)
+            for name in data:
+                data[name] = _grow(data[name], capacity)
+                if name in masks:
+                    masks[name] = _grow(masks[name], capacity)
+
+        _copy_rows(t, template.colnames, data, masks, capacity, n, n_new)
+        n = n_new
+        del t
+        t = next(tables, None)
+
+    return _build_table(template, data, masks, n)
+
+
+def _copy_rows(table, colnames, data, masks, capacity, start, end):
+    for name in colnames:
+        if name not in table.colnames:
+            if name not in masks:
+                masks[name] = np.zeros(data[name].shape, bool)
+            masks[name][start:end] = True
+            continue
+
+        col = table[name]
+        values = np.ma.getdata(col)
+        if name not in data:
+            data[name] = np.zeros((capacity,) + values.shape[1:], values.dtype)
+            if start:  # the column is missing from the previous tables
+                masks[name] = np.zeros(data[name].shape, bool)
+                masks[name][:start] = True
+        elif values.dtype != data[name].dtype:
+            dtype = np.promote_types(data[name].dtype, values.dtype)
+            if dtype != data[name].dtype:
+                data[name] = data[name].astype(dtype)
+        data[name][start:end] = values
+
+        mask = getattr(col, 'mask', None)
+        if mask is not None and name not in masks:
+            masks[name] = np.zeros(data[name].shape, bool)
+        if name in masks:
+            masks[name][start:end] = False if mask is None else mask
+
+
+def _build_table(template, data, masks, n_rows):
+    from astropy.table import Table, Column, MaskedColumn
+    out = Table(meta=template.meta)
+    for name in template.colnames:
+        info = template[name]
+        values = _grow(data[name], n_rows) if name in data else np.zeros((n_rows,) + info.shape[1:], info.dtype)
+        kwargs = dict(name=name, unit=info.unit, description=info.description, format=info.format, meta=info.meta, copy=False)
+        if name in masks:
+            out[name] = MaskedColumn(values, mask=_grow(masks[name], n_rows), **kwargs)
+        else:
+            out[name] = Column(values, **kwargs)
+    return out
+
+
+def _acquire_unless_stopped(semaphore, stop_event):
+    while not stop_event.is_set():
+        if semaphore.acquire(timeout=0.1):
+            return True
+    return False
+
+
+def _prefetch_generator(func, items, depth):
+    # a result takes a slot from when it starts being computed until the
+    # consumer asks for the next one, so that at most `depth` results exist
+    # besides the one the consumer holds
+    q = queue.Queue()
+    slots = threading.Semaphore(depth)
+    stop_event = threading.Event()
+    done = object()
+
+    def worker():
+        try:
+            for item in items:
+                if not _acquire_unless_stopped(slots, stop_event):
+                    return
+                try:
+                    result = (True, func(item))
+                except BaseException as e: # pylint: disable=broad-except
+                    q.put((False, e))
+                    return
+                q.put(result)
+                del result
+        finally:
+            q.put(done)
+
+    thread = threading.Thread(target=worker, name='saga-prefetch')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            result = q.get()
+            if result is done:
+                return
+            ok, value = result
+            del result
+            if not ok:
+                raise value
+            yield value
+            del value
+            slots.release()
+    finally:
+        stop_event.set()
+        thread.join()
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                break
+
+
+def prefetch(func, items, depth=1):
+    """
+    Return an iterator over `func(item)` for each item in `items`.
+    If `depth` > 0, the results are computed in a background thread, up to
+    `depth` items ahead of the consumer, so that (I/O-bound) work on the next
+    items overlaps with the work the consumer does on the current one. At
+    most `depth` + 1 results are alive at once (including the one the
+    consumer holds, until it asks for the next one).
+
+    Exceptions raised by `func` are re-raised by the iterator. Closing the
+    iterator early (or letting it be garbage collected) stops the
+    background thread once the item it is working on is done.
+
+    Parameters
+    ----------
+    func : callable
+    items : iterable
+    depth : int, optional
+        maximal number of results that are computed ahead (default: 1)
+
+    Returns
+    -------
+    iterator
+    """
+    if depth < 1:
+        return (func(item) for item in items)
+    return _prefetch_generator(func, items, int(depth))
+
+
+class SingleFlight(object):
+    """
+    Run at most one call per key at a time: callers that ask for a key
+    while a call for it is in progress wait for that call and share its
+    result (or its exception) instead of starting another one.
+
+    Examples
+    --------
+    >>> loads = SingleFlight()
+    >>> table, shared = loads.do(path, lambda: Table.read(path))
+    >>> if shared:
+    ...     table = table.copy()
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict()
+
+    def do(self, key, func):
+        """
+        Return (result of `func()`, shared), where `shared` is True if the
+        result came from a call started by another thread.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
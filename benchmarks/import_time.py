@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Check the startup cost of `import SAGA` (import-time regression benchmark).
+
+Each statement is run in a fresh interpreter; the best wall time of
+`--repeat` runs is reported, together with the heavy modules that were
+imported. The exit status is non-zero if a statement is slower than
+`--max-time` or imports one of the `--forbid` modules, so that this script
+can be used as a check in CI.
+
+Examples
+--------
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --max-time 0.5 --forbid astropy scipy
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+_repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_statements = [
+    'import SAGA',
+    'import SAGA; SAGA.Database()',
+    'import SAGA; SAGA.ObjectCatalog',
+]
+
+_heavy_modules = ('astropy', 'scipy', 'requests', 'numexpr', 'easyquery', 'casjobs')
+
+_script = '''
+import sys, time, json
+t0 = time.perf_counter()
+exec({statement!r})
+t = time.perf_counter() - t0
+print(json.dumps({{'time': t, 'modules': sorted({{m.split('.')[0] for m in sys.modules}})}}))
+'''
+
+
+def time_statement(statement, repeat=5):
+    """
+    Return (best wall time in s, heavy modules imported) of running
+    `statement` in a fresh interpreter.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([_repo_dir] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    best = None
+    modules = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', _script.format(statement=statement)], env=env)
+        result = json.loads(out.decode().strip().splitlines()[-1])
+        if best is None or result['time'] < best:
+            best = result['time']
+        modules = [m for m in result['modules'] if m in _heavy_modules]
+    return best, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-time', type=float, default=None, help='fail if a statement takes longer (in s)')
+    parser.add_argument('--forbid', nargs='*', default=['astropy', 'scipy', 'requests', 'casjobs'],
+                        help='fail if `import SAGA` or `SAGA.Database()` imports these modules')
+    args = parser.parse_args()
+
+    failed = False
+    for statement in _statements:
+        t, modules = time_statement(statement, args.repeat)
+        print('{:<36} {:8.4f} s   heavy modules: {}'.format(statement, t, ', '.join(modules) or '-'))
+        if args.max_time is not None and t > args.max_time:
+            print('  FAILED: slower than {} s'.format(args.max_time))
+            failed = True
+        if 'ObjectCatalog' not in statement:
+            forbidden = sorted(set(modules).intersection(args.forbid))
+            if forbidden:
+                print('  FAILED: imports {}'.format(', '.join(forbidden)))
+                failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+Benchmark the hot paths of the SAGA package on synthetic catalogs.
+
+Each stage is timed for several catalog sizes; the best wall time of
+`--repeat` runs is reported together with the throughput (rows per second)
+and the peak memory allocated during one extra run (measured with
+tracemalloc). Results are saved as JSON so that they can be compared
+across commits.
+
+Examples
+--------
+    python benchmarks/run_benchmarks.py --sizes 1000 5000 20000
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/abc1234.json
+"""
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+import astropy
+
+import SAGA
+from SAGA import ObjectCuts as C
+
+from synthetic import write_local_database, make_local_database, generate_wise
+
+_results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def _get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _stages(saga_database, extras):
+    """
+    Return an ordered dict of stage name -> (setup, func).
+    `setup()` returns the arguments of `func`, and is not timed.
+    `func(*args)` returns the number of input rows processed.
+    """
+    from SAGA.objects import build
+    saga_objects = SAGA.ObjectCatalog(saga_database)
+    host_ids = list(extras['hosts']['NSAID'])
+    first_host = host_ids[0]
+    n_base_rows = sum(len(saga_database['base', host].read()) for host in host_ids)
+    n_spectra_rows = len(saga_database['spectra_clean'].read())
+
+    def _base_copy():
+        return (saga_database['base', first_host].read().copy(),)
+
+    def load_all_hosts():
+        saga_objects.load(hosts='all', cuts=C.basic_cut)
+        return n_base_rows
+
+    def load_has_spec():
+        saga_objects.load(has_spec=True, cuts=C.basic_cut)
+        return n_spectra_rows
+
+    def add_spectra(base):
+        spectra = extras['spectra']
+        build.add_spectra(base, spectra[spectra['HOST_NSAID'] == first_host])
+        return len(base)
+
+    def add_more_photometric_data(base):
+        build.add_more_photometric_data(base, generate_wise(base))
+        return len(base)
+
+    def set_remove_flag(base):
+        build.set_remove_flag(base, saga_database['objects_to_remove'].read(), saga_database['objects_to_add'].read())
+        return len(base)
+
+    def fix_photometry_with_nsa(base):
+        build.fix_photometry_with_nsa(base, extras['nsa'])
+        return len(base)
+
+    def find_satelites(base):
+        build.find_satelites(base)
+        return len(base)
+
+    def calc_satellite_probability(base):
+        from SAGA.targets.gmm import calc_satellite_probability as _calc
+        _calc(base, extras['gmm_model_para'])
+        return len(base)
+
+    def _colored_base():
+        return (saga_objects.load(hosts=first_host),)
+
+    return OrderedDict([
+        ('ObjectCatalog.load(all)', (tuple, load_all_hosts)),
+        ('ObjectCatalog.load(has_spec)', (tuple, load_has_spec)),
+        ('add_more_photometric_data', (_base_copy, add_more_photometric_data)),
+        ('set_remove_flag', (_base_copy, set_remove_flag)),
+        ('fix_photometry_with_nsa', (_base_copy, fix_photometry_with_nsa)),
+        ('add_spectra', (_base_copy, add_spectra)),
+        ('find_satelites', (_base_copy, find_satelites)),
+        # SAGA.spectra.clean_repeats is not benchmarked: it is unfinished
+        # (it uses objects_nearby, which is not defined) and always fails
+        ('calc_satellite_probability', (_colored_base, calc_satellite_probability)),
+    ])
+
+
+def _run_stage(setup, func, repeat):
+    best = np.inf
+    rows = 0
+    for _ in range(repeat):
+        args = setup()
+        gc.collect()
+        t0 = time.perf_counter()
+        rows = func(*args)
+        best = min(best, time.perf_counter() - t0)
+        del args
+
+    args = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return OrderedDict([
+        ('rows', int(rows)),
+        ('time_s', best),
+        ('rows_per_s', rows / best if best > 0 else None),
+        ('peak_mem_mb', peak / 1024.0**2),
+    ])
+
+
+def run(sizes, n_hosts=4, repeat=3, stages=None, seed=0, verbose=True):
+    """
+    Run all (or the selected) stages for each size in `sizes`
+    (number of objects per host field).
+
+    Returns
+    -------
+    results : list of dict
+    """
+    results = []
+    for size in sizes:
+        root_dir = tempfile.mkdtemp(prefix='saga_bench_')
+        try:
+            extras = write_local_database(root_dir, n_hosts=n_hosts, n_objects=size, seed=seed)
+            saga_database = make_local_database(root_dir)
+            for name, (setup, func) in _stages(saga_database, extras).items():
+                if stages and name not in stages:
+                    continue
+                entry = OrderedDict([('stage', name), ('size', size)])
+                try:
+                    entry.update(_run_stage(setup, func, repeat))
+                except Exception as e: # pylint: disable=broad-except
+                    entry['error'] = '{}: {}'.format(type(e).__name__, e)
+                results.append(entry)
+                if verbose:
+                    _print_entry(entry)
+        finally:
+            shutil.rmtree(root_dir, ignore_errors=True)
+    return results
+
+
+def _print_entry(entry):
+    if 'error' in entry:
+        print('{stage:<32} {size:>8}  ERROR {error}'.format(**entry))
+    else:
+        print('{stage:<32} {size:>8} {rows:>9} rows {time_s:>9.4f} s {rows_per_s:>12.0f} rows/s {peak_mem_mb:>9.1f} MB'.format(**entry))
+    sys.stdout.flush()
+
+
+def compare(results, reference):
+    """
+    Print the ratio of wall times (current / reference) for matching stages and sizes.
+    """
+    ref = {(r['stage'], r['size']): r for r in reference['results']}
+    print('\n{:<32} {:>8} {:>10} {:>10} {:>8}'.format('stage', 'size', 'ref (s)', 'now (s)', 'ratio'))
+    for r in results:
+        r0 = ref.get((r['stage'], r['size']))
+        if r0 is None or 'time_s' not in r or 'time_s' not in r0:
+            continue
+        print('{:<32} {:>8} {:>10.4f} {:>10.4f} {:>8.2f}'.format(r['stage'], r['size'], r0['time_s'], r['time_s'], r['time_s']/r0['time_s']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 3000, 10000], help='number of objects per host field')
+    parser.add_argument('--hosts', type=int, default=4, help='number of hosts')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', nargs='+', help='only run these stages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', help='name of the output file (default: current git commit)')
+    parser.add_argument('--output-dir', default=_results_dir)
+    parser.add_argument('--compare', help='path to a previous result file to compare with')
+    args = parser.parse_args()
+
+    reference = None
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+
+    results = run(args.sizes, args.hosts, args.repeat, args.stages, args.seed)
+
+    commit = _get_commit()
+    output = OrderedDict([
+        ('label', args.label or commit),
+        ('commit', commit),
+        ('timestamp', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('astropy', astropy.__version__),
+        ('saga', SAGA.__version__),
+        ('n_hosts', args.hosts),
+        ('results', results),
+    ])
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    path = os.path.join(args.output_dir, '{}.json'.format(output['label']))
+    with open(path, 'w') as f:
+        json.dump(output, f, indent=2)
+    print('\nresults saved to {}'.format(path))
+
+    if reference is not None:
+        compare(results, reference)
+
+
+if __name__ == '__main__':
+    main()
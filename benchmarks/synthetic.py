@@ -0,0 +1,349 @@
+"""
+Synthetic SAGA catalogs for benchmarking.
+
+This file generates host lists, base catalogs, a clean spectra catalog,
+NSA and WISE catalogs, remove/add lists and GMM model parameters that look
+like the real ones (same column names, types and rough distributions),
+and writes them to a local directory that can be used with `SAGA.Database`
+without network access.
+
+Examples
+--------
+>>> from synthetic import write_local_database, make_local_database
+>>> extras = write_local_database('/tmp/saga_bench', n_hosts=4, n_objects=10000)
+>>> saga_database = make_local_database('/tmp/saga_bench')
+>>> saga_objects = SAGA.ObjectCatalog(saga_database)
+"""
+import os
+import numpy as np
+from astropy.table import Table, MaskedColumn, vstack
+
+import SAGA
+from SAGA.database import FitsTable
+
+__all__ = ['generate_hosts', 'generate_base', 'generate_spectra', 'generate_nsa',
+           'generate_wise', 'generate_remove_add_lists', 'generate_gmm_model_parameters',
+           'write_local_database', 'make_local_database']
+
+_bands = 'ugriz'
+_field_radius = 1.0 # deg
+_objid_offset = 1237600000000000000
+
+
+def _random_points_in_cap(rng, ra, dec, radius, n):
+    """uniform random points within `radius` deg of (ra, dec)"""
+    cos_r = np.cos(np.deg2rad(radius))
+    z = rng.uniform(cos_r, 1.0, n)
+    phi = rng.uniform(0.0, 2.0*np.pi, n)
+    s = np.sqrt(1.0 - z*z)
+    # point around the north pole, then rotate to (ra, dec)
+    x, y = s*np.cos(phi), s*np.sin(phi)
+    theta = np.deg2rad(90.0 - dec)
+    x, z = x*np.cos(theta) + z*np.sin(theta), -x*np.sin(theta) + z*np.cos(theta)
+    ra_out = (np.rad2deg(np.arctan2(y, x)) + ra) % 360.0
+    dec_out = np.rad2deg(np.arcsin(np.clip(z, -1.0, 1.0)))
+    return ra_out, dec_out
+
+
+def _separation_deg(ra1, dec1, ra2, dec2):
+    ra1, dec1, ra2, dec2 = map(np.deg2rad, (ra1, dec1, ra2, dec2))
+    h = np.sin((dec2-dec1)/2.0)**2 + np.cos(dec1)*np.cos(dec2)*np.sin((ra2-ra1)/2.0)**2
+    return np.rad2deg(2.0*np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0))))
+
+
+def generate_hosts(n_hosts, overlap_fraction=0.25, seed=0):
+    """
+    Generate a host list. A fraction `overlap_fraction` of the hosts are
+    placed within one field radius of the previous host, so that their
+    fields overlap (as they do for some real SAGA hosts).
+
+    Returns
+    -------
+    hosts : astropy.table.Table
+    hosts_named : astropy.table.Table
+    """
+    rng = np.random.RandomState(seed)
+    ra = rng.uniform(120.0, 240.0, n_hosts)
+    dec = rng.uniform(0.0, 50.0, n_hosts)
+    for i in range(1, n_hosts):
+        if rng.rand() < overlap_fraction:
+            ra[i] = ra[i-1] + rng.uniform(0.3, 0.8)
+            dec[i] = dec[i-1] + rng.uniform(-0.3, 0.3)
+
+    nsaid = np.arange(n_hosts, dtype=np.int64) * 1000 + 1000
+    distance = rng.uniform(20.0, 40.0, n_hosts)
+    hosts = Table({
+        'NSAID': nsaid,
+        'RA': ra,
+        'Dec': dec,
+        'distance': distance,
+        'vhelio': distance * 70.0,
+        'M_K': rng.uniform(-24.6, -23.0, n_hosts),
+        'M_r': rng.uniform(-22.0, -20.5, n_hosts),
+        'M_g': rng.uniform(-21.5, -20.0, n_hosts),
+    }, names=('NSAID', 'RA', 'Dec', 'distance', 'vhelio', 'M_K', 'M_r', 'M_g'))
+
+    hosts_named = Table({
+        'SAGA': np.array(['Host{}'.format(i) for i in range(n_hosts)]),
+        'NSA': nsaid,
+        'NGC': np.array(['NGC{}'.format(1000+i) for i in range(n_hosts)]),
+    }, names=('SAGA', 'NSA', 'NGC'))
+
+    return hosts, hosts_named
+
+
+def _generate_objects(rng, ra, dec, n_objects, objid_start):
+    n = n_objects
+    ra, dec = _random_points_in_cap(rng, ra, dec, _field_radius, n)
+    t = Table()
+    t['OBJID'] = np.arange(objid_start, objid_start + n, dtype=np.int64) + _objid_offset
+    t['RA'] = ra
+    t['DEC'] = dec
+    t['PHOTPTYPE'] = np.where(rng.rand(n) < 0.6, 3, 6).astype(np.int16)
+    t['PHOT_SG'] = np.where(t['PHOTPTYPE'] == 3, 'GALAXY', 'STAR').astype('S6')
+
+    r = 23.5 - rng.exponential(1.5, n).clip(0, 9.5)
+    colors = {'ug': rng.normal(1.5, 0.4, n), 'gr': rng.normal(0.6, 0.25, n),
+              'ri': rng.normal(0.3, 0.15, n), 'iz': rng.normal(0.2, 0.15, n)}
+    mags = {'r': r}
+    mags['g'] = r + colors['gr']
+    mags['u'] = mags['g'] + colors['ug']
+    mags['i'] = r - colors['ri']
+    mags['z'] = mags['i'] - colors['iz']
+    for b in _bands:
+        t[b] = mags[b].astype(np.float32)
+        t['{}_err'.format(b)] = (0.01 * 10**(0.25*(mags[b]-17.0))).clip(0.005, 2.0).astype(np.float32)
+        t['EXTINCTION_{}'.format(b.upper())] = rng.uniform(0.0, 0.2, n).astype(np.float32)
+    for b in 'GRI':
+        t['PETRORAD_{}'.format(b)] = rng.lognormal(1.0, 0.6, n).clip(1.5, None).astype(np.float32)
+        t['PETRORADERR_{}'.format(b)] = rng.lognormal(-1.0, 0.5, n).astype(np.float32)
+    t['SB_EXP_R'] = rng.normal(22.5, 1.5, n).astype(np.float32)
+    t['FIBERMAG_R'] = (r + rng.uniform(0.5, 1.5, n)).astype(np.float32)
+    for col, p in (('BINNED1', 0.98), ('SATURATED', 0.01), ('BAD_COUNTS_ERROR', 0.005)):
+        t[col] = np.where(rng.rand(n) < p, 1, 0).astype(np.int64)
+    return t
+
+
+def generate_base(hosts, n_objects, seed=0, build_columns=True):
+    """
+    Generate one base catalog per host. Objects are drawn per host field,
+    and every host receives all objects within its field, so overlapping
+    fields share objects (and OBJIDs).
+
+    Parameters
+    ----------
+    hosts : astropy.table.Table
+    n_objects : int
+        number of objects drawn per host field
+    build_columns : bool, optional
+        If set to True, also add the columns that the build step adds
+        (host info, REMOVE, spectra columns, SATS)
+
+    Returns
+    -------
+    bases : dict
+        base catalogs keyed by host NSAID
+    """
+    rng = np.random.RandomState(seed)
+    objects = vstack([_generate_objects(rng, h['RA'], h['Dec'], n_objects, i*n_objects) for i, h in enumerate(hosts)])
+
+    bases = dict()
+    for host in hosts:
+        sep = _separation_deg(objects['RA'], objects['DEC'], host['RA'], host['Dec'])
+        base = objects[sep < _field_radius]
+        if build_columns:
+            sep = _separation_deg(base['RA'], base['DEC'], host['RA'], host['Dec'])
+            n = len(base)
+            base['W1'] = rng.normal(16.0, 1.5, n).astype(np.float32)
+            base['W1ERR'] = rng.uniform(0.01, 0.2, n).astype(np.float32)
+            base['W2'] = base['W1'] - 0.2
+            base['W2ERR'] = base['W1ERR']
+            base['HOST_NSAID'] = host['NSAID']
+            base['HOST_RA'] = host['RA']
+            base['HOST_DEC'] = host['Dec']
+            base['HOST_DIST'] = host['distance']
+            base['HOST_VHOST'] = host['vhelio']
+            base['HOST_MK'] = host['M_K']
+            base['HOST_MR'] = host['M_r']
+            base['HOST_MG'] = host['M_g']
+            base['RHOST_ARCM'] = sep * 60.0
+            base['RHOST_KPC'] = np.sin(np.deg2rad(sep)) * (1000.0 * host['distance'])
+            base['HOST_SAGA_NAME'] = np.array(['Host{}'.format(host['NSAID'])] * n, dtype='S48')
+            base['HOST_NGC_NAME'] = np.zeros(n, dtype='S48')
+            base['REMOVE'] = np.where(rng.rand(n) < 0.9, -1, rng.randint(0, 6, n)).astype(np.int64)
+            has_spec = rng.rand(n) < 0.05
+            base['TELNAME'] = np.where(has_spec, 'MMT', '').astype('S6')
+            base['MASKNAME'] = np.where(has_spec, 'mask1', '').astype('S48')
+            base['ZQUALITY'] = np.where(has_spec, rng.randint(1, 5, n), -1).astype(np.int64)
+            z = np.where(rng.rand(n) < 0.1, host['vhelio']/SAGA.utils.SPEED_OF_LIGHT, rng.uniform(0.0, 0.3, n))
+            base['SPEC_Z'] = np.where(has_spec, z, -1.0)
+            base['SPEC_Z_ERR'] = np.where(has_spec, 1.0e-4, -1.0)
+            base['SPEC_REPEAT'] = np.where(has_spec, 'MMT', '').astype('S48')
+            base['SPECOBJID'] = np.where(has_spec, 'spec', '').astype('S48')
+            base['OBJ_NSAID'] = np.full(n, -1, dtype=np.int64)
+            base['SATS'] = np.where(has_spec, 0, -1).astype(np.int64)
+        bases[host['NSAID']] = base
+    return bases
+
+
+def generate_spectra(bases, fraction=0.05, seed=0):
+    """
+    Generate a spectra catalog by placing spectra at (slightly offset)
+    positions of a random subset of base objects.
+
+    Returns
+    -------
+    spectra : astropy.table.Table
+        in the format used as input of `SAGA.objects.build.add_spectra`
+    spectra_clean : astropy.table.Table
+        in the format of `saga_spectra_clean` (base columns of objects with spectra)
+    """
+    rng = np.random.RandomState(seed)
+    spectra = []
+    spectra_clean = []
+    for base in bases.values():
+        idx = np.flatnonzero(rng.rand(len(base)) < fraction)
+        n = len(idx)
+        s = Table()
+        s['RA'] = base['RA'][idx] + rng.normal(0.0, 0.3/3600.0, n)
+        s['DEC'] = base['DEC'][idx] + rng.normal(0.0, 0.3/3600.0, n)
+        s['SPEC_Z'] = rng.uniform(0.0, 0.3, n)
+        s['SPEC_Z_ERR'] = np.full(n, 1.0e-4)
+        s['ZQUALITY'] = rng.randint(1, 5, n).astype(np.int64)
+        s['TELNAME'] = rng.choice(['MMT', 'AAT', 'IMACS', 'SDSS'], n).astype('S6')
+        s['MASKNAME'] = np.array(['mask{}'.format(i % 50) for i in range(n)], dtype='S48')
+        s['SPEC_REPEAT'] = s['TELNAME'].astype('S48')
+        s['specobjid'] = np.array(['{}'.format(i) for i in range(n)], dtype='S48')
+        s['HOST_NSAID'] = base['HOST_NSAID'][idx] if 'HOST_NSAID' in base.colnames else -1
+        spectra.append(s)
+
+        if 'ZQUALITY' in base.colnames:
+            spectra_clean.append(base[base['ZQUALITY'] >= 0])
+
+    spectra = vstack(spectra)
+    spectra_clean = vstack(spectra_clean) if spectra_clean else None
+    return spectra, spectra_clean
+
+
+def generate_nsa(hosts, n_per_host=20, seed=0):
+    """
+    Generate a NSA catalog with `n_per_host` galaxies near each host.
+    """
+    rng = np.random.RandomState(seed)
+    out = []
+    for host in hosts:
+        n = n_per_host
+        ra, dec = _random_points_in_cap(rng, host['RA'], host['Dec'], _field_radius, n)
+        t = Table()
+        t['NSAID'] = host['NSAID'] * 1000 + np.arange(n, dtype=np.int64) + 1
+        t['RA'] = ra
+        t['DEC'] = dec
+        t['Z'] = rng.uniform(0.001, 0.05, n)
+        t['PETROTH90'] = rng.uniform(3.0, 30.0, n)
+        t['SERSIC_BA'] = rng.uniform(0.2, 1.0, n)
+        t['SERSIC_PHI'] = rng.uniform(0.0, 180.0, n)
+        t['HAEW'] = rng.uniform(0.0, 50.0, n)
+        t['HAEWERR'] = rng.uniform(0.1, 2.0, n)
+        t['ZSRC'] = np.array(['sdss'] * n, dtype='S8')
+        out.append(t)
+    return vstack(out)
+
+
+def generate_wise(base, fraction=0.7, seed=0):
+    """
+    Generate a WISE catalog matched to a fraction of `base` objects.
+    """
+    rng = np.random.RandomState(seed)
+    idx = np.flatnonzero(rng.rand(len(base)) < fraction)
+    n = len(idx)
+    t = Table()
+    t['RA'] = base['RA'][idx] + rng.normal(0.0, 0.2/3600.0, n)
+    t['DEC'] = base['DEC'][idx] + rng.normal(0.0, 0.2/3600.0, n)
+    t['W1_MAG'] = rng.normal(16.0, 1.5, n)
+    t['W1_MAG_ERR'] = rng.uniform(0.01, 0.2, n)
+    t['W2_MAG'] = t['W1_MAG'] - 0.2
+    t['W2_MAG_ERR'] = t['W1_MAG_ERR']
+    return t
+
+
+def generate_remove_add_lists(bases, n_remove=200, n_add=20, seed=0):
+    """
+    Generate the objects_to_remove and objects_to_add lists. As in the
+    Google Sheets, "SDSS ID" is a masked column with some blank entries.
+    """
+    rng = np.random.RandomState(seed)
+    objids = np.unique(np.concatenate([b['OBJID'] for b in bases.values()]))
+
+    def _make_list(n):
+        ids = rng.choice(objids, min(n, len(objids)), replace=False)
+        ids = np.concatenate([ids, [0]])
+        mask = np.zeros(len(ids), dtype=bool)
+        mask[-1] = True
+        return Table([MaskedColumn(ids, mask=mask, name='SDSS ID')])
+
+    return _make_list(n_remove), _make_list(n_add)
+
+
+def generate_gmm_model_parameters(n_components=8, seed=0):
+    """
+    Generate GMM model parameters in the format used by
+    `SAGA.targets.gmm.calc_satellite_probability`.
+    """
+    rng = np.random.RandomState(seed)
+    out = dict()
+    for label, offset in (('sat', 0.0), ('nosat', 0.3)):
+        xamp = rng.uniform(0.5, 1.0, n_components)
+        out['xamp_{}'.format(label)] = xamp / xamp.sum()
+        out['xmean_{}'.format(label)] = rng.normal([1.4+offset, 0.5+offset, 0.25, 0.15], 0.2, (n_components, 4))
+        a = rng.normal(0.0, 0.1, (n_components, 4, 4))
+        out['xcovar_{}'.format(label)] = np.einsum('nij,nkj->nik', a, a) + np.eye(4) * 0.01
+    return out
+
+
+def write_local_database(root_dir, n_hosts=4, n_objects=10000, seed=0):
+    """
+    Generate all synthetic catalogs and write them to `root_dir` with the
+    same layout as the SAGA Dropbox folder (plus local copies of the
+    Google Sheets tables in `root_dir/sheets`).
+
+    Returns
+    -------
+    extras : dict
+        tables that are not stored in the database (spectra, nsa, wise, gmm model)
+    """
+    for d in ('base_catalogs', 'data', 'sheets'):
+        if not os.path.isdir(os.path.join(root_dir, d)):
+            os.makedirs(os.path.join(root_dir, d))
+
+    hosts, hosts_named = generate_hosts(n_hosts, seed=seed)
+    bases = generate_base(hosts, n_objects, seed=seed)
+    spectra, spectra_clean = generate_spectra(bases, seed=seed)
+    objects_to_remove, objects_to_add = generate_remove_add_lists(bases, seed=seed)
+
+    for host_id, base in bases.items():
+        FitsTable(os.path.join(root_dir, 'base_catalogs', 'base_sql_nsa{}.fits.gz'.format(host_id))).write(base, overwrite=True)
+    FitsTable(os.path.join(root_dir, 'data', 'saga_spectra_clean.fits.gz')).write(spectra_clean, overwrite=True)
+
+    sheets = {'hosts_no_flags': hosts, 'hosts_no_sdss_flags': hosts, 'hosts_named': hosts_named,
+              'objects_to_remove': objects_to_remove, 'objects_to_add': objects_to_add}
+    for key, table in sheets.items():
+        FitsTable(os.path.join(root_dir, 'sheets', '{}.fits'.format(key)), compress_after_write=False).write(table, overwrite=True)
+
+    return {
+        'hosts': hosts,
+        'spectra': spectra,
+        'nsa': generate_nsa(hosts, seed=seed),
+        'gmm_model_para': generate_gmm_model_parameters(seed=seed),
+    }
+
+
+def make_local_database(root_dir):
+    """
+    Return a `SAGA.Database` that reads from the files written by
+    `write_local_database`, without accessing the network.
+    """
+    saga_database = SAGA.Database(root_dir)
+    for filename in os.listdir(os.path.join(root_dir, 'sheets')):
+        key = filename.rpartition('.fits')[0]
+        saga_database[key] = FitsTable(os.path.join(root_dir, 'sheets', filename))
+    return saga_database
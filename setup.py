@@ -24,9 +24,15 @@ setup(
         'Intended Audience :: Science/Research',
         'License :: OSI Approved :: MIT License',
         'Topic :: Scientific/Engineering :: Astronomy',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
     keywords='easyquery query numpy',
     packages=find_packages(),
+    python_requires='>=3.8',
     install_requires=['numpy', 'numexpr', 'astropy', 'easyquery', 'scipy', 'requests', 'casjobs'],
+    extras_require={'arrow': ['pyarrow']},
 )
@@ -0,0 +1,69 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'benchmarks'))
+
+
+@pytest.fixture
+def local_database(tmp_path):
+    """a SAGA.Database of synthetic catalogs (see benchmarks/synthetic.py), and the extra tables"""
+    from synthetic import write_local_database, make_local_database
+    extras = write_local_database(str(tmp_path), n_hosts=3, n_objects=2000)
+    return make_local_database(str(tmp_path)), extras
+
+
+@pytest.fixture(scope='session')
+def overlapping_inputs():
+    """raw (unbuilt) base catalogs of three hosts with overlapping fields, and the build inputs"""
+    from synthetic import generate_hosts, generate_base, generate_spectra, generate_nsa, generate_remove_add_lists
+    hosts, hosts_named = generate_hosts(3, overlap_fraction=1.0, seed=1)
+    raw = generate_base(hosts, 1500, seed=1, build_columns=False)
+    for base in raw.values():
+        base['OBJ_NSAID'] = -1
+    objects_to_remove, objects_to_add = generate_remove_add_lists(raw, seed=1)
+    return {
+        'hosts': hosts,
+        'hosts_named': hosts_named,
+        'raw': raw,
+        'spectra': generate_spectra(raw, seed=1)[0],
+        'nsa': generate_nsa(hosts, seed=1),
+        'objects_to_remove': objects_to_remove,
+        'objects_to_add': objects_to_add,
+    }
+
+
+def get_steps(inputs, host):
+    from SAGA.objects import build
+    return build.get_build_steps(host, nsa=inputs['nsa'], spectra=inputs['spectra'],
+                                 objects_to_remove=inputs['objects_to_remove'], objects_to_add=inputs['objects_to_add'])
+
+
+def write_built_database(root_dir, inputs, spectra=None):
+    """write the base catalogs of `inputs`, built with `spectra` (default: inputs['spectra']), and the host lists"""
+    from synthetic import make_local_database
+    from SAGA.database import FitsTable
+    from SAGA.objects import build
+    if spectra is not None:
+        inputs = dict(inputs, spectra=spectra)
+    for d in ('base_catalogs', 'data', 'sheets'):
+        os.makedirs(os.path.join(root_dir, d), exist_ok=True)
+    for host in inputs['hosts']:
+        base = build.run_build_steps(inputs['raw'][host['NSAID']].copy(), get_steps(inputs, host))
+        FitsTable(os.path.join(root_dir, 'base_catalogs', 'base_sql_nsa{}.fits.gz'.format(host['NSAID']))).write(base)
+    for key in ('hosts_no_flags', 'hosts_no_sdss_flags'):
+        FitsTable(os.path.join(root_dir, 'sheets', '{}.fits'.format(key)), compress_after_write=False).write(inputs['hosts'])
+    FitsTable(os.path.join(root_dir, 'sheets', 'hosts_named.fits'), compress_after_write=False).write(inputs['hosts_named'])
+    return make_local_database(root_dir)
+
+
+@pytest.fixture(scope='session')
+def overlapping_database(tmp_path_factory, overlapping_inputs):
+    """a SAGA.Database with the built base catalogs of `overlapping_inputs` (do not modify it)"""
+    return write_built_database(str(tmp_path_factory.mktemp('overlapping_database')), overlapping_inputs)
+
+
+@pytest.fixture
+def build_database():
+    """`write_built_database`, for tests that need a database they can modify"""
+    return write_built_database
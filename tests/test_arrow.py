@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from astropy.table import Table, MaskedColumn
+from SAGA import ObjectCatalog
+from SAGA.objects import cuts as C
+
+
+def _assert_same(t1, t2):
+    assert t1.colnames == t2.colnames
+    assert len(t1) == len(t2)
+    for c in t1.colnames:
+        assert t1[c].dtype == t2[c].dtype, c
+        mask = np.ma.getmaskarray(t1[c])
+        assert np.array_equal(mask, np.ma.getmaskarray(t2[c])), c
+        assert np.array_equal(np.ma.getdata(t1[c])[~mask], np.ma.getdata(t2[c])[~mask]), c
+
+
+def test_fits_tables_are_read_in_native_byte_order(local_database):
+    database, _ = local_database
+    host_id = ObjectCatalog(database)._hosts.resolve_id('all')[0]  # pylint: disable=protected-access
+    for t in (database['base', host_id].read(), database['base', host_id].read_rows([0, 5, 2])):
+        assert all(t[c].dtype.isnative for c in t.colnames)
+
+
+def test_arrow_roundtrip():
+    pytest.importorskip('pyarrow')
+    from SAGA.database import table_to_arrow, table_from_arrow
+    t = Table()
+    t['OBJID'] = np.arange(5, dtype=np.int64)
+    t['r_mag'] = MaskedColumn(np.linspace(17, 21, 5).astype('>f4'), mask=[0, 1, 0, 0, 1])
+    t['r_mag'].unit = 'mag'
+    t['TELNAME'] = np.array(['MMT', 'AAT', '', 'SDSS', 'MMT'], dtype='S6')
+    t['MASKNAME'] = np.array(['a', 'bb', 'ccc', '', 'a'])
+    t['REMOVE'] = np.array([True, False, False, True, False])
+    t['COEFFS'] = np.arange(10.0).reshape(5, 2)
+    t2 = table_from_arrow(table_to_arrow(t))
+    t['r_mag'] = t['r_mag'].astype('f4')
+    _assert_same(t, t2)
+    assert t2['r_mag'].unit == 'mag'
+
+
+def test_division_is_not_exact():
+    pytest.importorskip('pyarrow')
+    from easyquery import Query
+    from SAGA.database.arrow import _query_to_arrow
+    names = {'r_mag', 'g_mag', 'ZQUALITY'}
+    assert _query_to_arrow(Query('r_mag < 20'), names)[1]
+    assert not _query_to_arrow(Query('r_mag / g_mag < 1'), names)[1]
+    assert not _query_to_arrow(Query('ZQUALITY / 2 >= 1') & Query('r_mag < 20'), names)[1]
+    assert _query_to_arrow(~Query('ZQUALITY / 2 >= 1'), names) is None
+
+
+@pytest.mark.parametrize('cuts', [None, C.basic_cut, 'r_mag < 20', 'ZQUALITY / 2 >= 1', C.is_clean & 'r_mag / 2 < 10'])
+def test_parquet_load_same_as_fits(local_database, cuts):
+    pytest.importorskip('pyarrow')
+    database, _ = local_database
+    saga_objects = ObjectCatalog(database)
+    saga_objects.build_parquet_dataset()
+    columns = ['OBJID', 'RA', 'DEC', 'r_mag', 'ZQUALITY', 'TELNAME', 'REMOVE', 'HOST_NSAID']
+    for base, base_parquet in zip(saga_objects.load(hosts='all', cuts=cuts, columns=columns, iter_hosts=True),
+                                  saga_objects.load(hosts='all', cuts=cuts, columns=columns, iter_hosts=True,
+                                                    from_parquet=True)):
+        assert len(base)
+        _assert_same(base, base_parquet)
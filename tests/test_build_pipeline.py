@@ -0,0 +1,54 @@
+import functools
+import numpy as np
+from astropy.table import Table
+from SAGA.objects import BuildPipeline
+from conftest import get_steps
+
+
+def _failing(func):
+    @functools.wraps(func)
+    def wrapper(base, **kwargs):
+        raise RuntimeError('interrupted')
+    return wrapper
+
+
+def test_resume_from_checkpoint(tmp_path, overlapping_inputs):
+    hosts = overlapping_inputs['hosts'][:1]
+    host_id = int(hosts['NSAID'][0])
+    overlapping_inputs['raw'][host_id].write(str(tmp_path / 'sdss_nsa{}.fits'.format(host_id)))
+    sdss_path = str(tmp_path / 'sdss_nsa{}.fits')
+    steps = get_steps(overlapping_inputs, hosts[0])
+    k = len(steps) // 2
+    assert k
+
+    # the wrapper has the same key as the stage it replaces (see inspect.unwrap)
+    failing_steps = list(steps)
+    failing_steps[k] = (_failing(steps[k][0]), steps[k][1])
+    pipeline = BuildPipeline(str(tmp_path / 'checkpoints'))
+    failed = pipeline.build(hosts, lambda host: failing_steps, sdss_path, str(tmp_path / 'base_nsa{}.fits'))
+    assert list(failed) == [host_id]
+    assert pipeline.stages_run == k
+
+    pipeline = BuildPipeline(str(tmp_path / 'checkpoints'))
+    assert not pipeline.build(hosts, lambda host: steps, sdss_path, str(tmp_path / 'base_nsa{}.fits'))
+    assert pipeline.stages_reused == k
+    assert pipeline.stages_run == len(steps) - k
+
+    pipeline = BuildPipeline(str(tmp_path / 'checkpoints'))
+    pipeline.build(hosts, lambda host: steps, sdss_path, str(tmp_path / 'resumed_nsa{}.fits'))
+    assert pipeline.stages_reused == len(steps)
+    assert pipeline.stages_run == 0
+
+    pipeline = BuildPipeline(str(tmp_path / 'other_checkpoints'))
+    pipeline.build(hosts, lambda host: steps, sdss_path, str(tmp_path / 'expected_nsa{}.fits'))
+    assert pipeline.stages_run == len(steps)
+
+    expected = Table.read(str(tmp_path / 'expected_nsa{}.fits'.format(host_id)))
+    for name in ('base_nsa{}.fits', 'resumed_nsa{}.fits'):
+        out = Table.read(str(tmp_path / name.format(host_id)))
+        assert out.colnames == expected.colnames
+        assert len(out) == len(expected)
+        for c in out.colnames:
+            mask = np.ma.getmaskarray(expected[c])
+            assert np.array_equal(np.ma.getmaskarray(out[c]), mask), c
+            assert np.array_equal(np.ma.getdata(out[c])[~mask], np.ma.getdata(expected[c])[~mask]), c
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from astropy.table import Table
+from SAGA.objects import build, build_chunked
+from conftest import get_steps
+
+
+@pytest.mark.parametrize('output_name', ['base.fits', 'base.fits.gz'])
+def test_chunked_build_same_as_in_memory(tmp_path, overlapping_inputs, output_name):
+    host = overlapping_inputs['hosts'][0]
+    input_path = str(tmp_path / 'raw.fits')
+    overlapping_inputs['raw'][host['NSAID']].write(input_path)
+    steps = get_steps(overlapping_inputs, host)
+
+    expected_path = str(tmp_path / 'expected.fits')
+    build.run_build_steps(Table.read(input_path), steps).write(expected_path)
+    expected = Table.read(expected_path)
+    output_path = str(tmp_path / output_name)
+    n_chunks = build_chunked(input_path, output_path, steps, chunk_rows=400)
+    assert n_chunks > 2
+    out = Table.read(output_path)
+
+    assert out.colnames == expected.colnames
+    assert len(out) == len(expected)
+    for c in out.colnames:
+        mask = np.ma.getmaskarray(expected[c])
+        assert np.array_equal(np.ma.getmaskarray(out[c]), mask), c
+        assert np.array_equal(np.ma.getdata(out[c])[~mask], np.ma.getdata(expected[c])[~mask]), c
@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import requests
+from SAGA.utils import CutoutFetcher, get_decals_viewer_image
+from SAGA.utils import cutouts
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # ra=1 fails twice with 503, ra=2 is not found, dec=9 is slow; the body is the query
+    hits = None
+    lock = threading.Lock()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        with self.lock:
+            self.hits[self.path] = self.hits.get(self.path, 0) + 1
+            n = self.hits[self.path]
+        if 'ra=1.0000000&' in self.path and n < 3:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        if 'ra=2.0000000&' in self.path:
+            self.send_response(404)
+            self.end_headers()
+            return
+        time.sleep(1.0 if 'dec=9.0000000&' in self.path else 0.2)
+        body = self.path.partition('?')[2].encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def cutout_server():
+    hits = dict()
+    handler = type('Handler', (_Handler,), {'hits': hits})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/jpeg-cutout/'.format(server.server_port), hits
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_many_retries_and_caches(tmp_path, cutout_server):
+    url, hits = cutout_server
+    with CutoutFetcher(cache_dir=str(tmp_path), base_url=url, max_workers=8, backoff=0.01) as fetcher:
+        ra = [10.0 + 0.01*i for i in range(16)] + [1.0]
+        contents = fetcher.fetch_many(ra, 5.0)
+        assert contents[0] == b'ra=10.0000000&dec=5.0000000&pixscale=0.2&layer=sdssco&size=256'
+        assert contents[-1].startswith(b'ra=1.0000000&')
+        assert sum(hits.values()) == 16 + 3
+        assert os.path.isfile(fetcher.cache_path(ra[3], 5.0))
+
+        assert fetcher.fetch_many(ra, 5.0) == contents
+        assert sum(hits.values()) == 16 + 3
+
+
+def test_fetch_many_errors(cutout_server):
+    url, _ = cutout_server
+    with CutoutFetcher(base_url=url, max_retries=1, backoff=0.01) as fetcher:
+        with pytest.raises(requests.HTTPError):
+            fetcher.fetch(2.0, 0.0)
+        contents = fetcher.fetch_many([2.0, 3.0], 0.0, size=[64, 128], ignore_errors=True)
+        assert contents[0] is None
+        assert contents[1].endswith(b'&size=128')
+
+        # the error is raised without waiting for the running (slow) downloads
+        t0 = time.time()
+        with pytest.raises(requests.HTTPError):
+            fetcher.fetch_many([2.0, 3.0, 4.0], [0.0, 9.0, 9.0])
+        assert time.time() - t0 < 0.8
+
+
+def test_concurrent_requests_download_once(cutout_server):
+    url, hits = cutout_server
+    with CutoutFetcher(base_url=url, max_workers=8) as fetcher:
+        contents = fetcher.fetch_many([3.0] * 8, 4.0)
+    assert len(set(contents)) == 1
+    assert sum(hits.values()) == 1
+
+
+def test_get_decals_viewer_image(tmp_path, cutout_server, monkeypatch):
+    url, _ = cutout_server
+    monkeypatch.setattr(cutouts, '_default_fetcher', CutoutFetcher(base_url=url))
+    path = str(tmp_path / 'cutout')
+    content = get_decals_viewer_image(3.0, 4.0, size=64, out=path)
+    assert content.endswith(b'&size=64')
+    with open(path + '.jpg', 'rb') as f:
+        assert f.read() == content
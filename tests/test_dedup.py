@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from astropy.table import vstack
+from SAGA import ObjectCatalog
+from SAGA.objects import cuts as C, DedupCatalog
+
+
+def _assert_same_rows(t1, t2):
+    assert t1.colnames == t2.colnames
+    assert len(t1) == len(t2)
+    for c in t1.colnames:
+        assert np.array_equal(np.asarray(t1[c]), np.asarray(t2[c])), c
+
+
+def test_overlapping_hosts_have_different_flags(overlapping_database):
+    saga_objects = ObjectCatalog(overlapping_database)
+    bases = list(saga_objects.load(hosts='all', iter_hosts=True))
+    common = np.intersect1d(bases[0]['OBJID'], bases[1]['OBJID'])
+    assert len(common)
+    remove = [b['REMOVE'][np.isin(b['OBJID'], common)][np.argsort(b['OBJID'][np.isin(b['OBJID'], common)])]
+              for b in bases[:2]]
+    # the test below is only meaningful if REMOVE depends on the host
+    assert np.any(remove[0] != remove[1])
+
+
+@pytest.mark.parametrize('cuts', [None, C.is_clean, C.basic_cut, C.is_clean & C.sat_rcut])
+def test_view_same_as_stacked_load(overlapping_database, cuts):
+    saga_objects = ObjectCatalog(overlapping_database)
+    stacked = saga_objects.load(hosts='all', cuts=cuts)
+    dedup = saga_objects.load_dedup(hosts='all')
+    assert len(dedup.objects) < len(dedup.associations)
+    _assert_same_rows(dedup.view(stacked.colnames, cuts), stacked)
+
+
+def test_view_with_columns_and_hosts(overlapping_database):
+    saga_objects = ObjectCatalog(overlapping_database)
+    bases = list(saga_objects.load(hosts='all', iter_hosts=True))
+    dedup = DedupCatalog.from_tables(iter(bases))
+    host_id = int(bases[1]['HOST_NSAID'][0])
+    columns = ['OBJID', 'HOST_NSAID', 'REMOVE', 'r_mag', 'SATS']
+    _assert_same_rows(dedup.view(columns, C.is_clean, hosts=host_id), C.is_clean.filter(bases[1])[columns])
+    _assert_same_rows(dedup.view(columns), vstack(bases)[columns])
@@ -0,0 +1,51 @@
+import numpy as np
+from astropy.table import vstack
+from SAGA import ObjectCatalog
+from SAGA.objects.ingest import ingest_spectra, remove_repeated_spectra
+
+
+def _assert_same(t1, t2):
+    assert t1.colnames == t2.colnames
+    assert len(t1) == len(t2)
+    for c in t1.colnames:
+        mask = np.ma.getmaskarray(t1[c])
+        assert np.array_equal(mask, np.ma.getmaskarray(t2[c])), c
+        assert np.array_equal(np.ma.getdata(t1[c])[~mask], np.ma.getdata(t2[c])[~mask]), c
+
+
+def test_ingest_same_as_full_rebuild(tmp_path, overlapping_inputs, build_database):
+    spectra = overlapping_inputs['spectra']
+    is_new = np.random.RandomState(2).rand(len(spectra)) < 0.3
+    old_spectra, new_spectra = spectra[~is_new], spectra[is_new]
+
+    database = build_database(str(tmp_path / 'incremental'), overlapping_inputs, spectra=old_spectra)
+    database['spectra_store'].append(old_spectra, run='initial')
+    changed_rows = ingest_spectra(database, new_spectra, run='new')
+    assert set(changed_rows) == set(int(h) for h in overlapping_inputs['hosts']['NSAID'])
+    assert all(changed_rows.values())
+    assert len(database['spectra_store']) == len(spectra)
+
+    # add_spectra breaks ties by row order, so the rebuild sees the old spectra first
+    rebuilt = build_database(str(tmp_path / 'rebuilt'), overlapping_inputs, spectra=vstack([old_spectra, new_spectra]))
+    for base, expected in zip(ObjectCatalog(database).load(hosts='all', iter_hosts=True),
+                              ObjectCatalog(rebuilt).load(hosts='all', iter_hosts=True)):
+        _assert_same(base, expected)
+
+
+def test_remove_repeated_spectra(overlapping_inputs):
+    spectra = overlapping_inputs['spectra'][:100]
+    repeats = spectra[:10].copy()
+    repeats['RA'] += 0.1 / 3600.0
+    repeats['SPEC_Z'] += 10.0 / 3.0e5
+    assert len(remove_repeated_spectra(repeats, spectra)) == 0
+    assert len(remove_repeated_spectra(spectra, spectra[:0])) == len(spectra)
+
+    # the repeat with the lower ZQUALITY is removed
+    both = spectra[:1].copy()
+    both.add_row(repeats[0])
+    both['ZQUALITY'] = [1, 4]
+    assert list(remove_repeated_spectra(both)['ZQUALITY']) == [4]
+
+    # the same object from another telescope is not a repeat
+    repeats['TELNAME'] = np.where(repeats['TELNAME'] == b'AAT', b'MMT', b'AAT')
+    assert len(remove_repeated_spectra(repeats, spectra)) == len(repeats)
@@ -0,0 +1,54 @@
+import numpy as np
+from easyquery import Query
+from SAGA import ObjectCatalog
+from SAGA.objects.result_cache import canonical_query_key
+
+THRESHOLD = 20.0
+
+
+def _r_cut(table):
+    return table['r_mag'] < THRESHOLD
+
+
+class _IdList(object):
+    def __init__(self, ids):
+        self.ids = np.asarray(ids)
+
+    def contains(self, ids):
+        return np.isin(ids, self.ids)
+
+
+def test_key_of_plain_function_is_stable():
+    assert canonical_query_key(_r_cut) is not None
+    assert canonical_query_key(_r_cut) == canonical_query_key(_r_cut)
+    assert canonical_query_key((np.isfinite, 'r_mag')) == canonical_query_key((np.isfinite, 'r_mag'))
+    assert canonical_query_key(Query('r_mag < 20') & Query('g_mag < 21')) == \
+        canonical_query_key(Query('g_mag<21') & Query('r_mag<20'))
+
+
+def test_key_changes_with_globals():
+    global THRESHOLD  # pylint: disable=global-statement
+    key = canonical_query_key(_r_cut)
+    THRESHOLD = 21.0
+    try:
+        assert canonical_query_key(_r_cut) != key
+    finally:
+        THRESHOLD = 20.0
+
+
+def test_bound_methods_and_closures_have_no_key():
+    ids = np.arange(3)
+    assert canonical_query_key((_IdList([1]).contains, 'OBJID')) is None
+    assert canonical_query_key((lambda x: np.isin(x, ids), 'OBJID')) is None
+
+
+def test_cache_does_not_mix_bound_methods(local_database):
+    saga_database, extras = local_database
+    host = int(extras['hosts']['NSAID'][0])
+    objids = saga_database['base', host].read()['OBJID']
+
+    saga_objects = ObjectCatalog(saga_database, cache=True)
+    t1 = saga_objects.load(hosts=host, cuts=Query((_IdList(objids[:10]).contains, 'OBJID')))
+    t2 = saga_objects.load(hosts=host, cuts=Query((_IdList(objids[10:100]).contains, 'OBJID')))
+    assert len(t1) == 10
+    assert len(t2) == 90
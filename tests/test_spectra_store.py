@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from astropy.table import Table
+from SAGA.database import SpectraStore
+from SAGA.database.spectra_store import select_spectra
+
+
+def _make_spectra(n=500, seed=0):
+    rng = np.random.RandomState(seed)
+    t = Table()
+    t['RA'] = rng.uniform(10, 12, n)
+    t['DEC'] = rng.uniform(-1, 1, n)
+    t['SPEC_Z'] = rng.uniform(0, 0.1, n)
+    t['TELNAME'] = np.array(['AAT', 'MMT', 'SDSS'])[rng.randint(3, size=n)].astype('S6')
+    t['HOST_NSAID'] = np.array([1, 2, 3])[rng.randint(3, size=n)]
+    return t
+
+
+def _sorted(t):
+    return t[np.argsort(np.asarray(t['SPEC_Z']))]
+
+
+def test_store_reads_match_full_scan(tmp_path):
+    spectra = _make_spectra()
+    store = SpectraStore(str(tmp_path / 'store'), block_rows=16)
+    store.append(spectra[:300], run='run1')
+    store.append(spectra[300:], run='run2')
+    assert len(store) == len(spectra)
+    assert store.telescopes == ['AAT', 'MMT', 'SDSS']
+
+    for kwargs in (dict(telescope='MMT'), dict(hosts=[1, 3]), dict(ra=11.0, dec=0.0, radius=0.3),
+                   dict(telescope=['AAT'], hosts=2, ra=11.0, dec=0.0, radius=0.5)):
+        expected = _sorted(select_spectra(spectra, **kwargs))
+        t = _sorted(store.read(**kwargs))
+        assert np.array_equal(t['SPEC_Z'], expected['SPEC_Z']), kwargs
+
+
+def test_store_overwrite_is_atomic(tmp_path, monkeypatch):
+    spectra = _make_spectra()
+    store = SpectraStore(str(tmp_path / 'store'))
+    store.write(spectra)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(Table, 'write', fail)
+    with pytest.raises(RuntimeError):
+        store.write(spectra[:10], overwrite=True)
+    monkeypatch.undo()
+    assert len(store) == len(spectra)
+    assert len(store.read(telescope='SDSS', reload=True)) == np.count_nonzero(spectra['TELNAME'] == b'SDSS')
+
+    store.write(spectra[:10], overwrite=True)
+    assert len(store) == 10
+    assert len(store.read(reload=True)) == 10
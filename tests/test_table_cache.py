@@ -0,0 +1,56 @@
+import numpy as np
+from astropy.table import Table
+from SAGA.database import TableCache
+from SAGA.database.database import DataObject
+
+
+class _Source(DataObject):
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self.reads = 0
+        self.last = None
+
+    def _read(self, columns=None):
+        self.reads += 1
+        self.last = Table({'OBJID': np.arange(self.n_rows), 'r_mag': np.zeros(self.n_rows)})
+        return self.last if columns is None else self.last[list(columns)]
+
+    def get_version(self):
+        return 1
+
+
+def test_cached_tables_are_copied():
+    source = _Source(100)
+    source.attach_cache(TableCache(1 << 20), 'source')
+    t1 = source.read()
+    assert t1 is not source.last
+    t1['r_mag'][:] = 99.0
+    t2 = source.read()
+    assert source.reads == 1
+    assert np.all(t2['r_mag'] == 0)
+    assert np.array_equal(source.read(columns=['OBJID'])['OBJID'], np.arange(100))
+    assert source.reads == 1
+
+
+def test_tables_over_budget_are_not_copied():
+    source = _Source(1000)
+    cache = TableCache(1000)
+    source.attach_cache(cache, 'source')
+    t1 = source.read()
+    assert t1 is source.last
+    assert len(cache) == 0
+    t2 = source.read()
+    assert source.reads == 2
+    assert t2 is source.last
+
+
+def test_evicted_tables_are_not_copied():
+    cache = TableCache(17000)
+    large = _Source(1000)
+    large.attach_cache(cache, 'large')
+    large.read(keep=True)  # pinned
+    small = _Source(100)
+    small.attach_cache(cache, 'small')
+    # does not fit next to the pinned table, so it is evicted right away
+    assert small.read() is small.last
+    assert len(cache) == 1
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from astropy.table import vstack
+from SAGA.targets import TargetSelection
+
+
+def test_batch_same_as_single_hosts(local_database):
+    saga_database, extras = local_database
+    host_ids = [int(h) for h in extras['hosts']['NSAID']]
+    risa_objid = saga_database['base', host_ids[0]].read()['OBJID'][::50]
+    saga_targets = TargetSelection(saga_database, gmm_parameters=extras['gmm_model_para'], risa_objid=risa_objid)
+
+    batch = saga_targets.select_preliminary_targets_batch(host_ids, n_jobs=2, chunk_rows=500)
+    single = vstack([saga_targets.select_preliminary_targets(host_id) for host_id in host_ids])
+    assert len(batch) == len(single)
+    for c in ('OBJID', 'TARGETING_LABEL', 'TARGETING_SCORE'):
+        assert np.array_equal(batch[c], single[c]), c
+
+
+def test_missing_inputs(local_database):
+    saga_database, extras = local_database
+    saga_targets = TargetSelection(saga_database, gmm_parameters=extras['gmm_model_para'])
+    with pytest.raises(KeyError, match='risa_objid'):
+        saga_targets.select_preliminary_targets_batch()
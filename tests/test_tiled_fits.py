@@ -0,0 +1,56 @@
+import numpy as np
+from astropy.table import Table, MaskedColumn
+from SAGA.database import write_tiled_fits, read_tiled_fits, convert_to_tiled_fits
+
+
+def _make_table(n=1000):
+    rng = np.random.RandomState(0)
+    t = Table()
+    t['OBJID'] = np.arange(n, dtype=np.int64) + 1237648702966988800
+    t['RA'] = rng.uniform(0, 360, n)
+    t['r_mag'] = MaskedColumn(rng.uniform(14, 22, n).astype(np.float32), mask=rng.rand(n) < 0.1)
+    t['ZQUALITY'] = MaskedColumn(rng.randint(-1, 5, n).astype(np.int16), mask=rng.rand(n) < 0.2)
+    t['TELNAME'] = np.array(['SDSS', 'AAT', 'MMT', ''])[rng.randint(4, size=n)].astype('S6')
+    t['MASKNAME'] = np.array(['a', 'bb', 'ccc'])[rng.randint(3, size=n)]
+    t['REMOVE'] = rng.rand(n) < 0.5
+    return t
+
+
+def _assert_same(t1, t2):
+    assert t1.colnames == t2.colnames
+    for c in t1.colnames:
+        mask = np.ma.getmaskarray(t1[c])
+        assert np.array_equal(mask, np.ma.getmaskarray(t2[c])), c
+        data = np.ma.getdata(t1[c])
+        if data.dtype.kind == 'U':  # unicode strings are stored as bytes, as in fits tables
+            data = np.char.encode(data, 'ascii')
+        assert np.array_equal(data[~mask], np.ma.getdata(t2[c])[~mask]), c
+
+
+def test_tiled_fits_roundtrip(tmp_path):
+    t = _make_table()
+    path = str(tmp_path / 'base.fits.fz')
+    write_tiled_fits(t, path, tile_rows=128)
+    t2 = read_tiled_fits(path)
+    _assert_same(t, t2)
+    assert t2['TELNAME'].dtype == np.dtype('S6')
+    assert t2['MASKNAME'].dtype.kind == 'S'
+    assert t2['REMOVE'].dtype == bool
+    assert not hasattr(t2['RA'], 'mask')
+
+
+def test_tiled_fits_columns(tmp_path):
+    t = _make_table()
+    path = str(tmp_path / 'base.fits.fz')
+    write_tiled_fits(t, path)
+    t2 = read_tiled_fits(path, columns=['ZQUALITY', 'TELNAME'])
+    _assert_same(t[['ZQUALITY', 'TELNAME']], t2)
+
+
+def test_convert_to_tiled_fits(tmp_path):
+    t = _make_table(10)
+    path = str(tmp_path / 'base.fits')
+    t.write(path)
+    out_path = convert_to_tiled_fits(path)
+    assert out_path == path + '.fz'
+    _assert_same(Table.read(path), read_tiled_fits(out_path))
@@ -0,0 +1,134 @@
+import os
+import gzip
+import numpy as np
+import pytest
+from SAGA.utils import atomic_output_file, gzip_compress
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_atomic_output_file_gzip_roundtrip(tmp_path, threads):
+    data = np.random.RandomState(0).bytes(3 * (1 << 20) + 123)
+    path = str(tmp_path / 'out.fits.gz')
+    with atomic_output_file(path, compress=True, threads=threads) as f:
+        f.write(data[:1000])
+        f.write(data[1000:])
+    with gzip.open(path, 'rb') as f:
+        assert f.read() == data
+    assert os.listdir(str(tmp_path)) == ['out.fits.gz']
+
+
+def test_atomic_output_file_keeps_old_file_on_error(tmp_path):
+    path = str(tmp_path / 'out.fits')
+    with open(path, 'wb') as f:
+        f.write(b'old')
+    with pytest.raises(RuntimeError):
+        with atomic_output_file(path) as f:
+            f.write(b'new')
+            raise RuntimeError
+    with open(path, 'rb') as f:
+        assert f.read() == b'old'
+    assert os.listdir(str(tmp_path)) == ['out.fits']
+
+
+def test_gzip_compress(tmp_path):
+    path = str(tmp_path / 'table.fits')
+    with open(path, 'wb') as f:
+        f.write(b'SIMPLE' * 100000)
+    out_path = gzip_compress(path, threads=2)
+    assert out_path == path + '.gz'
+    assert not os.path.exists(path)
+    with gzip.open(out_path, 'rb') as f:
+        assert f.read() == b'SIMPLE' * 100000
+
+
+def _tables():
+    from astropy.table import Table, MaskedColumn
+    rng = np.random.RandomState(1)
+    t1 = Table({'OBJID': np.arange(5), 'r_mag': rng.rand(5).astype(np.float32), 'TELNAME': np.array([b'AAT'] * 5)})
+    t2 = Table({'OBJID': np.arange(5, 12), 'r_mag': MaskedColumn(rng.rand(7), mask=rng.rand(7) < 0.5),
+                'TELNAME': np.array([b'SDSS'] * 7)})
+    t3 = Table({'OBJID': np.arange(12, 15), 'SPEC_Z': rng.rand(3)})
+    return [t1, t2, t3]
+
+
+def test_concatenate_tables_same_as_vstack():
+    from astropy.table import vstack
+    from SAGA.utils import concatenate_tables
+    for tables in (_tables()[:2], _tables()):
+        expected = vstack(tables)
+        out = concatenate_tables(iter(tables), initial_rows=3)
+        assert out.colnames == expected.colnames
+        for c in out.colnames:
+            assert out[c].dtype == expected[c].dtype, c
+            mask = np.ma.getmaskarray(expected[c])
+            assert np.array_equal(np.ma.getmaskarray(out[c]), mask), c
+            assert np.array_equal(np.ma.getdata(out[c])[~mask], np.ma.getdata(expected[c])[~mask]), c
+
+
+def test_concatenate_tables_releases_each_table():
+    import gc
+    import weakref
+    from astropy.table import Table
+    from SAGA.utils import concatenate_tables
+    alive = []
+
+    def iter_tables():
+        previous = None
+        for i in range(4):
+            gc.collect()
+            alive.append(previous is not None and previous() is not None)
+            data = np.arange(i*10, (i+1)*10)
+            previous = weakref.ref(data)
+            yield Table({'OBJID': data}, copy=False)
+            del data
+
+    out = concatenate_tables(iter_tables())
+    assert np.array_equal(out['OBJID'], np.arange(40))
+    assert not any(alive)
+
+
+@pytest.mark.parametrize('depth', [1, 3])
+def test_prefetch_bounds_live_results(depth):
+    import time
+    import threading
+    from SAGA.utils import prefetch
+    lock = threading.Lock()
+    live = [0, 0]  # current, max
+
+    class Result(object):
+        def __init__(self, i):
+            self.i = i
+            with lock:
+                live[0] += 1
+                live[1] = max(live[1], live[0])
+
+        def __del__(self):
+            with lock:
+                live[0] -= 1
+
+    out = []
+    for result in prefetch(Result, range(20), depth):
+        time.sleep(0.002)
+        out.append(result.i)
+    del result
+    assert out == list(range(20))
+    assert live[1] <= depth + 1
+
+
+def test_prefetch_reraises_and_stops():
+    from SAGA.utils import prefetch
+
+    def func(i):
+        if i == 3:
+            raise KeyError(i)
+        return i
+
+    out = []
+    with pytest.raises(KeyError):
+        for i in prefetch(func, range(10), 2):
+            out.append(i)
+    assert out == [0, 1, 2]
+
+    it = prefetch(func, range(3), 2)
+    assert next(it) == 0
+    it.close()